@@ -0,0 +1,264 @@
+import numpy as np
+from environment.core import BluelockEnvironment
+from environment.vectorized import VectorizedBluelockEnvironment
+from environment.control import ControllerPipeline, Phase
+
+
+class EpisodeView(VectorizedBluelockEnvironment):
+    # one episode of a BatchedBluelockEnvironment, its arrays are slices of the batch's arrays
+    def __init__(
+        self,
+        batch: "BatchedBluelockEnvironment",
+        episode: int,
+        env: BluelockEnvironment,
+    ):
+        self.batch = batch
+        self.episode = episode
+        super().__init__((env.width, env.height), env.offense, env.defense, env.ball)
+
+    def allocate(self, player_count: int):
+        batch, episode = self.batch, self.episode
+        self.positions = batch.positions[episode]
+        self.rotations = batch.rotations[episode]
+        self.speeds = batch.speeds[episode]
+        self.top_speeds = batch.top_speeds[episode]
+        self.sizes = batch.sizes[episode]
+        self.teams = batch.teams[episode]
+        self.ball_position = batch.ball_positions[episode]
+        self.ball_speed = batch.ball_speeds[episode : episode + 1]
+        self.ball_direction = batch.ball_directions[episode : episode + 1]
+        self.possessor = batch.possessors[episode : episode + 1]
+
+    @property
+    def simulation_time(self):
+        return int(self.batch.simulation_time[self.episode])
+
+    @simulation_time.setter
+    def simulation_time(self, simulation_time: int):
+        self.batch.simulation_time[self.episode] = simulation_time
+
+    @property
+    def possession_changed_at(self):
+        return int(self.batch.possession_changed_at[self.episode])
+
+    @possession_changed_at.setter
+    def possession_changed_at(self, possession_changed_at: int):
+        self.batch.possession_changed_at[self.episode] = possession_changed_at
+
+
+class BatchedBluelockEnvironment:
+    """
+    Steps many episodes of the same roster layout in lockstep. State is held in
+    (episodes, players, ...) arrays and a single update advances every active episode
+    with vectorized operations; finished episodes are masked out and stop costing work.
+    Each episode is still reachable as a BluelockEnvironment through self.episodes so
+    per-episode controls keep working.
+    """
+
+    def __init__(self, envs: list[BluelockEnvironment]):
+        if len(envs) == 0:
+            raise ValueError("A batch needs at least one episode")
+        first = envs[0]
+        for env in envs:
+            if (env.width, env.height) != (first.width, first.height):
+                raise ValueError("All episodes of a batch must share dimensions")
+            if len(env.offense) != len(first.offense) or len(env.defense) != len(
+                first.defense
+            ):
+                raise ValueError("All episodes of a batch must share a roster layout")
+
+        self.width, self.height = first.width, first.height
+        self.offense_count = len(first.offense)
+        episode_count, player_count = len(envs), len(first.offense) + len(first.defense)
+        self.positions = np.zeros((episode_count, player_count, 2))
+        self.rotations = np.zeros((episode_count, player_count))
+        self.speeds = np.zeros((episode_count, player_count))
+        self.top_speeds = np.zeros((episode_count, player_count))
+        self.sizes = np.zeros((episode_count, player_count))
+        self.teams = np.zeros((episode_count, player_count), dtype=int)
+        self.ball_positions = np.zeros((episode_count, 2))
+        self.ball_speeds = np.zeros(episode_count)
+        self.ball_directions = np.zeros(episode_count)
+        self.possessors = np.full(episode_count, -1)
+        self.simulation_time = np.zeros(episode_count, dtype=int)
+        self.possession_changed_at = np.zeros(episode_count, dtype=int)
+        self.active = np.ones(episode_count, dtype=bool)
+        # batched controllers, the episodes' own pipelines are not run by the batch
+        self.controllers = ControllerPipeline()
+
+        self.episodes = [
+            EpisodeView(self, episode, env) for episode, env in enumerate(envs)
+        ]
+        self.ball_sizes = np.array(
+            [env.ball.size for env in self.episodes], dtype=float
+        )
+        self.ball_frictions = np.array([env.ball.friction for env in self.episodes])
+        self.reach = self.sizes + self.ball_sizes[:, None]
+        self.lower_bounds = np.repeat(self.sizes[..., None], 2, axis=2)
+        self.upper_bounds = np.array([self.width, self.height]) - self.lower_bounds
+
+    def get_slot(self, id: int):
+        # every episode of a batch shares its roster layout, so a player's slot too
+        return self.episodes[0].player_slots[id]
+
+    def does_defense_have_possession(self):
+        return self.possessors >= self.offense_count
+
+    def does_offense_have_possession(self):
+        return (self.possessors >= 0) & (self.possessors < self.offense_count)
+
+    def finish(self, episodes):
+        # accepts an episode index, a list of indices or a boolean mask over episodes
+        self.active[episodes] = False
+
+    def is_done(self):
+        return not self.active.any()
+
+    def get_active_episodes(self):
+        return [
+            (episode, self.episodes[episode]) for episode in np.flatnonzero(self.active)
+        ]
+
+    def update(self, dt: int, substep: int | None = None):
+        # one decision step for every active episode, see BluelockEnvironment.update
+        active_episodes = self.get_active_episodes()
+        self.controllers.run(Phase.PRE, active_episodes)
+        self.step(dt, substep)
+        self.controllers.run(Phase.POST, active_episodes)
+
+    def fast_forward(self, dt: int, duration: int):
+        active_episodes = self.get_active_episodes()
+        self.controllers.run(Phase.PRE, active_episodes)
+        self.coast(dt, duration)
+        self.controllers.run(Phase.POST, active_episodes)
+
+    def coast(self, dt: int, duration: int):
+        # advances every active episode by duration while holding each player's run command,
+        # see BluelockEnvironment.coast; an episode stops early once its ball is possessed
+        if duration <= dt:
+            self.step(dt)
+            return
+        for _, env in self.get_active_episodes():
+            advanced = 0
+            while advanced < duration:
+                advanced += env.coast(dt, duration - advanced)
+                if env.ball.is_possessed():
+                    break
+
+    def step(self, dt: int, substep: int | None = None):
+        # with a substep each active episode is advanced on its own, see BluelockEnvironment.step
+        if substep is not None and substep < dt:
+            for _, env in self.get_active_episodes():
+                env.step(dt, substep)
+            return
+
+        episodes = np.flatnonzero(self.active)
+        if len(episodes) == 0:
+            return
+        is_gathered = len(episodes) < len(self.active)
+        if not is_gathered:
+            episodes = slice(None)
+
+        self.simulation_time[episodes] += dt
+        positions = self.positions[episodes]
+        speeds = self.speeds[episodes]
+        ball_positions = self.ball_positions[episodes]
+        ball_speeds = self.ball_speeds[episodes]
+        ball_directions = self.ball_directions[episodes]
+        possessors = self.possessors[episodes].copy()
+        previous_possessors = possessors.copy()
+        reach = self.reach[episodes]
+
+        does_defense_have_possession = possessors >= self.offense_count
+        is_loose = possessors < 0
+        if is_loose.any():
+            loose_speeds, loose_directions = (
+                ball_speeds[is_loose],
+                ball_directions[is_loose],
+            )
+            ball_positions[is_loose, 0] += np.cos(loose_directions) * loose_speeds * dt
+            ball_positions[is_loose, 1] += np.sin(loose_directions) * loose_speeds * dt
+            ball_speeds[is_loose] = np.maximum(
+                0, loose_speeds - self.ball_frictions[episodes][is_loose] * dt
+            )
+
+        # defenders contest the holder where they stood before moving
+        rows = np.arange(len(possessors))
+        contest_centers = ball_positions.copy()
+        contest_centers[~is_loose] = positions[rows[~is_loose], possessors[~is_loose]]
+
+        rotations = self.rotations[episodes]
+        velocities = np.stack((np.cos(rotations), np.sin(rotations)), axis=-1)
+        velocities *= speeds[..., None]
+        velocities *= dt
+        positions += velocities
+        speeds[:] = 0
+
+        if positions.shape[1] > self.offense_count:
+            displacements = (
+                positions[:, self.offense_count :] - contest_centers[:, None]
+            )
+            contacts = (
+                np.sqrt(np.sum(displacements**2, axis=2))
+                <= reach[:, self.offense_count :]
+            )
+            contacts &= ~does_defense_have_possession[:, None]
+            for row in np.flatnonzero(contacts.any(axis=1)):
+                first = self.offense_count + np.argmax(contacts[row])
+                self.contest_ball(row, first, positions, reach, possessors)
+
+        is_loose = possessors < 0
+        if self.offense_count > 0 and is_loose.any():
+            displacements = positions[:, : self.offense_count] - ball_positions[:, None]
+            contacts = (
+                np.sqrt(np.sum(displacements**2, axis=2))
+                <= reach[:, : self.offense_count]
+            )
+            contacts &= is_loose[:, None]
+            claimed = np.flatnonzero(contacts.any(axis=1))
+            possessors[claimed] = np.argmax(contacts[claimed], axis=1)
+
+        has_new_possessor = possessors != previous_possessors
+        ball_speeds[has_new_possessor] = 0
+        ball_directions[has_new_possessor] = 0
+        self.possession_changed_at[episodes] = np.where(
+            has_new_possessor,
+            self.simulation_time[episodes],
+            self.possession_changed_at[episodes],
+        )
+
+        np.minimum(positions, self.upper_bounds[episodes], out=positions)
+        np.maximum(positions, self.lower_bounds[episodes], out=positions)
+        is_loose = possessors < 0
+        if is_loose.any():
+            ball_sizes = self.ball_sizes[episodes][is_loose, None]
+            ball_positions[is_loose] = np.maximum(
+                np.minimum(
+                    ball_positions[is_loose],
+                    np.array([self.width, self.height]) - ball_sizes,
+                ),
+                ball_sizes,
+            )
+
+        if is_gathered:
+            self.positions[episodes] = positions
+            self.speeds[episodes] = speeds
+            self.ball_positions[episodes] = ball_positions
+            self.ball_speeds[episodes] = ball_speeds
+            self.ball_directions[episodes] = ball_directions
+        self.possessors[episodes] = possessors
+
+    def contest_ball(
+        self,
+        row: int,
+        first: int,
+        positions: np.ndarray,
+        reach: np.ndarray,
+        possessors: np.ndarray,
+    ):
+        # defenders take the ball in slot order, each later defender contesting the new holder
+        possessors[row] = first
+        for slot in range(first + 1, positions.shape[1]):
+            displacement = positions[row, slot] - positions[row, possessors[row]]
+            if np.sqrt(np.sum(displacement**2)) <= reach[row, slot]:
+                possessors[row] = slot
@@ -10,3 +10,7 @@ PLAYER_OFFENDER_SPEED = 0.1
 PLAYER_DEFENDER_SPEED = 0.1
 PLAYER_SHOT_SPEED = 0.15
 PLAYER_SIZE = 16
+
+# spatial grid constants, rosters smaller than the minimum are scanned directly
+SPATIAL_GRID_CELL_SIZE = 64
+SPATIAL_GRID_MIN_PLAYERS = 8
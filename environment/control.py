@@ -0,0 +1,103 @@
+import time
+from enum import Enum
+from dataclasses import dataclass
+from typing import Callable
+
+
+class Phase(str, Enum):
+    PRE = "pre"  # before physics, where players decide on their runs
+    POST = "post"  # after physics, reacting to the new state
+
+
+# controllers of a phase run by ascending priority, ties in registration order
+OFFENSE_PRIORITY = 0
+DEFENSE_PRIORITY = 10
+
+
+@dataclass
+class Controller:
+    name: str
+    control: Callable
+    phase: Phase
+    priority: int
+    is_enabled: bool = True
+    calls: int = 0
+    elapsed: float = 0  # seconds, only accumulated while the pipeline is timed
+
+
+class ControllerPipeline:
+    """
+    The controllers an environment runs around each decision step. Running a phase is a
+    loop over a precomputed schedule, so the cost per step does not depend on how
+    controllers were added or toggled. Controls of a BluelockEnvironment take no
+    arguments, controls of a BatchedBluelockEnvironment take its active episodes.
+    """
+
+    def __init__(self):
+        self.controllers: dict[str, Controller] = {}
+        self.schedules = {Phase.PRE: [], Phase.POST: []}
+        self.is_timed = False
+
+    def register(
+        self,
+        name: str,
+        control: Callable,
+        phase: Phase = Phase.PRE,
+        priority: int = OFFENSE_PRIORITY,
+        is_enabled: bool = True,
+    ) -> Controller:
+        if name in self.controllers:
+            raise ValueError(f"A controller named {name} is already registered")
+        controller = Controller(name, control, phase, priority, is_enabled)
+        self.controllers[name] = controller
+        self.schedule()
+        return controller
+
+    def unregister(self, name: str):
+        del self.controllers[name]
+        self.schedule()
+
+    def enable(self, name: str):
+        self.controllers[name].is_enabled = True
+        self.schedule()
+
+    def disable(self, name: str):
+        self.controllers[name].is_enabled = False
+        self.schedule()
+
+    def schedule(self):
+        for phase in self.schedules:
+            controllers = [
+                controller
+                for controller in self.controllers.values()
+                if controller.phase == phase and controller.is_enabled
+            ]
+            # sorted is stable, so equal priorities keep their registration order
+            self.schedules[phase] = sorted(controllers, key=lambda c: c.priority)
+
+    def run(self, phase: Phase, *args):
+        if self.is_timed:
+            for controller in self.schedules[phase]:
+                start = time.perf_counter()
+                controller.control(*args)
+                controller.elapsed += time.perf_counter() - start
+                controller.calls += 1
+            return
+        for controller in self.schedules[phase]:
+            controller.control(*args)
+
+    def get_timings(self) -> dict[str, tuple[int, float]]:
+        # calls and seconds spent per controller since timing was switched on
+        return {
+            name: (controller.calls, controller.elapsed)
+            for name, controller in self.controllers.items()
+        }
+
+
+def for_each_episode(controls: list[Callable[[], None]]):
+    # lifts per episode controls into one batched control, controls[i] drives episode i
+    def control(episodes: list):
+        for episode, _ in episodes:
+            controls[episode]()
+
+    return control
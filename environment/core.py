@@ -6,9 +6,19 @@ from environment.config import (
     PLAYER_SHOT_SPEED,
     PLAYER_DEFENDER_SPEED,
     PLAYER_OFFENDER_SPEED,
+    SPATIAL_GRID_CELL_SIZE,
+    SPATIAL_GRID_MIN_PLAYERS,
 )
+from environment.spatial import UniformGrid
+from environment.control import ControllerPipeline, Phase
 from enum import Enum
-from util import get_unit_vector, can_circles_intersect, Circle
+from dataclasses import dataclass
+from util import (
+    get_unit_vector,
+    can_circles_intersect,
+    can_swept_circles_intersect,
+    Circle,
+)
 
 
 class Team(int, Enum):
@@ -127,21 +137,90 @@ class BluelockEnvironment:
         self.defense = defense
         self.ball = ball
         self.simulation_time = 0
+        self.possession_changed_at = 0
+        self.controllers = ControllerPipeline()
+        self.index_roster()
+
+    def index_roster(self):
+        # offense then defense, a player's slot stays fixed for the life of the environment
+        self.players = self.offense + self.defense
+        self.player_slots = {}
+        for slot, player in enumerate(self.players):
+            self.player_slots.setdefault(player.id, slot)
+        self.grid = UniformGrid((self.width, self.height), SPATIAL_GRID_CELL_SIZE)
+        self.grid_time = None
 
     def get_player(self, id: int):
-        for offensive_player in self.offense:
-            if offensive_player.id == id:
-                return offensive_player
-        for defensive_player in self.defense:
-            if defensive_player.id == id:
-                return defensive_player
-        return None
+        slot = self.player_slots.get(id)
+        if slot is None:
+            return None
+        return self.players[slot]
 
     def get_players_by_ids(self, *ids: int):
-        return [self.get_player(id) for id in ids]
+        players, slots = self.players, self.player_slots
+        return [players[slots[id]] if id in slots else None for id in ids]
+
+    def get_slots(self, *ids: int) -> np.ndarray:
+        # bulk resolves ids to roster slots, which also index per player arrays
+        return np.array([self.player_slots[id] for id in ids], dtype=int)
 
     def get_players(self):
-        return self.offense + self.defense
+        # the shared roster, callers must not mutate it
+        return self.players
+
+    def get_player_positions(self) -> np.ndarray:
+        return np.array([player.position for player in self.players], dtype=float)
+
+    def get_grid(self) -> UniformGrid:
+        # rebuilt lazily once the simulation has moved on, players placed by hand between
+        # ticks need an explicit invalidate_grid()
+        if self.grid_time != self.simulation_time:
+            self.grid.rebuild(self.get_player_positions())
+            self.grid_time = self.simulation_time
+        return self.grid
+
+    def invalidate_grid(self):
+        self.grid_time = None
+
+    def get_players_within(
+        self, center: np.ndarray, radius: float, start: int = 0, stop: int | None = None
+    ) -> list[int]:
+        # slots in [start, stop) of the players whose centres lie within radius of center,
+        # a superset is fine since callers do their own exact test
+        stop = len(self.players) if stop is None else stop
+        if len(self.players) < SPATIAL_GRID_MIN_PLAYERS:
+            return list(range(start, stop))
+        slots = self.get_grid().query_radius(center, radius + 1e-6)
+        return [slot for slot in slots.tolist() if start <= slot < stop]
+
+    def get_first_contact(self, center: np.ndarray, start: int, stop: int):
+        # the first slot in [start, stop) whose player can reach a ball centred at center
+        if start >= stop:
+            return None
+        max_size = max(player.size for player in self.players[start:stop])
+        for slot in self.get_players_within(
+            center, max_size + self.ball.size, start, stop
+        ):
+            player = self.players[slot]
+            if can_circles_intersect(
+                Circle(center, self.ball.size), Circle(player.position, player.size)
+            ):
+                return slot
+        return None
+
+    def contest_ball(self, center: np.ndarray):
+        # defenders take the ball in slot order, each later defender contesting the new holder
+        slot = self.get_first_contact(center, len(self.offense), len(self.players))
+        while slot is not None:
+            self.players[slot].possess(self.ball)
+            slot = self.get_first_contact(
+                self.players[slot].position, slot + 1, len(self.players)
+            )
+
+    def claim_loose_ball(self):
+        slot = self.get_first_contact(self.ball.position, 0, len(self.offense))
+        if slot is not None:
+            self.players[slot].possess(self.ball)
 
     def can_possess_ball(self, ball: Ball, player: Player):
         # todo: remove the need to have to check if the ball is possesed to calculate its position
@@ -153,19 +232,15 @@ class BluelockEnvironment:
         )
 
     def does_defense_have_possession(self):
-        for defender in self.defense:
-            if defender.has_possession():
-                return True
-        return False
+        possessor = self.ball.possessor
+        return possessor is not None and possessor.team == Team.DEFEND
 
     def does_offense_have_possession(self):
-        for offender in self.offense:
-            if offender.has_possession():
-                return True
-        return False
+        possessor = self.ball.possessor
+        return possessor is not None and possessor.team == Team.OFFEND
 
     def clamp_players(self):
-        for player in self.get_players():
+        for player in self.players:
             player.position[0] = max(
                 min(player.position[0], self.width - player.size),
                 player.size,
@@ -183,22 +258,217 @@ class BluelockEnvironment:
                 min(self.ball.position[1], self.height - self.ball.size), self.ball.size
             )
 
-    def update(self, dt: int):
+    def tick(self, dt: int):
         self.simulation_time += dt
+        possessor = self.ball.possessor
         does_defense_have_possession = self.does_defense_have_possession()
         self.ball.update(dt)
-        for defensive_player in self.defense:
-            defensive_player.update(dt)
-            if not does_defense_have_possession and self.can_possess_ball(
-                self.ball, defensive_player
-            ):
-                defensive_player.possess(self.ball)
-
-        for offensive_player in self.offense:
-            offensive_player.update(dt)
-            if not self.ball.is_possessed() and self.can_possess_ball(
-                self.ball, offensive_player
-            ):
-                offensive_player.possess(self.ball)
+        # defenders contest the holder where it stood before moving
+        contest_center = self.ball.position.copy()
+        if possessor is not None:
+            contest_center = possessor.position
+
+        for player in self.players:
+            player.update(dt)
+        self.invalidate_grid()
+        if not does_defense_have_possession:
+            self.contest_ball(contest_center)
+        if not self.ball.is_possessed():
+            self.claim_loose_ball()
         self.clamp_players()
         self.clamp_ball()
+        self.invalidate_grid()
+        if self.ball.possessor is not possessor:
+            self.possession_changed_at = self.simulation_time
+
+    def update(self, dt: int, substep: int | None = None):
+        # one decision step, the registered controllers run around the physics
+        self.controllers.run(Phase.PRE)
+        self.step(dt, substep)
+        self.controllers.run(Phase.POST)
+
+    def fast_forward(self, dt: int, duration: int) -> int:
+        # a decision step which coasts through a loose ball phase, see coast
+        self.controllers.run(Phase.PRE)
+        advanced = self.coast(dt, duration)
+        self.controllers.run(Phase.POST)
+        return advanced
+
+    def step(self, dt: int, substep: int | None = None):
+        # With a substep, dt is advanced as ticks of that size during which every player holds
+        # its current run, matching a loop that re-issues the runs before each fine tick.
+        # Stretches where a swept test rules out any change of possession are merged into
+        # closed-form jumps, so only ticks near a contact are actually stepped.
+        if substep is None or substep >= dt:
+            self.tick(dt)
+            return
+
+        ticks, remainder = divmod(dt, substep)
+        players = self.get_players()
+        held_speeds = [player.speed for player in players]
+        while ticks > 0:
+            ticks -= self.advance(substep, ticks)
+            for player, speed in zip(players, held_speeds):
+                player.speed = speed
+        if remainder > 0:
+            self.tick(remainder)
+        for player in players:
+            player.speed = 0
+
+    def coast(self, dt: int, duration: int) -> int:
+        # Advances a loose ball phase as if every player re-issued its current run before each
+        # tick, stopping right after the tick in which someone reaches the ball. Returns the
+        # time advanced.
+        if self.ball.is_possessed():
+            self.tick(dt)
+            return dt
+        ticks = self.advance(dt, max(1, duration // dt))
+        for player in self.get_players():
+            player.speed = 0
+        return ticks * dt
+
+    def advance(self, dt: int, ticks: int) -> int:
+        # Advances up to ticks ticks while players hold their runs. Ticks before the first one
+        # in which possession could change are jumped over in closed form, that tick is then
+        # stepped normally. Returns the number of ticks advanced.
+        if ticks == 1 or not self.are_bodies_in_bounds():
+            self.tick(dt)
+            return 1
+
+        trajectories = self.get_trajectories(dt, ticks)
+        contact_ticks = []
+        if self.can_possession_change(trajectories):
+            contact_ticks = self.get_contact_ticks(trajectories)
+        skipped = ticks if len(contact_ticks) == 0 else contact_ticks[0]
+        self.jump(trajectories, skipped, dt)
+        if len(contact_ticks) == 0:
+            return skipped
+        self.tick(dt)
+        return skipped + 1
+
+    def are_bodies_in_bounds(self):
+        for body in self.get_players() + [self.ball]:
+            x, y = body.position
+            if not body.size <= x <= self.width - body.size:
+                return False
+            if not body.size <= y <= self.height - body.size:
+                return False
+        return True
+
+    def get_trajectories(self, dt: int, ticks: int):
+        # Motion is monotone per axis, so clamping every tick equals clamping running sums of the
+        # per tick steps; the sums are accumulated in tick order so they match tick() exactly.
+        bounds = np.array([self.width, self.height])
+        players = self.get_players()
+        sizes = np.array([player.size for player in players], dtype=float)[:, None]
+        positions = np.array([player.position for player in players], dtype=float)
+        steps = np.array([player.speed * player.tilt for player in players]) * dt
+        steps = steps.reshape(positions.shape)
+        player_paths = np.cumsum(
+            np.concatenate(
+                [positions[None], np.broadcast_to(steps, (ticks,) + steps.shape)]
+            ),
+            axis=0,
+        )
+        clamped_player_paths = np.maximum(
+            np.minimum(player_paths, bounds - sizes), sizes
+        )
+
+        ball = self.ball
+        ball_speeds = np.maximum(
+            0,
+            np.cumsum(
+                np.concatenate([[ball.speed], np.full(ticks, -ball.friction * dt)])
+            ),
+        )
+        ball_steps = (get_unit_vector(ball.direction) * ball_speeds[:-1, None]) * dt
+        if ball.is_possessed():
+            ball_steps = np.zeros_like(ball_steps)
+        ball_path = np.cumsum(
+            np.concatenate([[np.asarray(ball.position, dtype=float)], ball_steps]),
+            axis=0,
+        )
+        clamped_ball_path = np.maximum(
+            np.minimum(ball_path, bounds - ball.size), ball.size
+        )
+        return Trajectories(
+            players=players,
+            sizes=sizes,
+            steps=steps,
+            player_paths=clamped_player_paths,
+            ball_steps=ball_steps,
+            ball_speeds=ball_speeds,
+            ball_path=clamped_ball_path,
+            is_clamped=not (
+                np.array_equal(player_paths[-1], clamped_player_paths[-1])
+                and np.array_equal(ball_path[-1], clamped_ball_path[-1])
+            ),
+        )
+
+    def get_contest(self, trajectories: "Trajectories"):
+        # the centres contested during each tick and which players contest them
+        possessor = self.ball.possessor
+        players = trajectories.players
+        if possessor is None:
+            centers = trajectories.ball_path[:-1] + trajectories.ball_steps
+            return centers, np.ones(len(players), dtype=bool)
+        if possessor.team == Team.DEFEND:
+            return None, np.zeros(len(players), dtype=bool)
+        # defenders contest the holder where it stood before moving
+        centers = trajectories.player_paths[:-1, self.player_slots[possessor.id]]
+        return centers, np.array([player.team == Team.DEFEND for player in players])
+
+    def can_possession_change(self, trajectories: "Trajectories"):
+        centers, contesters = self.get_contest(trajectories)
+        if not contesters.any():
+            return False
+        if trajectories.is_clamped:
+            return True
+        # unclamped, every contested position lies on the segment a body sweeps over the jump
+        paths = trajectories.player_paths
+        reach = trajectories.sizes[contesters, 0] + self.ball.size
+        return bool(
+            np.any(
+                can_swept_circles_intersect(
+                    paths[0, contesters],
+                    paths[-1, contesters],
+                    centers[0],
+                    centers[-1],
+                    reach,
+                )
+            )
+        )
+
+    def get_contact_ticks(self, trajectories: "Trajectories"):
+        # possession is decided on the moved but not yet clamped positions of a tick
+        centers, contesters = self.get_contest(trajectories)
+        contacts = (
+            trajectories.player_paths[:-1, contesters] + trajectories.steps[contesters]
+        )
+        reach = trajectories.sizes[contesters, 0] + self.ball.size
+        dists = np.sqrt(np.sum((centers[:, None] - contacts) ** 2, axis=2))
+        return np.flatnonzero(np.any(dists <= reach, axis=1))
+
+    def jump(self, trajectories: "Trajectories", ticks: int, dt: int):
+        if ticks == 0:
+            return
+        for player, position in zip(
+            trajectories.players, trajectories.player_paths[ticks]
+        ):
+            player.position = position.copy()
+        if not self.ball.is_possessed():
+            self.ball.position = trajectories.ball_path[ticks].copy()
+            self.ball.speed = float(trajectories.ball_speeds[ticks])
+        self.simulation_time += ticks * dt
+
+
+@dataclass
+class Trajectories:
+    players: list[Player]
+    sizes: np.ndarray
+    steps: np.ndarray
+    player_paths: np.ndarray
+    ball_steps: np.ndarray
+    ball_speeds: np.ndarray
+    ball_path: np.ndarray
+    is_clamped: bool
@@ -1,8 +1,13 @@
 from environment.core import BluelockEnvironment, Defender, Offender, Ball
+from environment.batched import BatchedBluelockEnvironment
+from environment.control import DEFENSE_PRIORITY
 from typing import Callable
 from util import get_euclidean_dist, get_beeline_orientation
 from dataclasses import dataclass
+from environment.spatial import UniformGrid
+import numpy as np
 import heapq
+import math
 
 
 @dataclass
@@ -14,22 +19,353 @@ class Assignment:
 
 DefensePolicy = Callable[[list[Defender], list[Offender], Ball], list[Assignment]]
 
-# decorates over BluelockEnvironment by controlling the defense's movements according to some policy
+
+def apply_policy_defense(env: BluelockEnvironment, policy: DefensePolicy):
+    assignments = policy(env.defense, env.offense, env.ball)
+    for assignment in assignments:
+        defender = env.get_player(assignment.defender_id)
+        defender.set_rotation(assignment.orientation)
+        if assignment.should_run:
+            defender.run()
+
+
+def get_batch_policy_defense(policy: DefensePolicy):
+    # a batched controller applying policy to every active episode of a batch
+    def control(episodes: list[tuple[int, BluelockEnvironment]]):
+        for _, env in episodes:
+            apply_policy_defense(env, policy)
+
+    return control
+
+
+# registers a controller on BluelockEnvironment which moves the defense according to some policy,
+# an incremental policy keeps its plan across steps and only re-plans when it could change
 def with_policy_defense(
-    env: BluelockEnvironment, policy: DefensePolicy
+    env: BluelockEnvironment,
+    policy: DefensePolicy,
+    name: str = "defense",
+    is_incremental: bool = False,
 ) -> BluelockEnvironment:
-    old_update = env.update
+    if is_incremental:
+        if policy not in incremental_policies:
+            raise ValueError(f"{policy.__name__} has no incremental mode")
+        policy = incremental_policies[policy]()
+    env.controllers.register(
+        name, lambda: apply_policy_defense(env, policy), priority=DEFENSE_PRIORITY
+    )
+    return env
 
-    def new_update(*args, **kwargs):
-        assignments = policy(env.defense, env.offense, env.ball)
-        for assignment in assignments:
-            env.get_player(assignment.defender_id).set_rotation(assignment.orientation)
-            if assignment.should_run:
-                env.get_player(assignment.defender_id).run()
-        old_update(*args, **kwargs)
 
-    env.update = new_update
-    return env
+BALL_TARGET = -2
+
+
+def match_man_to_man(
+    defender_positions: np.ndarray,
+    offender_positions: np.ndarray,
+    ball_positions: np.ndarray,
+    is_loose: np.ndarray,
+    handlers: np.ndarray,
+    defender_ids: np.ndarray | None = None,
+    offender_ids: np.ndarray | None = None,
+):
+    """
+    Man to man marking for a batch of episodes, the first axis of every argument indexes
+    the episode. With a loose ball the defender closest to it chases the ball, then
+    defenders and offenders are paired greedily by (ball handler first, distance, angle,
+    defender id, offender id), the order naive_man_to_man's heap pops pairs in. handlers
+    holds the index of the offender with the ball, or -1. Returns each defender's target,
+    an offender index, BALL_TARGET or -1 if it was left unassigned, and the turn it was
+    assigned in.
+    """
+    episode_count, defender_count = defender_positions.shape[:2]
+    offender_count = offender_positions.shape[1]
+    if defender_ids is None:
+        defender_ids = np.arange(defender_count)
+    if offender_ids is None:
+        offender_ids = np.arange(offender_count)
+    rows = np.arange(episode_count)
+    targets = np.full((episode_count, defender_count), -1)
+    turns = np.full((episode_count, defender_count), -1)
+    next_turns = np.zeros(episode_count, dtype=int)
+
+    if defender_count > 0:
+        # try to steal the loose ball
+        ball_displacements = ball_positions[:, None] - defender_positions
+        ball_dists = np.sqrt(np.sum(ball_displacements**2, axis=2))
+        loose = rows[is_loose]
+        chasers = np.argmin(ball_dists[loose], axis=1)
+        targets[loose, chasers] = BALL_TARGET
+        turns[loose, chasers] = 0
+        next_turns[loose] = 1
+
+    if defender_count > 0 and offender_count > 0:
+        displacements = offender_positions[:, None] - defender_positions[:, :, None]
+        dists = np.sqrt(np.sum(displacements**2, axis=3))
+        angles = np.arctan2(displacements[..., 1], displacements[..., 0])
+        priorities = get_marking_priorities(handlers, offender_count)
+
+        # rank every pair of an episode once, then repeatedly take each episode's best
+        # open pair
+        shape = dists.shape
+        keys = (
+            np.broadcast_to(offender_ids, shape),
+            np.broadcast_to(defender_ids[:, None], shape),
+            angles,
+            dists,
+            np.broadcast_to(priorities[:, None], shape),
+            np.broadcast_to(rows[:, None, None], shape),
+        )
+        order = np.lexsort([key.ravel() for key in keys])
+        unavailable = dists.size
+        ranks = np.empty(dists.size, dtype=int)
+        ranks[order] = np.arange(dists.size)
+        ranks = ranks.reshape(shape)
+        ranks[turns >= 0] = unavailable
+        for _ in range(min(defender_count, offender_count)):
+            picks = np.argmin(ranks.reshape(episode_count, -1), axis=1)
+            defenders, offenders = np.divmod(picks, offender_count)
+            is_open = ranks[rows, defenders, offenders] < unavailable
+            if not is_open.any():
+                break
+            episodes, defenders, offenders = (
+                rows[is_open],
+                defenders[is_open],
+                offenders[is_open],
+            )
+            targets[episodes, defenders] = offenders
+            turns[episodes, defenders] = next_turns[episodes]
+            next_turns[episodes] += 1
+            ranks[episodes, defenders, :] = unavailable
+            ranks[episodes, :, offenders] = unavailable
+    return targets, turns
+
+
+def get_marking_priorities(handlers: np.ndarray, offender_count: int):
+    # prioritize guarding the ball handler
+    priorities = np.zeros((len(handlers), offender_count))
+    has_handler = handlers >= 0
+    priorities[has_handler, handlers[has_handler]] = -1
+    return priorities
+
+
+def aim_man_to_man(
+    defender_positions: np.ndarray,
+    offender_positions: np.ndarray,
+    ball_positions: np.ndarray,
+    targets: np.ndarray,
+):
+    # orientation towards and whether to run at each defender's target
+    episode_count, defender_count = targets.shape
+    headings = np.zeros((episode_count, defender_count, 2))
+    should_run = np.zeros((episode_count, defender_count), dtype=bool)
+    is_chasing = targets == BALL_TARGET
+    episodes = np.broadcast_to(np.arange(episode_count)[:, None], targets.shape)
+    headings[is_chasing] = (
+        ball_positions[episodes[is_chasing]] - defender_positions[is_chasing]
+    )
+    should_run[is_chasing] = True
+    is_marking = targets >= 0
+    marks = offender_positions[episodes[is_marking], targets[is_marking]]
+    headings[is_marking] = marks - defender_positions[is_marking]
+    should_run[is_marking] = np.sqrt(np.sum(headings[is_marking] ** 2, axis=1)) > 3
+
+    # aimed with math.atan2 like get_beeline_orientation, np.arctan2 can differ in the last bit
+    orientations = np.zeros((episode_count, defender_count))
+    is_assigned = targets != -1
+    orientations[is_assigned] = [
+        math.atan2(y, x) for x, y in headings[is_assigned].tolist()
+    ]
+    return orientations, should_run
+
+
+def solve_man_to_man(
+    defender_positions: np.ndarray,
+    offender_positions: np.ndarray,
+    ball_positions: np.ndarray,
+    is_loose: np.ndarray,
+    handlers: np.ndarray,
+    defender_ids: np.ndarray | None = None,
+    offender_ids: np.ndarray | None = None,
+):
+    # see match_man_to_man, returns each defender's orientation, whether to run and turn
+    targets, turns = match_man_to_man(
+        defender_positions,
+        offender_positions,
+        ball_positions,
+        is_loose,
+        handlers,
+        defender_ids,
+        offender_ids,
+    )
+    orientations, should_run = aim_man_to_man(
+        defender_positions, offender_positions, ball_positions, targets
+    )
+    return orientations, should_run, turns
+
+
+def get_marking_margins(
+    defender_positions: np.ndarray,
+    offender_positions: np.ndarray,
+    ball_positions: np.ndarray,
+    is_loose: np.ndarray,
+    handlers: np.ndarray,
+):
+    # per episode, the smallest gap between two distances match_man_to_man compares
+    episode_count, defender_count = defender_positions.shape[:2]
+    offender_count = offender_positions.shape[1]
+    margins = np.full(episode_count, np.inf)
+    loose = np.flatnonzero(is_loose)
+    if defender_count > 1 and len(loose) > 0:
+        ball_displacements = ball_positions[loose, None] - defender_positions[loose]
+        ball_dists = np.sort(np.sqrt(np.sum(ball_displacements**2, axis=2)), axis=1)
+        margins[loose] = np.min(np.diff(ball_dists, axis=1), axis=1)
+
+    if defender_count * offender_count > 1:
+        displacements = offender_positions[:, None] - defender_positions[:, :, None]
+        dists = np.sqrt(np.sum(displacements**2, axis=3)).reshape(episode_count, -1)
+        priorities = np.broadcast_to(
+            get_marking_priorities(handlers, offender_count)[:, None],
+            (episode_count, defender_count, offender_count),
+        ).reshape(episode_count, -1)
+        # pairs of different priority are never ordered by distance
+        order = np.lexsort((dists, priorities))
+        dists = np.take_along_axis(dists, order, axis=1)
+        priorities = np.take_along_axis(priorities, order, axis=1)
+        gaps = np.where(
+            priorities[:, 1:] == priorities[:, :-1], np.diff(dists, axis=1), np.inf
+        )
+        margins = np.minimum(margins, np.min(gaps, axis=1))
+    return margins
+
+
+class ManToManPlanner:
+    """
+    Caches the man to man pairs of a batch of episodes. Each distance can change by at most
+    the movement of its two ends, so an episode is matched again only when possession
+    changed or when its players and ball moved far enough since the last match that two
+    distances the matching compared could have swapped order. In between, the cached pairs
+    are only re-aimed, which gives the same orientations a fresh match would.
+    """
+
+    def __init__(
+        self, episode_count: int, defender_ids: np.ndarray, offender_ids: np.ndarray
+    ):
+        self.defender_ids = defender_ids
+        self.offender_ids = offender_ids
+        defender_count, offender_count = len(defender_ids), len(offender_ids)
+        self.targets = np.full((episode_count, defender_count), -1)
+        self.turns = np.full((episode_count, defender_count), -1)
+        self.defender_positions = np.zeros((episode_count, defender_count, 2))
+        self.offender_positions = np.zeros((episode_count, offender_count, 2))
+        self.ball_positions = np.zeros((episode_count, 2))
+        self.is_loose = np.zeros(episode_count, dtype=bool)
+        self.handlers = np.full(episode_count, -1)
+        self.margins = np.full(episode_count, -np.inf)  # nothing has been matched yet
+
+    def get_movements(
+        self,
+        episodes: np.ndarray,
+        defender_positions: np.ndarray,
+        offender_positions: np.ndarray,
+        ball_positions: np.ndarray,
+    ):
+        # the furthest any player or the ball of each episode moved since its last match
+        movements = [
+            np.sqrt(
+                np.sum((ball_positions - self.ball_positions[episodes]) ** 2, axis=1)
+            )
+        ]
+        for positions, matched in (
+            (defender_positions, self.defender_positions),
+            (offender_positions, self.offender_positions),
+        ):
+            if positions.shape[1] > 0:
+                dists = np.sqrt(np.sum((positions - matched[episodes]) ** 2, axis=2))
+                movements.append(np.max(dists, axis=1))
+        return np.max(movements, axis=0)
+
+    def plan(
+        self,
+        episodes: np.ndarray,
+        defender_positions: np.ndarray,
+        offender_positions: np.ndarray,
+        ball_positions: np.ndarray,
+        is_loose: np.ndarray,
+        handlers: np.ndarray,
+    ):
+        # same as solve_man_to_man for the given episodes
+        movements = self.get_movements(
+            episodes, defender_positions, offender_positions, ball_positions
+        )
+        is_stale = 4 * movements >= self.margins[episodes]
+        is_stale |= is_loose != self.is_loose[episodes]
+        is_stale |= handlers != self.handlers[episodes]
+        if is_stale.any():
+            stale = episodes[is_stale]
+            state = (
+                defender_positions[is_stale],
+                offender_positions[is_stale],
+                ball_positions[is_stale],
+                is_loose[is_stale],
+                handlers[is_stale],
+            )
+            self.targets[stale], self.turns[stale] = match_man_to_man(
+                *state, self.defender_ids, self.offender_ids
+            )
+            self.margins[stale] = get_marking_margins(*state)
+            (
+                self.defender_positions[stale],
+                self.offender_positions[stale],
+                self.ball_positions[stale],
+                self.is_loose[stale],
+                self.handlers[stale],
+            ) = state
+
+        orientations, should_run = aim_man_to_man(
+            defender_positions,
+            offender_positions,
+            ball_positions,
+            self.targets[episodes],
+        )
+        return orientations, should_run, self.turns[episodes]
+
+
+def get_man_to_man_inputs(
+    defenders: list[Defender], offenders: list[Offender], ball: Ball
+):
+    # a single episode batch of solve_man_to_man's arguments
+    handler = -1
+    for index, offender in enumerate(offenders):
+        if offender.has_possession():
+            handler = index
+    return (
+        np.array([[defender.position for defender in defenders]], dtype=float),
+        np.array([offender.position for offender in offenders], dtype=float).reshape(
+            1, len(offenders), 2
+        ),
+        np.array([ball.position], dtype=float),
+        np.array([not ball.is_possessed()]),
+        np.array([handler]),
+    )
+
+
+def get_assignments(
+    defenders: list[Defender],
+    orientations: np.ndarray,
+    should_run: np.ndarray,
+    turns: np.ndarray,
+) -> list[Assignment]:
+    assignments = []
+    for index in np.argsort(turns, kind="stable"):
+        if turns[index] >= 0:
+            assignments.append(
+                Assignment(
+                    defender_id=defenders[index].id,
+                    orientation=float(orientations[index]),
+                    should_run=bool(should_run[index]),
+                )
+            )
+    return assignments
 
 
 def naive_man_to_man(
@@ -39,55 +375,174 @@ def naive_man_to_man(
     if len(defenders) == 0:
         return []
 
-    assignments = []
-    assigned_defenders = set([])
-    if not ball.is_possessed():
-        # try to steal the loose ball
-        dist, closest_defender = float("inf"), defenders[0]
-        for defender in defenders:
-            defender_dist_to_ball = get_euclidean_dist(defender.position, ball.position)
-            if defender_dist_to_ball < dist:
-                dist, closest_defender = defender_dist_to_ball, defender
-
-        assigned_defenders.add(closest_defender.id)
-        assignments.append(
-            Assignment(
-                defender_id=closest_defender.id,
-                orientation=get_beeline_orientation(
-                    ball.position - closest_defender.position
-                ),
-                should_run=True,
+    orientations, should_run, turns = solve_man_to_man(
+        *get_man_to_man_inputs(defenders, offenders, ball),
+        np.array([defender.id for defender in defenders]),
+        np.array([offender.id for offender in offenders]),
+    )
+    return get_assignments(defenders, orientations[0], should_run[0], turns[0])
+
+
+def incremental_man_to_man() -> DefensePolicy:
+    # naive_man_to_man for a single environment, re-planned only when the plan could change
+    planner = None
+
+    def policy(
+        defenders: list[Defender], offenders: list[Offender], ball: Ball
+    ) -> list[Assignment]:
+        nonlocal planner
+        if len(defenders) == 0:
+            return []
+        if planner is None:
+            planner = ManToManPlanner(
+                1,
+                np.array([defender.id for defender in defenders]),
+                np.array([offender.id for offender in offenders]),
             )
+        orientations, should_run, turns = planner.plan(
+            np.zeros(1, dtype=int), *get_man_to_man_inputs(defenders, offenders, ball)
+        )
+        return get_assignments(defenders, orientations[0], should_run[0], turns[0])
+
+    return policy
+
+
+incremental_policies = {naive_man_to_man: incremental_man_to_man}
+
+
+def get_batch_man_to_man_defense(
+    batch: BatchedBluelockEnvironment, is_incremental: bool = False
+):
+    # a batched controller marking man to man in every active episode with one solve
+    offense_count = batch.offense_count
+    first = batch.episodes[0]
+    defender_ids = np.array([defender.id for defender in first.defense])
+    offender_ids = np.array([offender.id for offender in first.offense])
+    planner = None
+    if is_incremental:
+        planner = ManToManPlanner(len(batch.episodes), defender_ids, offender_ids)
+
+    def control(episodes: list[tuple[int, BluelockEnvironment]]):
+        if len(episodes) == 0:
+            return
+        indices = np.array([episode for episode, _ in episodes])
+        positions, possessors = batch.positions[indices], batch.possessors[indices]
+        inputs = (
+            positions[:, offense_count:],
+            positions[:, :offense_count],
+            batch.ball_positions[indices],
+            possessors < 0,
+            np.where(possessors < offense_count, possessors, -1),
         )
+        if planner is None:
+            orientations, should_run, turns = solve_man_to_man(
+                *inputs, defender_ids, offender_ids
+            )
+        else:
+            orientations, should_run, turns = planner.plan(indices, *inputs)
+        is_assigned = turns >= 0
+        rotations = batch.rotations[indices, offense_count:]
+        rotations[is_assigned] = orientations[is_assigned]
+        batch.rotations[indices, offense_count:] = rotations
+        speeds = batch.speeds[indices, offense_count:]
+        is_running = is_assigned & should_run
+        speeds[is_running] = batch.top_speeds[indices, offense_count:][is_running]
+        batch.speeds[indices, offense_count:] = speeds
+
+    return control
+
+
+def get_nearest_offenders(
+    grid: UniformGrid, position: np.ndarray, is_offender: np.ndarray
+):
+    # yields offender slots by increasing distance, widening the grid query as it runs dry
+    fetched, k, total = 0, 2, int(np.count_nonzero(is_offender))
+    while fetched < total:
+        nearest = grid.nearest(position, k, mask=is_offender)
+        yield from nearest[fetched:].tolist()
+        fetched, k = len(nearest), k * 2
+
+
+def spatial_man_to_man(env: BluelockEnvironment) -> DefensePolicy:
+    # makes the same assignments as naive_man_to_man for env, but a defender's candidate
+    # offenders are pulled from the environment's grid nearest first and only as long as the
+    # ones ahead of them turn out to be marked, instead of heaping every pair up front
+    def policy(
+        defenders: list[Defender], offenders: list[Offender], ball: Ball
+    ) -> list[Assignment]:
+        if len(defenders) == 0:
+            return []
+
+        grid, players = env.get_grid(), env.get_players()
+        is_defender = np.zeros(len(players), dtype=bool)
+        is_defender[env.get_slots(*[defender.id for defender in defenders])] = True
+        is_offender = np.zeros(len(players), dtype=bool)
+        is_offender[env.get_slots(*[offender.id for offender in offenders])] = True
+
+        assignments = []
+        assigned_defenders = set([])
+        if not ball.is_possessed():
+            # try to steal the loose ball
+            closest_defender = players[grid.nearest(ball.position, mask=is_defender)[0]]
+            assigned_defenders.add(closest_defender.id)
+            assignments.append(
+                Assignment(
+                    defender_id=closest_defender.id,
+                    orientation=get_beeline_orientation(
+                        ball.position - closest_defender.position
+                    ),
+                    should_run=True,
+                )
+            )
+
+        def get_candidate(priority: int, defender: Defender, offender: Offender):
+            return (
+                priority,
+                get_euclidean_dist(defender.position, offender.position),
+                get_beeline_orientation(offender.position - defender.position),
+                defender.id,
+                offender.id,
+            )
 
-    marked_offenders = set([])
-    defender_to_offender_dists = []
-    for defender in defenders:
-        if defender.id not in assigned_defenders:
-            for offender in offenders:
+        ball_handlers = [
+            offender for offender in offenders if offender.has_possession()
+        ]
+        marked_offenders = set([])
+        candidates, streams = [], {}
+        for defender in defenders:
+            if defender.id not in assigned_defenders:
                 # prioritize guarding the ball handler
-                offender_priority = -1 if offender.has_possession() else 0
-                defender_to_offender_dists.append(
-                    (
-                        offender_priority,
-                        get_euclidean_dist(defender.position, offender.position),
-                        get_beeline_orientation(offender.position - defender.position),
-                        defender.id,
-                        offender.id,
-                    )
+                for offender in ball_handlers:
+                    candidates.append(get_candidate(-1, defender, offender))
+                streams[defender.id] = get_nearest_offenders(
+                    grid, defender.position, is_offender
                 )
+                slot = next(streams[defender.id], None)
+                if slot is not None:
+                    candidates.append(get_candidate(0, defender, players[slot]))
 
-    heapq.heapify(defender_to_offender_dists)
-    while len(assignments) < len(defenders):
-        _, dist, angle, defender_id, offender_id = heapq.heappop(
-            defender_to_offender_dists
-        )
-        if defender_id in assigned_defenders or offender_id in marked_offenders:
-            continue
+        heapq.heapify(candidates)
+        while len(assignments) < len(defenders) and len(candidates) > 0:
+            priority, dist, angle, defender_id, offender_id = heapq.heappop(candidates)
+            if defender_id in assigned_defenders:
+                continue
+            if offender_id in marked_offenders:
+                if priority == 0:
+                    slot = next(streams[defender_id], None)
+                    if slot is not None:
+                        candidate = get_candidate(
+                            0, env.get_player(defender_id), players[slot]
+                        )
+                        heapq.heappush(candidates, candidate)
+                continue
 
-        assigned_defenders.add(defender_id)
-        assignments.append(
-            Assignment(defender_id=defender_id, orientation=angle, should_run=dist > 3)
-        )
-        marked_offenders.add(offender_id)
-    return assignments
+            assigned_defenders.add(defender_id)
+            assignments.append(
+                Assignment(
+                    defender_id=defender_id, orientation=angle, should_run=dist > 3
+                )
+            )
+            marked_offenders.add(offender_id)
+        return assignments
+
+    return policy
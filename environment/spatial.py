@@ -0,0 +1,83 @@
+import numpy as np
+
+
+class UniformGrid:
+    """
+    Buckets points into square cells of a uniform grid laid over the pitch so radius and
+    nearest neighbour queries only look at nearby cells. Points are stored sorted by cell
+    with an offset table per cell, so a rebuild is a handful of NumPy calls.
+    """
+
+    def __init__(self, dims: tuple[int, int], cell_size: float):
+        width, height = dims
+        self.cell_size = cell_size
+        self.cols = max(1, int(np.ceil(width / cell_size)))
+        self.rows = max(1, int(np.ceil(height / cell_size)))
+        self.positions = np.zeros((0, 2))
+        self.order = np.zeros(0, dtype=int)
+        self.cell_starts = np.zeros(self.cols * self.rows + 1, dtype=int)
+
+    def get_cell(self, point: np.ndarray):
+        col = min(max(int(point[0] // self.cell_size), 0), self.cols - 1)
+        row = min(max(int(point[1] // self.cell_size), 0), self.rows - 1)
+        return col, row
+
+    def rebuild(self, positions: np.ndarray):
+        self.positions = positions
+        cells = np.floor_divide(positions, self.cell_size).astype(int)
+        cols = np.clip(cells[:, 0], 0, self.cols - 1)
+        rows = np.clip(cells[:, 1], 0, self.rows - 1)
+        cell_ids = rows * self.cols + cols
+        self.order = np.argsort(cell_ids, kind="stable")
+        self.cell_starts = np.searchsorted(
+            cell_ids[self.order], np.arange(self.cols * self.rows + 1)
+        )
+
+    def get_block_members(self, min_col: int, max_col: int, min_row: int, max_row: int):
+        # a block's cells are contiguous within each of its rows in the sorted order
+        rows = np.arange(min_row, max_row + 1) * self.cols
+        starts = self.cell_starts[rows + min_col]
+        lengths = self.cell_starts[rows + max_col + 1] - starts
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return self.order[offsets + np.arange(len(offsets))]
+
+    def get_dists(self, indices: np.ndarray, point: np.ndarray):
+        return np.sqrt(np.sum((self.positions[indices] - point) ** 2, axis=1))
+
+    def query_radius(
+        self, point: np.ndarray, radius: float, mask: np.ndarray | None = None
+    ) -> np.ndarray:
+        # indices of the points within radius of point, in ascending index order
+        min_col, min_row = self.get_cell(np.asarray(point) - radius)
+        max_col, max_row = self.get_cell(np.asarray(point) + radius)
+        candidates = self.get_block_members(min_col, max_col, min_row, max_row)
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        candidates = candidates[self.get_dists(candidates, point) <= radius]
+        return np.sort(candidates)
+
+    def nearest(
+        self, point: np.ndarray, k: int = 1, mask: np.ndarray | None = None
+    ) -> np.ndarray:
+        # indices of the (up to) k nearest points sorted by distance then index, the block of
+        # cells searched around point doubles until the k-th candidate is closer than any cell
+        # left outside it
+        col, row = self.get_cell(point)
+        max_ring = max(col, self.cols - 1 - col, row, self.rows - 1 - row)
+        ring = 1
+        while True:
+            candidates = self.get_block_members(
+                max(col - ring, 0),
+                min(col + ring, self.cols - 1),
+                max(row - ring, 0),
+                min(row + ring, self.rows - 1),
+            )
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+            dists = self.get_dists(candidates, point)
+            order = np.lexsort((candidates, dists))
+            if ring >= max_ring or (
+                len(candidates) >= k and dists[order[k - 1]] <= ring * self.cell_size
+            ):
+                return candidates[order[:k]]
+            ring *= 2
@@ -0,0 +1,246 @@
+import math
+import numpy as np
+from environment.core import BluelockEnvironment, Player, Ball, Offender, Defender
+from environment.control import ControllerPipeline
+
+
+class PlayerView(Player):
+    # a Player whose kinematic state lives in a row of the environment's arrays
+    def __init__(self, env: "VectorizedBluelockEnvironment", slot: int, player: Player):
+        self.env = env
+        self.slot = slot
+        self.id = player.id
+        self.team = player.team
+        self.size = player.size
+        self.top_speed = player.top_speed
+
+    @property
+    def position(self):
+        # hand out a copy so held positions stay snapshots, like they do for Player
+        return self.env.positions[self.slot].copy()
+
+    @position.setter
+    def position(self, position):
+        self.env.positions[self.slot] = position
+
+    @property
+    def rotation(self):
+        return float(self.env.rotations[self.slot])
+
+    @rotation.setter
+    def rotation(self, angle: float):
+        self.env.rotations[self.slot] = angle
+
+    @property
+    def speed(self):
+        return float(self.env.speeds[self.slot])
+
+    @speed.setter
+    def speed(self, speed: float):
+        self.env.speeds[self.slot] = speed
+
+    @property
+    def ball(self):
+        if self.env.possessor[0] == self.slot:
+            return self.env.ball
+        return None
+
+    @ball.setter
+    def ball(self, ball):
+        # possession is tracked by the environment's possessor slot, see BallView.possessor
+        pass
+
+
+class BallView(Ball):
+    # a Ball whose state lives in the environment's ball arrays
+    def __init__(self, env: "VectorizedBluelockEnvironment", ball: Ball):
+        self.env = env
+        self.size = ball.size
+        self.friction = ball.friction
+
+    @property
+    def position(self):
+        return self.env.ball_position.copy()
+
+    @position.setter
+    def position(self, position):
+        self.env.ball_position[:] = position
+
+    @property
+    def speed(self):
+        return float(self.env.ball_speed[0])
+
+    @speed.setter
+    def speed(self, speed: float):
+        self.env.ball_speed[0] = speed
+
+    @property
+    def direction(self):
+        return float(self.env.ball_direction[0])
+
+    @direction.setter
+    def direction(self, direction: float):
+        self.env.ball_direction[0] = direction
+
+    @property
+    def possessor(self):
+        slot = self.env.possessor[0]
+        if slot < 0:
+            return None
+        return self.env.players[slot]
+
+    @possessor.setter
+    def possessor(self, player: PlayerView | None):
+        self.env.possessor[0] = -1 if player is None else player.slot
+
+    def is_possessed(self):
+        return self.env.possessor[0] >= 0
+
+
+class VectorizedBluelockEnvironment(BluelockEnvironment):
+    """
+    Struct-of-arrays alternative to BluelockEnvironment. Every player occupies a slot
+    (offense first, then defense) in contiguous arrays which are advanced, possession
+    checked and clamped with a handful of NumPy operations per tick. The Player and
+    Ball objects handed out are views over those arrays.
+    """
+
+    def __init__(
+        self,
+        dims: tuple[int, int],
+        offense: list[Offender],
+        defense: list[Defender],
+        ball: Ball,
+    ):
+        self.width, self.height = dims
+        self.simulation_time = 0
+        self.possession_changed_at = 0
+        self.controllers = ControllerPipeline()
+        self.allocate(len(offense) + len(defense))
+        self.load(offense, defense, ball)
+
+    def allocate(self, player_count: int):
+        self.positions = np.zeros((player_count, 2))
+        self.rotations = np.zeros(player_count)
+        self.speeds = np.zeros(player_count)
+        self.top_speeds = np.zeros(player_count)
+        self.sizes = np.zeros(player_count)
+        self.teams = np.zeros(player_count, dtype=int)
+        self.ball_position = np.zeros(2)
+        self.ball_speed = np.zeros(1)
+        self.ball_direction = np.zeros(1)
+        self.possessor = np.full(1, -1)
+
+    def load(self, offense: list[Offender], defense: list[Defender], ball: Ball):
+        players = offense + defense
+        self.offense_count = len(offense)
+        for slot, player in enumerate(players):
+            self.positions[slot] = player.position
+            self.rotations[slot] = player.rotation
+            self.speeds[slot] = player.speed
+            self.top_speeds[slot] = player.top_speed
+            self.sizes[slot] = player.size
+            self.teams[slot] = player.team
+        self.ball_position[:] = ball.position
+        self.ball_speed[0] = ball.speed
+        self.ball_direction[0] = ball.direction
+        self.possessor[0] = -1
+        for slot, player in enumerate(players):
+            if ball.possessor is player:
+                self.possessor[0] = slot
+
+        views = [PlayerView(self, slot, player) for slot, player in enumerate(players)]
+        self.offense = views[: self.offense_count]
+        self.defense = views[self.offense_count :]
+        self.ball = BallView(self, ball)
+        self.index_roster()
+
+        # static per-slot quantities used every tick
+        self.reach = self.sizes + ball.size
+        self.lower_bounds = np.repeat(self.sizes[:, None], 2, axis=1)
+        self.upper_bounds = np.array([self.width, self.height]) - self.lower_bounds
+        self.velocities = np.zeros_like(self.positions)
+
+    def get_player_positions(self):
+        return self.positions.copy()
+
+    def does_defense_have_possession(self):
+        return self.possessor[0] >= self.offense_count
+
+    def does_offense_have_possession(self):
+        return 0 <= self.possessor[0] < self.offense_count
+
+    def possess(self, slot: int):
+        self.possessor[0] = slot
+        self.ball_speed[0] = 0
+        self.ball_direction[0] = 0
+
+    def update_ball(self, dt: int):
+        speed, direction = self.ball_speed[0], self.ball_direction[0]
+        self.ball_position[0] += math.cos(direction) * speed * dt
+        self.ball_position[1] += math.sin(direction) * speed * dt
+        self.ball_speed[0] = max(0, speed - self.ball.friction * dt)
+
+    def move_players(self, dt: int):
+        np.cos(self.rotations, out=self.velocities[:, 0])
+        np.sin(self.rotations, out=self.velocities[:, 1])
+        self.velocities *= self.speeds[:, None]
+        self.velocities *= dt
+        self.positions += self.velocities
+        self.speeds[:] = 0
+
+    def get_ball_contacts(self, center: np.ndarray, start: int, stop: int):
+        displacement = self.positions[start:stop] - center
+        dists = np.sqrt(np.sum(displacement**2, axis=1))
+        return np.flatnonzero(dists <= self.reach[start:stop]) + start
+
+    def contest_ball(self, center: np.ndarray):
+        # defenders take the ball in slot order, each later defender contesting the new holder
+        contacts = self.get_ball_contacts(center, self.offense_count, len(self.players))
+        if len(contacts) == 0:
+            return
+        self.possess(contacts[0])
+        for slot in range(contacts[0] + 1, len(self.players)):
+            holder = self.positions[self.possessor[0]]
+            if len(self.get_ball_contacts(holder, slot, slot + 1)) > 0:
+                self.possess(slot)
+
+    def claim_loose_ball(self):
+        contacts = self.get_ball_contacts(self.ball_position, 0, self.offense_count)
+        if len(contacts) > 0:
+            self.possess(contacts[0])
+
+    def clamp_players(self):
+        np.minimum(self.positions, self.upper_bounds, out=self.positions)
+        np.maximum(self.positions, self.lower_bounds, out=self.positions)
+
+    def clamp_ball(self):
+        if self.possessor[0] < 0:
+            size = self.ball.size
+            self.ball_position[0] = max(
+                min(self.ball_position[0], self.width - size), size
+            )
+            self.ball_position[1] = max(
+                min(self.ball_position[1], self.height - size), size
+            )
+
+    def tick(self, dt: int):
+        self.simulation_time += dt
+        possessor = self.possessor[0]
+        does_defense_have_possession = self.does_defense_have_possession()
+        if self.possessor[0] < 0:
+            self.update_ball(dt)
+            contest_center = self.ball_position.copy()
+        else:
+            # defenders contest the holder where they stood before moving
+            contest_center = self.positions[self.possessor[0]].copy()
+
+        self.move_players(dt)
+        if not does_defense_have_possession:
+            self.contest_ball(contest_center)
+        if self.possessor[0] < 0:
+            self.claim_loose_ball()
+        self.clamp_players()
+        self.clamp_ball()
+        if self.possessor[0] != possessor:
+            self.possession_changed_at = self.simulation_time
@@ -0,0 +1,217 @@
+import atexit
+import gzip
+import io
+import os
+import pickle
+import queue
+import shutil
+import threading
+from itertools import count
+from dataclasses import dataclass
+from neat.reporting import ReporterSet
+
+# writes between full snapshots, the checkpoints in between are deltas against the last
+FULL_INTERVAL = 10
+CONFIG_FILE = "config"
+FULL_FILE = "full"
+DELTA_FILE = "delta"
+
+
+@dataclass
+class Snapshot:
+    # a checkpoint pickled on the caller's thread, so the populations are free to change
+    generation: int
+    genomes: dict[tuple[int, int], bytes]  # (population index, genome key) to genome
+    species: bytes
+    random_state: object
+
+
+class GenomePickler(pickle.Pickler):
+    # genomes of the checkpointed populations are pickled by key, species sets only hold
+    # references to them, reporters are left to the population that restores them
+    def __init__(self, file, references: dict[int, tuple]):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.references = references
+
+    def persistent_id(self, obj):
+        if isinstance(obj, ReporterSet):
+            return ("reporters",)
+        return self.references.get(id(obj))
+
+
+class GenomeUnpickler(pickle.Unpickler):
+    def __init__(self, file, genomes: dict[tuple[int, int], object]):
+        super().__init__(file)
+        self.genomes = genomes
+
+    def persistent_load(self, pid):
+        if pid[0] == "reporters":
+            return ReporterSet()
+        _, index, key = pid
+        return self.genomes[(index, key)]
+
+
+def take_snapshot(
+    generation: int, populations: list[dict], species_sets: list, random_state
+) -> Snapshot:
+    genomes, references = {}, {}
+    for index, population in enumerate(populations):
+        for key, genome in population.items():
+            genomes[(index, key)] = pickle.dumps(genome, pickle.HIGHEST_PROTOCOL)
+            references[id(genome)] = ("genome", index, key)
+    species = io.BytesIO()
+    GenomePickler(species, references).dump(species_sets)
+    return Snapshot(generation, genomes, species.getvalue(), random_state)
+
+
+def write_atomically(path: str, data):
+    # a reader sees the old file or the new one, never half of one
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(gzip.compress(pickle.dumps(data, pickle.HIGHEST_PROTOCOL)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temporary_path, path)
+
+
+def read(path: str):
+    with open(path, "rb") as f:
+        return pickle.loads(gzip.decompress(f.read()))
+
+
+class CheckpointWriter:
+    """
+    Checkpoints populations partly off the generation loop. Every write still pickles
+    every genome on the caller's thread, so the populations are free to change once it
+    returns, only compression and writing happen on a background thread, each file
+    through a temporary file and a rename. A checkpoint is a directory: the configs,
+    written once per run, a full snapshot, and a delta holding only the genomes that
+    changed since the full snapshot. Every full_interval writes the delta is compacted
+    into a new full snapshot. A new directory is built under a temporary name and
+    renamed into place once it holds a full snapshot, so it can always be read.
+    """
+
+    def __init__(self, path: str, full_interval: int = FULL_INTERVAL):
+        self.path = path
+        self.full_interval = full_interval
+        self.base: Snapshot | None = None
+        self.writes = 0
+        self.is_config_written = False
+        self.error: BaseException | None = None
+        # one checkpoint waiting behind the one being written, the loop waits after that
+        self.pending = queue.Queue(maxsize=1)
+        threading.Thread(target=self.run, daemon=True).start()
+        atexit.register(self.flush)
+
+    def write(
+        self,
+        generation: int,
+        configs: list,
+        populations: list[dict],
+        species_sets: list,
+        random_state,
+    ):
+        self.raise_error()
+        snapshot = take_snapshot(generation, populations, species_sets, random_state)
+        files = []
+        if not self.is_config_written:
+            files.append((CONFIG_FILE, configs))
+            self.is_config_written = True
+        if self.base is None or self.writes % self.full_interval == 0:
+            self.base = snapshot
+            files.append(
+                (
+                    FULL_FILE,
+                    (
+                        snapshot.generation,
+                        snapshot.genomes,
+                        snapshot.species,
+                        snapshot.random_state,
+                    ),
+                )
+            )
+            files.append((DELTA_FILE, None))
+        else:
+            changed = {
+                key: genome
+                for key, genome in snapshot.genomes.items()
+                if self.base.genomes.get(key) != genome
+            }
+            files.append(
+                (
+                    DELTA_FILE,
+                    (
+                        self.base.generation,
+                        snapshot.generation,
+                        changed,
+                        list(snapshot.genomes),
+                        snapshot.species,
+                        snapshot.random_state,
+                    ),
+                )
+            )
+        self.writes += 1
+        self.pending.put(files)
+
+    def run(self):
+        while True:
+            files = self.pending.get()
+            try:
+                if os.path.isfile(self.path):
+                    # a checkpoint from before checkpoints were directories, it has been
+                    # restored from by now so it is kept aside rather than in the way
+                    os.replace(self.path, f"{self.path}.old")
+                directory = self.path
+                if not os.path.isdir(self.path):
+                    directory = f"{self.path}.tmp"
+                    # left behind by a run that died before its first checkpoint
+                    shutil.rmtree(directory, ignore_errors=True)
+                    os.makedirs(directory)
+                for name, data in files:
+                    path = os.path.join(directory, name)
+                    if data is not None:
+                        write_atomically(path, data)
+                    elif os.path.exists(path):
+                        os.remove(path)
+                if directory != self.path:
+                    os.replace(directory, self.path)
+            except BaseException as error:
+                self.error = error
+            finally:
+                self.pending.task_done()
+
+    def flush(self):
+        # waits for every checkpoint written so far to be on disk
+        self.pending.join()
+        self.raise_error()
+
+    def raise_error(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+
+
+def read_checkpoint(path: str):
+    # (generation, configs, populations, species sets, random state) of a checkpoint
+    configs = read(os.path.join(path, CONFIG_FILE))
+    generation, genomes, species, random_state = read(os.path.join(path, FULL_FILE))
+    delta_path = os.path.join(path, DELTA_FILE)
+    if os.path.exists(delta_path):
+        base_generation, delta_generation, changed, keys, delta_species, state = read(
+            delta_path
+        )
+        # a delta left behind by an interrupted compaction belongs to an older snapshot
+        if base_generation == generation:
+            genomes = {key: changed.get(key, genomes.get(key)) for key in keys}
+            generation, species, random_state = delta_generation, delta_species, state
+    objects = {key: pickle.loads(genome) for key, genome in genomes.items()}
+    species_sets = GenomeUnpickler(io.BytesIO(species), objects).load()
+    populations = [{} for _ in configs]
+    for (index, key), genome in objects.items():
+        populations[index][key] = genome
+    for config, population in zip(configs, populations):
+        # configs are written once per run, the node indexer they hold is as old as
+        # that write, it carries on from the restored genomes instead
+        node_keys = [key for genome in population.values() for key in genome.nodes]
+        config.genome_config.node_indexer = count(max(node_keys, default=0) + 1)
+    return generation, configs, populations, species_sets, random_state
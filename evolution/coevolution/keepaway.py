@@ -1,15 +1,21 @@
+import numpy as np
 import neat
-import json
 from environment.config import ENVIRONMENT_HEIGHT, ENVIRONMENT_WIDTH
 from evolution.coevolution.task import CoevolutionTask
+from evolution.episodes import EpisodeBank
+from evolution.metrics import MetricsSink
 from evolution.config import (
     CHECKPOINTS_PATH,
     MODELS_PATH,
     PLOTS_PATH,
     get_default_config,
 )
-from evolution.util import get_keepaway2v1_fitness, get_keepaway2v1_env
-from evolution.sequential.keepaway import with_fully_learned_behaviors
+from evolution.util import get_keepaway2v1_batch_fitness, get_keepaway2v1_env
+from evolution.sequential.keepaway import (
+    with_fully_learned_behaviors,
+    fuse_fully_learned_behaviors,
+    get_batch_fully_learned_behaviors_control,
+)
 from util import get_random_point
 from visualization.visualizer import BluelockEnvironmentVisualizer
 
@@ -17,7 +23,7 @@ TASK_NAME = "coevolved_keepaway"
 
 
 class CoevolvedKeepaway(CoevolutionTask):
-    def __init__(self, difficulty=0.5, is_dynamic=False):
+    def __init__(self, difficulty=0.5, is_dynamic=False, decision_interval=15):
         task_name = TASK_NAME
         if is_dynamic:
             task_name = f"{TASK_NAME}_dynamic"
@@ -28,8 +34,10 @@ class CoevolvedKeepaway(CoevolutionTask):
         )
         self.difficulty = difficulty
         self.is_dynamic = is_dynamic
+        # how often the offense re-decides, physics in between is resolved at the training dt
+        self.decision_interval = decision_interval
 
-    def get_episodes(self):
+    def get_episodes(self, rng: np.random.Generator | None = None):
         envs = []
         for _ in range(10):
             if self.is_dynamic:
@@ -37,55 +45,53 @@ class CoevolvedKeepaway(CoevolutionTask):
                     get_keepaway2v1_env(
                         self.difficulty,
                         defender_pos=get_random_point(
-                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT
+                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng
                         ),
                         possessor_pos=get_random_point(
-                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT
+                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng
                         ),
+                        rng=rng,
                     )
                 )
             else:
-                envs.append(get_keepaway2v1_env(self.difficulty))
+                envs.append(get_keepaway2v1_env(self.difficulty, rng=rng))
         return envs
 
-    def compute_fitness(self, genomes, configs) -> float:
+    def compute_bank_fitness(self, genomes, configs, bank: EpisodeBank) -> float:
         nets = []
         for genome, config in zip(genomes, configs):
             nets.append(neat.nn.FeedForwardNetwork.create(genome, config))
 
-        seeker, passer, find_spacer, pass_evaluator = nets
+        behaviors = fuse_fully_learned_behaviors(*nets)
         dt, allotted = 15, 24000
-        episodes = self.get_episodes()
-        fitness = 0
-        for env in episodes:
-            env = with_fully_learned_behaviors(
-                env, seeker, passer, find_spacer, pass_evaluator
-            )
-            for elapsed in range(0, allotted, dt):
-                if env.does_defense_have_possession():
-                    break
-                env.update(dt)
-
-            fitness += get_keepaway2v1_fitness(elapsed / allotted)
-        return fitness / len(episodes)
+        batch = bank.get_batch()
+        return get_keepaway2v1_batch_fitness(
+            batch,
+            get_batch_fully_learned_behaviors_control(batch, behaviors),
+            dt,
+            allotted,
+            self.decision_interval,
+        )
 
 
 def coevolve_keepaway():
-    stats = {"difficulty": {}, "fitness": {}}
     task = CoevolvedKeepaway()
-    eval_count = 0
-    for best_team in task.evolve(101, 5):
-        eval_count += 1
-        fitness = task.compute_fitness(best_team, task.configs)
-        print(
-            f"{eval_count} test at difficulty {task.difficulty} resulted in fitness of {fitness}"
-        )
-        if fitness > 0.8:
-            task.difficulty += 0.05
-        stats["difficulty"][eval_count] = task.difficulty
-        stats["fitness"][eval_count] = fitness
-        with open(f"coevolved_keepaway_stats.json", "w") as f:
-            json.dump(stats, f, indent=2, sort_keys=True)
+    with MetricsSink("coevolved_keepaway_metrics.jsonl") as metrics:
+        eval_count = 0
+        for best_team in task.evolve(101, 5, metrics=metrics):
+            eval_count += 1
+            fitness = task.compute_test_fitness(best_team, task.configs)
+            print(
+                f"{eval_count} test at difficulty {task.difficulty} resulted in fitness of {fitness}"
+            )
+            if fitness > 0.8:
+                task.difficulty += 0.05
+            metrics.record(
+                "test",
+                evaluation=eval_count,
+                difficulty=task.difficulty,
+                fitness=fitness,
+            )
 
 
 def watch_coevolved_keepaway():
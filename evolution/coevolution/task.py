@@ -6,7 +6,15 @@ import time
 import pickle
 import gzip
 import sys
+import numpy as np
+from environment.core import BluelockEnvironment
 from evolution.util import EvolutionVisualizer
+from evolution.episodes import EpisodeBank, get_test_seed
+from evolution.workers import WorkerPool, create_pool
+from evolution.checkpoints import CheckpointWriter, read_checkpoint
+from evolution.models import save_genomes, get_networks
+from evolution.hall_of_fame import HallOfFame
+from evolution.metrics import MetricsSink
 
 
 class CoevolutionTask:
@@ -33,11 +41,22 @@ class CoevolutionTask:
         self.checkpoint_path = os.path.join(checkpoint_dir, self.task_name)
         self.plot_path = os.path.join(plot_dir, self.task_name)
         self.model_path = os.path.join(model_dir, self.task_name)
+        self.hall_of_fame = HallOfFame(
+            os.path.join(model_dir, f"{self.task_name}_hall_of_fame")
+        )
         self.configs = configs
         self.cpus = cpus
+        # the curriculum's difficulty, for tasks that have one
+        self.difficulty: float | None = None
         self.seed = self.get_seed()
+        self.bank: EpisodeBank | None = None
 
-    def evolve(self, generations: int, generation_step_size: int = 5):
+    def evolve(
+        self,
+        generations: int,
+        generation_step_size: int = 5,
+        metrics: MetricsSink | None = None,
+    ):
         def noop_fitness(genome, config):
             pass
 
@@ -52,32 +71,59 @@ class CoevolutionTask:
         for tag, population in zip(self.population_tags, populations):
             population.add_reporter(EvolutionVisualizer(f"{self.plot_path}_{tag})"))
 
-        for generation in range(start_generation, generations):
-            self.checkpoint(populations, generation)
-            for tag, population in zip(self.population_tags, populations):
-                print(f"{generation}: {tag} {len(population.population)}")
-            start = time.monotonic()
-            teams = self.get_teams(populations)
-            performances = self.evaluate_teams(teams, self.configs)
-            best_performing_team, best_performance = teams[0], float("-inf")
-            for team, performance in zip(teams, performances):
-                for individual in team:
-                    individual.fitness += performance
-                if performance > best_performance:
-                    best_performing_team, best_performance = team, performance
-
-            self.save_best_team(best_performing_team)
-            print(
-                f"Fitness evaluation for {generation} generation finished in {round(time.monotonic() - start, 2)}s"
-            )
-            print(
-                f"The best performing team of {generation} has fitness {best_performance}"
-            )
-            for population in populations:
-                population.run(noop_fitness, n=1)
-
-            if generation > 0 and generation % generation_step_size == 0:
-                yield best_performing_team
+        # kept off the task, which is shipped to workers
+        writer = CheckpointWriter(self.checkpoint_path)
+        # evaluations so far, counted like MetricsRecorder counts them
+        evaluations = 0
+        try:
+            with create_pool(self, self.cpus) as pool:
+                for generation in range(start_generation, generations):
+                    self.checkpoint(writer, populations, generation)
+                    for tag, population in zip(self.population_tags, populations):
+                        print(f"{generation}: {tag} {len(population.population)}")
+                    start = time.monotonic()
+                    teams = self.get_teams(populations)
+                    evaluations += len(teams)
+                    performances = self.evaluate_teams(pool, teams)
+                    best_performing_team, best_performance = teams[0], float("-inf")
+                    for team, performance in zip(teams, performances):
+                        for individual in team:
+                            individual.fitness += performance
+                        if performance > best_performance:
+                            best_performing_team, best_performance = team, performance
+
+                    self.save_best_team(best_performing_team)
+                    self.hall_of_fame.add_genomes(
+                        best_performing_team,
+                        self.configs,
+                        generation,
+                        best_performance,
+                        self.difficulty,
+                    )
+                    print(
+                        f"Fitness evaluation for {generation} generation finished in {round(time.monotonic() - start, 2)}s"
+                    )
+                    print(
+                        f"The best performing team of {generation} has fitness {best_performance}"
+                    )
+                    if metrics is not None:
+                        metrics.record(
+                            "generation",
+                            tag=self.task_name,
+                            generation=generation,
+                            seconds=time.monotonic() - start,
+                            evaluations=evaluations,
+                            best_fitness=best_performance,
+                            mean_fitness=sum(performances) / len(performances),
+                        )
+                    for population in populations:
+                        population.run(noop_fitness, n=1)
+
+                    if generation > 0 and generation % generation_step_size == 0:
+                        yield best_performing_team
+        finally:
+            # on disk once evolving ends, also when the generator is closed early
+            writer.flush()
 
     def get_teams(self, populations: list[neat.Population], participations=5):
         def pick_random_individual(individuals):
@@ -112,55 +158,86 @@ class CoevolutionTask:
 
         return teams
 
-    def checkpoint(self, populations: list[neat.Population], generation: int):
-        pop_data = []
-        for population in populations:
-            pop_data.append(
-                (population.population, population.config, population.species)
-            )
-
-        data = (generation, pop_data, random.getstate())
-        with open(self.checkpoint_path, "wb") as f:
-            f.write(gzip.compress(pickle.dumps(data)))
+    def checkpoint(
+        self,
+        writer: CheckpointWriter,
+        populations: list[neat.Population],
+        generation: int,
+    ):
+        writer.write(
+            generation,
+            [population.config for population in populations],
+            [population.population for population in populations],
+            [population.species for population in populations],
+            random.getstate(),
+        )
 
     def load_checkpoint(self):
-        with open(self.checkpoint_path, "rb") as f:
-            generation, pop_data, random_state = pickle.loads(gzip.decompress(f.read()))
-            populations = []
-            for individuals, config, species in pop_data:
-                populations.append(neat.Population(config, (individuals, species, 0)))
-            random.setstate(random_state)
-            return populations, generation
+        if os.path.isfile(self.checkpoint_path):
+            # a checkpoint from before checkpoints were directories
+            with open(self.checkpoint_path, "rb") as f:
+                generation, pop_data, random_state = pickle.loads(
+                    gzip.decompress(f.read())
+                )
+        else:
+            generation, configs, individuals, species_sets, random_state = (
+                read_checkpoint(self.checkpoint_path)
+            )
+            pop_data = zip(individuals, configs, species_sets)
+        populations = []
+        for individuals, config, species in pop_data:
+            population = neat.Population(config, (individuals, species, 0))
+            species.reporters = population.reporters
+            populations.append(population)
+        random.setstate(random_state)
+        return populations, generation
 
     def save_best_team(self, genomes):
-        with open(self.model_path, "wb") as f:
-            f.write(gzip.compress(pickle.dumps(genomes)))
+        save_genomes(self.model_path, genomes, self.configs)
 
     def load_best_team(self):
-        with open(self.model_path, "rb") as f:
-            genomes = pickle.loads(gzip.decompress(f.read()))
-            nets = []
-            for genome, config in zip(genomes, self.configs):
-                nets.append(neat.nn.FeedForwardNetwork.create(genome, config))
-            return nets
+        return get_networks(self.model_path, self.configs)
 
     def compute_fitness(self, genomes, configs) -> float:
+        return self.compute_bank_fitness(genomes, configs, self.get_episode_bank())
+
+    def compute_test_fitness(self, genomes, configs) -> float:
+        # on episodes of its own rather than those of the generation the team came from
+        bank = EpisodeBank.generate(self.get_episodes, get_test_seed(), self.difficulty)
+        return self.compute_bank_fitness(genomes, configs, bank)
+
+    # override, the fitness of a team over the episodes of bank
+    def compute_bank_fitness(self, genomes, configs, bank: EpisodeBank) -> float:
         return float("-inf")
 
-    def evaluate_teams(self, teams, configs) -> list[float]:
+    def get_episodes(
+        self, rng: np.random.Generator | None = None
+    ) -> list[BluelockEnvironment]:
+        return []
+
+    def get_episode_bank(self) -> EpisodeBank:
+        # drawn again when the seed or the difficulty the episodes are shaped by changes
+        key = (self.seed, self.difficulty)
+        if self.bank is None or (self.bank.seed, self.bank.difficulty) != key:
+            self.bank = EpisodeBank.generate(
+                self.get_episodes, self.seed, self.difficulty
+            )
+        return self.bank
+
+    def use_bank(self, bank: EpisodeBank):
+        # a worker takes on a broadcast bank along with the seed and difficulty of it
+        self.bank, self.seed, self.difficulty = bank, bank.seed, bank.difficulty
+
+    def evaluate_teams(self, pool: WorkerPool, teams) -> list[float]:
+        # the generation's episodes are drawn once here and broadcast to the workers
         self.seed = self.get_seed()
-        performances = []
-        with multiprocessing.Pool(processes=self.cpus) as pool:
-            evals = []
-            for team in teams:
-                eval = pool.apply_async(self.evaluate_team, (team, configs))
-                evals.append(eval)
-            for _, eval in enumerate(evals):
-                performances.append(eval.get(None))
-        return performances
+        return pool.evaluate(self.get_episode_bank(), teams)
+
+    def evaluate_chunk(self, teams) -> list[float]:
+        # runs in a worker, which already holds the task, its configs and episode bank
+        return [self.evaluate_team(team, self.configs) for team in teams]
 
     def evaluate_team(self, team, configs) -> float:
-        random.seed(self.seed)
         return self.compute_fitness(team, configs)
 
     def get_seed(self):
@@ -1,3 +1,4 @@
+import copy
 import os
 import neat
 
@@ -8,11 +9,22 @@ CONFIGS_PATH = os.path.join(os.path.dirname(__file__), "config")
 PLOTS_PATH = os.path.join(output_path, "plots")
 
 
+# configs parsed in this process by their file's path, with the mtime they were parsed at
+parsed_configs: dict[str, tuple[int, neat.Config]] = {}
+
+
 def get_default_config(config_file):
-    return neat.Config(
-        neat.DefaultGenome,
-        neat.DefaultReproduction,
-        neat.DefaultSpeciesSet,
-        neat.DefaultStagnation,
-        os.path.join(CONFIGS_PATH, config_file),
-    )
+    # parsed once, every caller gets a copy of its own, since a config holds state like
+    # the node indexer of its genomes
+    path = os.path.join(CONFIGS_PATH, config_file)
+    mtime = os.stat(path).st_mtime_ns
+    if path not in parsed_configs or parsed_configs[path][0] != mtime:
+        config = neat.Config(
+            neat.DefaultGenome,
+            neat.DefaultReproduction,
+            neat.DefaultSpeciesSet,
+            neat.DefaultStagnation,
+            path,
+        )
+        parsed_configs[path] = (mtime, config)
+    return copy.deepcopy(parsed_configs[path][1])
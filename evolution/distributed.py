@@ -0,0 +1,235 @@
+import pickle
+import queue
+import select
+import socket
+import struct
+import threading
+import time
+import traceback
+from dataclasses import dataclass
+from typing import Callable
+from evolution.episodes import EpisodeBank
+from evolution.workers import CHUNKS_PER_PROCESS, get_chunks
+
+# seconds, a worker beats every interval and is given up on after the timeout
+HEARTBEAT_INTERVAL = 1.0
+HEARTBEAT_TIMEOUT = 10.0
+# how many workers a chunk may be lost on before its evaluation fails
+MAX_ATTEMPTS = 3
+FRAME_HEADER = struct.Struct("!Q")
+
+
+class Channel:
+    """
+    (kind, payload) messages framed as length prefixed pickles over a socket. Pickles
+    run code when loaded, so only connect coordinators and workers that trust each
+    other, on a private network.
+    """
+
+    def __init__(self, sock: socket.socket):
+        self.sock = sock
+        # workers send heartbeats from a second thread
+        self.send_lock = threading.Lock()
+
+    def send(self, kind: str, payload=None):
+        data = pickle.dumps((kind, payload), protocol=pickle.HIGHEST_PROTOCOL)
+        with self.send_lock:
+            self.sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+    def receive(self) -> tuple[str, object]:
+        (size,) = FRAME_HEADER.unpack(self.receive_exactly(FRAME_HEADER.size))
+        return pickle.loads(self.receive_exactly(size))
+
+    def receive_exactly(self, size: int) -> bytes:
+        buffer = bytearray()
+        while len(buffer) < size:
+            data = self.sock.recv(size - len(buffer))
+            if not data:
+                raise ConnectionError("The other side closed the connection")
+            buffer.extend(data)
+        return bytes(buffer)
+
+    def is_readable(self):
+        readable, _, _ = select.select([self.sock], [], [], 0)
+        return len(readable) > 0
+
+    def close(self):
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+@dataclass
+class Job:
+    # a chunk of work, the bank it is evaluated on and where its results go
+    bank: EpisodeBank
+    items: list
+    callback: Callable[[list], None]
+    error_callback: Callable[[BaseException], None]
+    attempts: int = 0
+
+
+class DistributedPool:
+    """
+    Evaluates chunks of work on worker processes connected over TCP, a drop-in for
+    WorkerPool that scales a generation across machines. A worker is sent the task once
+    when it connects and the episode bank whenever it changes, then takes one chunk at
+    a time from a shared queue. A worker that stops beating or drops its connection
+    has its chunk put back for another worker. Results come back in the order of the
+    items. Start workers with `python main.py worker --host <host> --port <port>`.
+    """
+
+    def __init__(self, task, processes: int, address: tuple[str, int]):
+        self.task = task
+        self.processes = processes
+        self.bank: EpisodeBank | None = None
+        self.jobs: queue.Queue[Job] = queue.Queue()
+        self.worker_count = 0
+        self.lock = threading.Lock()
+        self.is_closed = False
+        self.server = socket.create_server(address)
+        self.address = self.server.getsockname()
+        print(f"Waiting for workers on {self.address[0]}:{self.address[1]}")
+        threading.Thread(target=self.accept, daemon=True).start()
+
+    def accept(self):
+        while not self.is_closed:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            threading.Thread(
+                target=self.serve, args=(Channel(sock),), daemon=True
+            ).start()
+
+    def serve(self, channel: Channel):
+        channel.sock.settimeout(HEARTBEAT_TIMEOUT)
+        with self.lock:
+            self.worker_count += 1
+        job, sent_bank, last_seen = None, None, time.monotonic()
+        try:
+            channel.send("task", self.task)
+            while not self.is_closed:
+                try:
+                    job = self.jobs.get(timeout=HEARTBEAT_INTERVAL)
+                except queue.Empty:
+                    # an idle worker still has to be heard from
+                    while channel.is_readable():
+                        channel.receive()
+                        last_seen = time.monotonic()
+                    if time.monotonic() - last_seen > HEARTBEAT_TIMEOUT:
+                        raise TimeoutError("The worker stopped sending heartbeats")
+                    continue
+
+                if job.bank is not sent_bank:
+                    channel.send("bank", job.bank)
+                    sent_bank = job.bank
+                channel.send("chunk", job.items)
+                kind, payload = channel.receive()
+                while kind == "heartbeat":
+                    kind, payload = channel.receive()
+                last_seen = time.monotonic()
+                finished, job = job, None
+                if kind == "result":
+                    finished.callback(payload)
+                else:
+                    finished.error_callback(RuntimeError(payload))
+        except (OSError, ConnectionError):
+            if job is not None:
+                self.retry(job)
+        finally:
+            with self.lock:
+                self.worker_count -= 1
+            channel.close()
+
+    def retry(self, job: Job):
+        job.attempts += 1
+        if job.attempts >= MAX_ATTEMPTS:
+            job.error_callback(
+                ConnectionError(f"A chunk was lost on {job.attempts} workers")
+            )
+        else:
+            self.jobs.put(job)
+
+    def broadcast(self, bank: EpisodeBank):
+        self.bank = bank
+
+    def submit(self, items: list, callback, error_callback):
+        self.jobs.put(Job(self.bank, items, callback, error_callback))
+
+    def evaluate(
+        self, bank: EpisodeBank, items: list, chunk_count: int | None = None
+    ) -> list:
+        self.broadcast(bank)
+        worker_count = max(self.processes, self.worker_count)
+        chunks = get_chunks(items, chunk_count or worker_count * CHUNKS_PER_PROCESS)
+        finished = queue.Queue()
+        for index, chunk in enumerate(chunks):
+            self.submit(
+                chunk,
+                lambda results, index=index: finished.put((index, results)),
+                lambda error, index=index: finished.put((index, error)),
+            )
+        chunk_results = [None] * len(chunks)
+        for _ in chunks:
+            index, results = finished.get()
+            if isinstance(results, BaseException):
+                raise results
+            chunk_results[index] = results
+        return [result for results in chunk_results for result in results]
+
+    def close(self):
+        self.is_closed = True
+        self.server.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def connect(host: str, port: int) -> Channel:
+    # workers may be started before the coordinator is listening
+    while True:
+        try:
+            return Channel(socket.create_connection((host, port)))
+        except ConnectionRefusedError:
+            time.sleep(HEARTBEAT_INTERVAL)
+
+
+def run_worker(host: str, port: int):
+    # evaluates chunks for a DistributedPool until it goes away
+    channel = connect(host, port)
+    is_stopped = threading.Event()
+
+    def beat():
+        while not is_stopped.wait(HEARTBEAT_INTERVAL):
+            try:
+                channel.send("heartbeat")
+            except OSError:
+                return
+
+    threading.Thread(target=beat, daemon=True).start()
+    task = None
+    try:
+        while True:
+            kind, payload = channel.receive()
+            if kind == "task":
+                task = payload
+            elif kind == "bank":
+                task.use_bank(payload)
+            elif kind == "chunk":
+                try:
+                    results = task.evaluate_chunk(payload)
+                except Exception:
+                    channel.send("error", traceback.format_exc())
+                    continue
+                channel.send("result", results)
+    except (OSError, ConnectionError):
+        pass
+    finally:
+        is_stopped.set()
+        channel.close()
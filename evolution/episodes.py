@@ -0,0 +1,224 @@
+import numpy as np
+from dataclasses import dataclass, replace
+from typing import Callable
+from environment.core import BluelockEnvironment, Offender, Defender, Ball
+from environment.batched import BatchedBluelockEnvironment
+from environment.control import ControllerPipeline
+
+
+def get_test_seed() -> int:
+    # drawn from the OS, so a test never replays the episodes of a generation
+    return np.random.SeedSequence().entropy
+
+
+@dataclass
+class EpisodeBank:
+    """
+    The initial states of a generation's episodes kept as flat arrays, so a bank is cheap
+    to pickle over to workers. Episodes are drawn once per generation from a NumPy
+    Generator seeded with the bank's seed, evaluations then materialize environments from
+    the bank or reset a pooled batch to it.
+    """
+
+    seed: int | None
+    dims: tuple[int, int]
+    ids: np.ndarray  # (players,)
+    teams: np.ndarray  # (players,)
+    offense_count: int
+    positions: np.ndarray  # (episodes, players, 2)
+    rotations: np.ndarray  # (episodes, players)
+    top_speeds: np.ndarray  # (episodes, players)
+    sizes: np.ndarray  # (episodes, players)
+    ball_positions: np.ndarray  # (episodes, 2)
+    ball_speeds: np.ndarray  # (episodes,)
+    ball_directions: np.ndarray  # (episodes,)
+    ball_sizes: np.ndarray  # (episodes,)
+    ball_frictions: np.ndarray  # (episodes,)
+    possessors: np.ndarray  # (episodes,) slot of the possessor, -1 if the ball is loose
+    # the curriculum difficulty the episodes were drawn at, for tasks that have one
+    difficulty: float | None = None
+
+    @classmethod
+    def generate(
+        cls,
+        get_episodes: Callable[[np.random.Generator], list[BluelockEnvironment]],
+        seed: int,
+        difficulty: float | None = None,
+    ) -> "EpisodeBank":
+        return cls.from_envs(
+            get_episodes(np.random.default_rng(seed)), seed, difficulty
+        )
+
+    @classmethod
+    def from_envs(
+        cls,
+        envs: list[BluelockEnvironment],
+        seed: int | None = None,
+        difficulty: float | None = None,
+    ) -> "EpisodeBank":
+        if len(envs) == 0:
+            raise ValueError("An episode bank needs at least one episode")
+        first = envs[0]
+        ids = np.array([player.id for player in first.get_players()], dtype=int)
+        for env in envs:
+            players = env.get_players()
+            if (env.width, env.height) != (first.width, first.height):
+                raise ValueError("All episodes of a bank must share dimensions")
+            if len(env.offense) != len(first.offense) or not np.array_equal(
+                [player.id for player in players], ids
+            ):
+                raise ValueError("All episodes of a bank must share a roster layout")
+
+        def gather(get_value):
+            return np.array(
+                [[get_value(player) for player in env.get_players()] for env in envs],
+                dtype=float,
+            ).reshape((len(envs), len(ids)) + np.shape(get_value(first.players[0])))
+
+        possessors = []
+        for env in envs:
+            possessor = env.ball.possessor
+            possessors.append(
+                -1 if possessor is None else env.player_slots[possessor.id]
+            )
+
+        return cls(
+            seed=seed,
+            dims=(first.width, first.height),
+            ids=ids,
+            teams=np.array([player.team for player in first.get_players()], dtype=int),
+            offense_count=len(first.offense),
+            positions=gather(lambda player: player.position),
+            rotations=gather(lambda player: player.rotation),
+            top_speeds=gather(lambda player: player.top_speed),
+            sizes=gather(lambda player: player.size),
+            ball_positions=np.array([env.ball.position for env in envs], dtype=float),
+            ball_speeds=np.array([env.ball.speed for env in envs], dtype=float),
+            ball_directions=np.array([env.ball.direction for env in envs], dtype=float),
+            ball_sizes=np.array([env.ball.size for env in envs], dtype=float),
+            ball_frictions=np.array([env.ball.friction for env in envs], dtype=float),
+            possessors=np.array(possessors, dtype=int),
+            difficulty=difficulty,
+        )
+
+    def __len__(self):
+        return len(self.positions)
+
+    def tile(self, copies: int) -> "EpisodeBank":
+        # the bank's episodes repeated copies times, episode i of copy c at c * len(self) + i
+        def repeat(values: np.ndarray):
+            return np.tile(values, (copies,) + (1,) * (values.ndim - 1))
+
+        return replace(
+            self,
+            positions=repeat(self.positions),
+            rotations=repeat(self.rotations),
+            top_speeds=repeat(self.top_speeds),
+            sizes=repeat(self.sizes),
+            ball_positions=repeat(self.ball_positions),
+            ball_speeds=repeat(self.ball_speeds),
+            ball_directions=repeat(self.ball_directions),
+            ball_sizes=repeat(self.ball_sizes),
+            ball_frictions=repeat(self.ball_frictions),
+            possessors=repeat(self.possessors),
+        )
+
+    def select(self, start: int, stop: int) -> "EpisodeBank":
+        # the bank's episodes start to stop, keeping the seed of the whole bank
+        return replace(
+            self,
+            positions=self.positions[start:stop],
+            rotations=self.rotations[start:stop],
+            top_speeds=self.top_speeds[start:stop],
+            sizes=self.sizes[start:stop],
+            ball_positions=self.ball_positions[start:stop],
+            ball_speeds=self.ball_speeds[start:stop],
+            ball_directions=self.ball_directions[start:stop],
+            ball_sizes=self.ball_sizes[start:stop],
+            ball_frictions=self.ball_frictions[start:stop],
+            possessors=self.possessors[start:stop],
+        )
+
+    def materialize(self) -> list[BluelockEnvironment]:
+        envs = []
+        for episode in range(len(self)):
+            players = []
+            for slot, id in enumerate(self.ids.tolist()):
+                position = self.positions[episode, slot]
+                if slot < self.offense_count:
+                    player = Offender(id, position)
+                else:
+                    player = Defender(id, position)
+                player.top_speed = float(self.top_speeds[episode, slot])
+                player.size = float(self.sizes[episode, slot])
+                player.rotation = float(self.rotations[episode, slot])
+                players.append(player)
+
+            ball = Ball(
+                self.ball_positions[episode],
+                size=float(self.ball_sizes[episode]),
+                friction=float(self.ball_frictions[episode]),
+            )
+            if self.possessors[episode] >= 0:
+                players[self.possessors[episode]].possess(ball)
+            ball.speed = float(self.ball_speeds[episode])
+            ball.direction = float(self.ball_directions[episode])
+            envs.append(
+                BluelockEnvironment(
+                    self.dims,
+                    offense=players[: self.offense_count],
+                    defense=players[self.offense_count :],
+                    ball=ball,
+                )
+            )
+        return envs
+
+    def get_layout(self):
+        # everything a pooled batch bakes in when it is built, a reset may only change the rest
+        return (
+            self.dims,
+            self.offense_count,
+            self.ids.tobytes(),
+            self.teams.tobytes(),
+            self.top_speeds.tobytes(),
+            self.sizes.tobytes(),
+            self.ball_sizes.tobytes(),
+            self.ball_frictions.tobytes(),
+        )
+
+    def reset(self, batch: BatchedBluelockEnvironment):
+        # puts a batch built from a bank of the same layout back at this bank's initial states
+        batch.positions[:] = self.positions
+        batch.rotations[:] = self.rotations
+        batch.speeds[:] = 0
+        batch.ball_positions[:] = self.ball_positions
+        batch.ball_speeds[:] = self.ball_speeds
+        batch.ball_directions[:] = self.ball_directions
+        batch.possessors[:] = self.possessors
+        batch.simulation_time[:] = 0
+        batch.possession_changed_at[:] = 0
+        batch.active[:] = True
+        batch.controllers = ControllerPipeline()
+        for env in batch.episodes:
+            env.controllers = ControllerPipeline()
+            env.invalidate_grid()
+
+    def get_batch(self) -> BatchedBluelockEnvironment:
+        # a batch of this bank's episodes, pooled per process so evaluations of the same
+        # layout reset one batch instead of building a fresh one
+        layout = self.get_layout()
+        batch = pooled_batches.pop(layout, None)
+        if batch is None:
+            batch = BatchedBluelockEnvironment(self.materialize())
+            if len(pooled_batches) >= POOLED_BATCH_LIMIT:
+                # the least recently used layout goes
+                del pooled_batches[next(iter(pooled_batches))]
+        else:
+            self.reset(batch)
+        pooled_batches[layout] = batch
+        return batch
+
+
+# enough for a worker to keep a batch per episode chunk of a generation
+POOLED_BATCH_LIMIT = 16
+pooled_batches: dict[tuple, BatchedBluelockEnvironment] = {}
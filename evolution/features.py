@@ -0,0 +1,175 @@
+import numpy as np
+import math
+from dataclasses import dataclass
+from environment.core import BluelockEnvironment, Player
+from environment.batched import BatchedBluelockEnvironment
+from util import Rect, get_unit_vectors
+
+# the point of a feature that is the ball rather than a role's player
+BALL = "ball"
+
+
+@dataclass(frozen=True)
+class Pitch:
+    # the static features of a pitch size
+    scale: np.ndarray  # (2,) width and height, displacements are scaled down by it
+    corners: np.ndarray  # (4, 2) in the order of Rect.get_vertices
+    vertices: list[list[float]]  # the corners as floats, for single environments
+
+
+pitches: dict[tuple[float, float], Pitch] = {}
+
+
+def get_pitch(width: float, height: float) -> Pitch:
+    # built once per pitch size and shared by every layout
+    if (width, height) not in pitches:
+        scale = np.array([width, height])
+        vertices = Rect([0.0, 0.0], height=height, width=width).get_vertices()
+        corners = np.array(vertices, dtype=float)
+        scale.flags.writeable = corners.flags.writeable = False
+        pitches[(width, height)] = Pitch(scale, corners, corners.tolist())
+    return pitches[(width, height)]
+
+
+def get_positions(
+    batch: BatchedBluelockEnvironment,
+    episodes: np.ndarray,
+    slots: dict[str, int | np.ndarray],
+    point: str,
+):
+    if point == BALL:
+        return batch.ball_positions[episodes]
+    return batch.positions[episodes, slots[point]]
+
+
+def get_point(env: BluelockEnvironment, players: dict[str, Player], point: str):
+    if point == BALL:
+        return env.ball.position.tolist()
+    return players[point].position.tolist()
+
+
+@dataclass(frozen=True)
+class Displacement:
+    # from the source to the target, each a role or the ball
+    source: str
+    target: str
+    size = 2
+
+    def get_roles(self):
+        return {self.source, self.target} - {BALL}
+
+    def encode(self, batch: BatchedBluelockEnvironment, episodes, slots, pitch: Pitch):
+        return (
+            get_positions(batch, episodes, slots, self.target)
+            - get_positions(batch, episodes, slots, self.source)
+        ) / pitch.scale
+
+    def encode_env(self, env: BluelockEnvironment, players, pitch: Pitch):
+        source_x, source_y = get_point(env, players, self.source)
+        target_x, target_y = get_point(env, players, self.target)
+        return [(target_x - source_x) / env.width, (target_y - source_y) / env.height]
+
+
+@dataclass(frozen=True)
+class CornerDisplacements:
+    # from every pitch corner to the role, or from the role to every corner
+    role: str
+    is_to_corners: bool = False
+    size = 8
+
+    def get_roles(self):
+        return {self.role}
+
+    def encode(self, batch: BatchedBluelockEnvironment, episodes, slots, pitch: Pitch):
+        positions = get_positions(batch, episodes, slots, self.role)[:, None]
+        if self.is_to_corners:
+            displacements = pitch.corners - positions
+        else:
+            displacements = positions - pitch.corners
+        return (displacements / pitch.scale).reshape(len(episodes), self.size)
+
+    def encode_env(self, env: BluelockEnvironment, players, pitch: Pitch):
+        x, y = get_point(env, players, self.role)
+        features = []
+        for corner_x, corner_y in pitch.vertices:
+            if self.is_to_corners:
+                features.append((corner_x - x) / env.width)
+                features.append((corner_y - y) / env.height)
+            else:
+                features.append((x - corner_x) / env.width)
+                features.append((y - corner_y) / env.height)
+        return features
+
+
+@dataclass(frozen=True)
+class BallVelocity:
+    size = 2
+
+    def get_roles(self):
+        return set()
+
+    def encode(self, batch: BatchedBluelockEnvironment, episodes, slots, pitch: Pitch):
+        return batch.ball_speeds[episodes, None] * get_unit_vectors(
+            batch.ball_directions[episodes]
+        )
+
+    def encode_env(self, env: BluelockEnvironment, players, pitch: Pitch):
+        ball = env.ball
+        return [
+            ball.speed * math.cos(ball.direction),
+            ball.speed * math.sin(ball.direction),
+        ]
+
+
+Feature = Displacement | CornerDisplacements | BallVelocity
+
+
+class FeatureLayout:
+    """
+    A network's inputs declared as a sequence of features over named roles. A layout
+    encodes any number of episodes of a batch in one pass over its state arrays, roles
+    are bound to player slots per call, either one slot shared by every episode or a slot
+    per episode. A single environment is encoded with plain floats instead, a row of
+    NumPy costs more than it saves. Static features of the pitch are computed once per
+    pitch size.
+    """
+
+    def __init__(self, features: list[Feature]):
+        self.features = features
+        self.size = sum(feature.size for feature in features)
+        self.roles = set().union(*(feature.get_roles() for feature in features))
+
+    def __add__(self, other: "FeatureLayout") -> "FeatureLayout":
+        return FeatureLayout(self.features + other.features)
+
+    def check_roles(self, roles: dict):
+        missing = self.roles - roles.keys()
+        if len(missing) > 0:
+            raise ValueError(f"No players were given for roles {sorted(missing)}")
+
+    def encode(
+        self,
+        batch: BatchedBluelockEnvironment,
+        episodes: np.ndarray,
+        **slots: int | np.ndarray,
+    ) -> np.ndarray:
+        self.check_roles(slots)
+        pitch = get_pitch(batch.width, batch.height)
+        features = np.empty((len(episodes), self.size))
+        start = 0
+        for feature in self.features:
+            features[:, start : start + feature.size] = feature.encode(
+                batch, episodes, slots, pitch
+            )
+            start += feature.size
+        return features
+
+    def encode_env(self, env: BluelockEnvironment, **ids: int) -> list[float]:
+        # the inputs of one environment, roles are bound to player ids
+        self.check_roles(ids)
+        pitch = get_pitch(env.width, env.height)
+        players = {role: env.get_player(id) for role, id in ids.items()}
+        features = []
+        for feature in self.features:
+            features.extend(feature.encode_env(env, players, pitch))
+        return features
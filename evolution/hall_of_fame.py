@@ -0,0 +1,129 @@
+import math
+import os
+import struct
+import neat
+import numpy as np
+from dataclasses import dataclass
+from evolution.models import decode_networks, encode_networks
+
+# offset and size of an entry's networks, its generation, fitness and difficulty
+INDEX_RECORD = struct.Struct("<QQqdd")
+
+
+@dataclass(frozen=True)
+class Fame:
+    # the metadata of an entry, difficulty is None for tasks without a curriculum
+    index: int
+    generation: int
+    fitness: float
+    difficulty: float | None
+
+
+class HallOfFame:
+    """
+    An append-only archive of a task's best networks, a genome or a team per entry. The
+    networks are appended to one file in the format of evolution.models and a fixed
+    size record per entry to an index next to it, so any entry is found with one seek
+    and reading entries never loads the whole archive. An entry is indexed only once
+    its networks are written, an interrupted append leaves no entry behind.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = f"{path}.index"
+
+    def __len__(self):
+        if not os.path.exists(self.index_path):
+            return 0
+        # a record torn by an interrupted append is not counted
+        return os.path.getsize(self.index_path) // INDEX_RECORD.size
+
+    def add(
+        self,
+        nets: list[neat.nn.FeedForwardNetwork],
+        generation: int,
+        fitness: float,
+        difficulty: float | None = None,
+    ):
+        data = encode_networks(nets)
+        with open(self.path, "ab") as f:
+            offset = f.tell()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        difficulty = math.nan if difficulty is None else difficulty
+        with open(self.index_path, "ab") as f:
+            f.seek(len(self) * INDEX_RECORD.size)
+            f.truncate()
+            f.write(
+                INDEX_RECORD.pack(offset, len(data), generation, fitness, difficulty)
+            )
+
+    def add_genomes(
+        self,
+        genomes: list,
+        configs: list[neat.Config],
+        generation: int,
+        fitness: float,
+        difficulty: float | None = None,
+    ):
+        nets = [
+            neat.nn.FeedForwardNetwork.create(genome, config)
+            for genome, config in zip(genomes, configs)
+        ]
+        self.add(nets, generation, fitness, difficulty)
+
+    def get_position(self, index: int) -> int:
+        count = len(self)
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError(f"No entry {index} in a hall of fame of {count}")
+        return index
+
+    def read_record(self, index: int) -> tuple:
+        with open(self.index_path, "rb") as f:
+            f.seek(index * INDEX_RECORD.size)
+            return INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+
+    @staticmethod
+    def get_fame(index: int, record: tuple) -> Fame:
+        _, _, generation, fitness, difficulty = record
+        return Fame(
+            index, generation, fitness, None if math.isnan(difficulty) else difficulty
+        )
+
+    def get_fame_at(self, index: int) -> Fame:
+        index = self.get_position(index)
+        return HallOfFame.get_fame(index, self.read_record(index))
+
+    def __getitem__(self, index: int) -> list[neat.nn.FeedForwardNetwork]:
+        offset, size, *_ = self.read_record(self.get_position(index))
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            return decode_networks(np.frombuffer(f.read(size), dtype=np.uint8))
+
+    def __iter__(self):
+        # (fame, networks) of every entry in the order they were added, read one at a
+        # time
+        count = len(self)
+        if count == 0:
+            return
+        with open(self.index_path, "rb") as index, open(self.path, "rb") as data:
+            for position in range(count):
+                record = INDEX_RECORD.unpack(index.read(INDEX_RECORD.size))
+                offset, size, *_ = record
+                data.seek(offset)
+                nets = decode_networks(np.frombuffer(data.read(size), dtype=np.uint8))
+                yield HallOfFame.get_fame(position, record), nets
+
+    def get_fames(self) -> list[Fame]:
+        # the metadata of every entry, without reading any networks
+        if len(self) == 0:
+            return []
+        with open(self.index_path, "rb") as f:
+            data = f.read(len(self) * INDEX_RECORD.size)
+        return [
+            HallOfFame.get_fame(index, record)
+            for index, record in enumerate(INDEX_RECORD.iter_unpack(data))
+        ]
@@ -0,0 +1,78 @@
+import neat
+import os
+import random
+import traceback
+from multiprocessing.connection import Connection
+from evolution.util import MostRecentHistoryRecorder, get_mean_award
+
+
+def get_island_path(path: str, island: int) -> str:
+    return f"{path}_island{island}"
+
+
+def immigrate(population: neat.Population, migrants: list):
+    # migrants take the place of random offspring of the island's new generation, under
+    # their keys, so the species the offspring were placed in hold the migrants instead
+    offspring = [
+        key for key, genome in population.population.items() if genome.fitness is None
+    ]
+    keys = random.sample(offspring, min(len(migrants), len(offspring)))
+    for migrant, key in zip(migrants, keys):
+        migrant.key, migrant.fitness = key, None
+        population.population[key] = migrant
+        for species in population.species.species.values():
+            if key in species.members:
+                species.members[key] = migrant
+
+
+def run_island(task, island: int, migrant_count: int, connection: Connection):
+    """
+    The loop of an island's process. It sends how many generations the island has
+    already evolved, then for every (generations, migrants) it is sent, takes the
+    migrants in and evolves its own population on its own episodes, replying with its
+    fittest migrant_count genomes of the last generation and its best genome. None
+    stops it.
+    """
+    recorder = None
+    try:
+        checkpoint_path = get_island_path(task.checkpoint_path, island)
+        evolved = 0
+        if os.path.exists(checkpoint_path):
+            population = MostRecentHistoryRecorder.restore_generation(checkpoint_path)
+            evolved = population.generation + 1
+        else:
+            # forked islands would otherwise share their parent's random state
+            random.seed(task.seed + island)
+            population = neat.Population(task.config)
+        recorder = MostRecentHistoryRecorder(
+            checkpoint_path, get_island_path(task.model_path, island)
+        )
+        population.add_reporter(recorder)
+        emigrants = []
+
+        def evaluate(genomes, config):
+            task.seed = task.get_seed()
+            task.get_episode_bank()
+            individuals = [genome for _, genome in genomes]
+            awards = task.evaluate_chunk(task.get_units(individuals))
+            for genome, genome_awards in zip(individuals, awards):
+                genome.fitness = get_mean_award(genome_awards)
+            emigrants[:] = sorted(
+                individuals, key=lambda genome: genome.fitness, reverse=True
+            )[:migrant_count]
+
+        connection.send(evolved)
+        while (message := connection.recv()) is not None:
+            generations, migrants = message
+            immigrate(population, migrants)
+            best_genome = population.run(evaluate, n=generations)
+            # on disk before the parent hears back, it may stop the island right after
+            recorder.writer.flush()
+            connection.send((emigrants, best_genome))
+    except Exception:
+        connection.send(RuntimeError(traceback.format_exc()))
+    finally:
+        connection.close()
+        # an island's process never runs atexit, which flushes the writer otherwise
+        if recorder is not None:
+            recorder.writer.flush()
@@ -0,0 +1,116 @@
+import json
+import time
+from typing import Iterator
+from neat.reporting import BaseReporter
+
+# a sink writes its buffered events once it holds this many, or once this many seconds
+# have passed since it last wrote
+FLUSH_EVENTS = 64
+FLUSH_SECONDS = 5.0
+
+
+class MetricsSink:
+    """
+    Appends events to a stream of JSON lines, one object per event holding its name, the
+    time it happened and its fields. Events are buffered and written in batches, so the
+    cost of an event stays the same however long a run goes. Read streams with
+    MetricsReader.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        flush_events: int = FLUSH_EVENTS,
+        flush_seconds: float = FLUSH_SECONDS,
+    ):
+        self.path = path
+        self.flush_events = flush_events
+        self.flush_seconds = flush_seconds
+        self.file = open(path, "a")
+        self.lines: list[str] = []
+        self.last_flush = time.monotonic()
+
+    def record(self, event: str, **fields):
+        self.lines.append(json.dumps({"event": event, "time": time.time(), **fields}))
+        if (
+            len(self.lines) >= self.flush_events
+            or time.monotonic() - self.last_flush >= self.flush_seconds
+        ):
+            self.flush()
+
+    def flush(self):
+        if len(self.lines) > 0:
+            self.file.write("\n".join(self.lines) + "\n")
+            self.lines = []
+        self.file.flush()
+        self.last_flush = time.monotonic()
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class MetricsReader:
+    """
+    Reads a stream of a MetricsSink from where it last left off, only lines written in
+    full are read, so a stream can be read while it is being written.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+
+    def read(self, event: str | None = None) -> Iterator[dict]:
+        # the events appended since the last read, all of them on the first
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    return
+                self.offset += len(line)
+                record = json.loads(line)
+                if event is None or record["event"] == event:
+                    yield record
+
+    def follow(
+        self, event: str | None = None, poll_interval: float = 1.0
+    ) -> Iterator[dict]:
+        # the events of the stream as they are appended, without end
+        while True:
+            yield from self.read(event)
+            time.sleep(poll_interval)
+
+
+class MetricsRecorder(BaseReporter):
+    # records how long each generation took to evaluate and how it did
+    def __init__(self, metrics: MetricsSink, tag: str):
+        super().__init__()
+        self.metrics = metrics
+        self.tag = tag
+        self.generation = 0
+        self.start = time.monotonic()
+        self.evaluations = 0
+
+    def start_generation(self, generation):
+        self.generation = generation
+        self.start = time.monotonic()
+
+    def post_evaluate(self, config, population, species, best_genome):
+        fitnesses = [genome.fitness for genome in population.values()]
+        self.evaluations += len(fitnesses)
+        self.metrics.record(
+            "generation",
+            tag=self.tag,
+            generation=self.generation,
+            seconds=time.monotonic() - self.start,
+            evaluations=self.evaluations,
+            species=len(species.species),
+            best_fitness=best_genome.fitness,
+            mean_fitness=sum(fitnesses) / len(fitnesses),
+        )
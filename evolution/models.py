@@ -0,0 +1,182 @@
+import os
+import gzip
+import pickle
+import struct
+import neat
+import numpy as np
+from neat.aggregations import sum_aggregation
+from evolution.network import activation_codes
+
+# a file of networks: a header, then per network its counts and its arrays
+MAGIC = b"NNET"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sHHI")  # magic, version, unused, network count
+NETWORK_HEADER = struct.Struct("<IIII")  # inputs, outputs, evaluated nodes, links
+# networks loaded in this process by their file's path, with the mtime they were loaded at
+loaded_networks: dict[str, tuple[int, list[neat.nn.FeedForwardNetwork]]] = {}
+# the neat activation of every code of evolution.network
+activation_functions = {
+    code: activation for activation, code in activation_codes.items()
+}
+
+
+def get_array_layout(inputs: int, outputs: int, nodes: int, links: int):
+    # (name, dtype, length) of a network's arrays in file order, doubles first so they
+    # stay 8 byte aligned
+    return [
+        ("biases", np.float64, nodes),
+        ("responses", np.float64, nodes),
+        ("weights", np.float64, links),
+        ("input_keys", np.int32, inputs),
+        ("output_keys", np.int32, outputs),
+        ("node_keys", np.int32, nodes),
+        ("activations", np.int32, nodes),
+        ("fan_ins", np.int32, nodes),
+        ("sources", np.int32, links),
+    ]
+
+
+def get_padding(size: int) -> int:
+    return -size % 8
+
+
+def encode_network(net: neat.nn.FeedForwardNetwork) -> bytes:
+    arrays = {"biases": [], "responses": [], "weights": [], "node_keys": []}
+    arrays.update(activations=[], fan_ins=[], sources=[])
+    for key, activation, aggregation, bias, response, links in net.node_evals:
+        if activation not in activation_codes:
+            raise ValueError(f"{activation.__name__} can not be saved")
+        if aggregation is not sum_aggregation:
+            raise ValueError(f"{aggregation.__name__} can not be saved")
+        arrays["node_keys"].append(key)
+        arrays["activations"].append(activation_codes[activation])
+        arrays["biases"].append(bias)
+        arrays["responses"].append(response)
+        arrays["fan_ins"].append(len(links))
+        arrays["sources"].extend(source for source, _ in links)
+        arrays["weights"].extend(weight for _, weight in links)
+    arrays["input_keys"], arrays["output_keys"] = net.input_nodes, net.output_nodes
+
+    counts = (
+        len(net.input_nodes),
+        len(net.output_nodes),
+        len(net.node_evals),
+        len(arrays["sources"]),
+    )
+    data = bytearray(NETWORK_HEADER.pack(*counts))
+    for name, dtype, _ in get_array_layout(*counts):
+        data.extend(np.array(arrays[name], dtype=dtype).tobytes())
+    data.extend(bytes(get_padding(len(data))))
+    return bytes(data)
+
+
+def decode_network(buffer: np.ndarray, offset: int):
+    # the network at offset of a byte buffer and the offset after it, the arrays are
+    # views of the buffer until they are turned into neat's lists
+    counts = NETWORK_HEADER.unpack_from(buffer, offset)
+    offset += NETWORK_HEADER.size
+    arrays = {}
+    for name, dtype, length in get_array_layout(*counts):
+        size = length * np.dtype(dtype).itemsize
+        arrays[name] = buffer[offset : offset + size].view(dtype).tolist()
+        offset += size
+    offset += get_padding(offset)
+
+    node_evals, start = [], 0
+    sources, weights = arrays["sources"], arrays["weights"]
+    for key, code, bias, response, fan_in in zip(
+        arrays["node_keys"],
+        arrays["activations"],
+        arrays["biases"],
+        arrays["responses"],
+        arrays["fan_ins"],
+    ):
+        links = list(
+            zip(sources[start : start + fan_in], weights[start : start + fan_in])
+        )
+        node_evals.append(
+            (key, activation_functions[code], sum_aggregation, bias, response, links)
+        )
+        start += fan_in
+    net = neat.nn.FeedForwardNetwork(
+        arrays["input_keys"], arrays["output_keys"], node_evals
+    )
+    return net, offset
+
+
+def encode_networks(nets: list[neat.nn.FeedForwardNetwork]) -> bytes:
+    data = FILE_HEADER.pack(MAGIC, VERSION, 0, len(nets))
+    data += bytes(get_padding(len(data)))
+    return data + b"".join(encode_network(net) for net in nets)
+
+
+def decode_networks(buffer: np.ndarray) -> list[neat.nn.FeedForwardNetwork]:
+    # buffer holds bytes written by encode_networks
+    magic, version, _, count = FILE_HEADER.unpack_from(buffer, 0)
+    if magic != MAGIC:
+        raise ValueError("Not a file of networks")
+    if version != VERSION:
+        raise ValueError(f"Networks of version {version}, expected {VERSION}")
+    nets, offset = [], FILE_HEADER.size + get_padding(FILE_HEADER.size)
+    for _ in range(count):
+        net, offset = decode_network(buffer, offset)
+        nets.append(net)
+    return nets
+
+
+def save_networks(path: str, nets: list[neat.nn.FeedForwardNetwork]):
+    # through a temporary file, a model being watched is never read half written
+    data = encode_networks(nets)
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(data)
+    os.replace(temporary_path, path)
+
+
+def save_genomes(path: str, genomes: list, configs: list[neat.Config]):
+    save_networks(
+        path,
+        [
+            neat.nn.FeedForwardNetwork.create(genome, config)
+            for genome, config in zip(genomes, configs)
+        ],
+    )
+
+
+def is_network_file(path: str) -> bool:
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def load_networks(path: str) -> list[neat.nn.FeedForwardNetwork]:
+    # memory maps the file and builds the networks straight from its arrays
+    return decode_networks(np.memmap(path, dtype=np.uint8, mode="r"))
+
+
+def read_pickled_genomes(path: str) -> list:
+    # models from before this format, a pickled genome or a gzipped pickle of a team
+    with open(path, "rb") as f:
+        data = f.read()
+    if data[:2] == b"\x1f\x8b":
+        data = gzip.decompress(data)
+    genomes = pickle.loads(data)
+    return genomes if isinstance(genomes, list) else [genomes]
+
+
+def get_networks(path: str, configs: list[neat.Config]) -> list:
+    """
+    The networks of a model file, loaded once per process and handed out to every
+    caller until the file is saved again. The networks are shared, so they must not be
+    changed. configs are only needed for models pickled before this format.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    if path not in loaded_networks or loaded_networks[path][0] != mtime:
+        if is_network_file(path):
+            nets = load_networks(path)
+        else:
+            nets = [
+                neat.nn.FeedForwardNetwork.create(genome, config)
+                for genome, config in zip(read_pickled_genomes(path), configs)
+            ]
+        loaded_networks[path] = (mtime, nets)
+    return loaded_networks[path][1]
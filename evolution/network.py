@@ -0,0 +1,317 @@
+import math
+import weakref
+import neat
+import numpy as np
+from dataclasses import dataclass
+from neat.activations import clamped_activation, sigmoid_activation
+from neat.aggregations import sum_aggregation
+
+
+def clamped(z: np.ndarray) -> np.ndarray:
+    return np.clip(z, -1.0, 1.0)
+
+
+def sigmoid(z: np.ndarray) -> np.ndarray:
+    # math.exp per value as neat does, np.exp can differ from it in the last bit
+    z = np.clip(5.0 * z, -60.0, 60.0)
+    exps = np.array([math.exp(-value) for value in z.ravel().tolist()])
+    return 1.0 / (1.0 + exps.reshape(z.shape))
+
+
+# neat's activations which compile, by their index in activations
+activations = [clamped, sigmoid]
+activation_codes = {clamped_activation: 0, sigmoid_activation: 1}
+
+
+def activate(sums: np.ndarray, codes: np.ndarray) -> np.ndarray:
+    # applies each node's activation, codes holding the activations' indices
+    for code, activation in enumerate(activations):
+        is_coded = np.broadcast_to(codes == code, sums.shape)
+        if is_coded.all():
+            return activation(sums)
+        if is_coded.any():
+            sums[is_coded] = activation(sums[is_coded])
+    return sums
+
+
+@dataclass
+class Layer:
+    # nodes are sorted by descending fan in, so the nodes with a k-th link are a prefix
+    slots: np.ndarray  # (nodes,) where each node's value is stored
+    sources: np.ndarray  # (nodes, max fan in) slots of each node's inputs, link order
+    weights: np.ndarray  # (nodes, max fan in)
+    prefixes: np.ndarray  # (max fan in,) how many nodes have a k-th link
+    biases: np.ndarray  # (nodes,)
+    responses: np.ndarray  # (nodes,)
+    activations: np.ndarray  # (nodes,) index of each node's activation
+
+
+class CompiledNetwork:
+    """
+    A feed forward NEAT network compiled into layers of NumPy arrays, so a batch of
+    inputs with one row per episode is activated with a few array operations per layer.
+    Only the activations of our configs and sum aggregation are supported. Every node
+    adds up its weighted inputs in the order neat.nn.FeedForwardNetwork does, so the
+    outputs are bit for bit the same as activating each row on its own.
+    """
+
+    def __init__(
+        self,
+        input_count: int,
+        output_slots: np.ndarray,
+        layers: list[Layer],
+        slots: int,
+    ):
+        self.input_count = input_count
+        self.output_slots = output_slots
+        self.layers = layers
+        self.slots = slots
+
+    @staticmethod
+    def create(genome: neat.DefaultGenome, config: neat.Config) -> "CompiledNetwork":
+        return CompiledNetwork.from_network(
+            neat.nn.FeedForwardNetwork.create(genome, config)
+        )
+
+    @staticmethod
+    def from_network(net: neat.nn.FeedForwardNetwork) -> "CompiledNetwork":
+        # inputs come first, then nodes in evaluation order, then outputs which are never
+        # evaluated and stay 0 like they do in FeedForwardNetwork
+        slots = {key: slot for slot, key in enumerate(net.input_nodes)}
+        depths = {key: 0 for key in net.input_nodes}
+        layers: list[list] = []
+        for key, activation, aggregation, bias, response, links in net.node_evals:
+            if activation not in activation_codes:
+                raise ValueError(f"{activation.__name__} does not compile")
+            if aggregation is not sum_aggregation:
+                raise ValueError(f"{aggregation.__name__} does not compile")
+            slots[key] = len(slots)
+            # a node goes in the layer right after the deepest of its inputs
+            depths[key] = 1 + max((depths[source] for source, _ in links), default=0)
+            if depths[key] > len(layers):
+                layers.append([])
+            layers[depths[key] - 1].append(
+                (
+                    slots[key],
+                    bias,
+                    response,
+                    activation_codes[activation],
+                    [(slots[source], weight) for source, weight in links],
+                )
+            )
+        for key in net.output_nodes:
+            if key not in slots:
+                slots[key] = len(slots)
+
+        output_slots = np.array([slots[key] for key in net.output_nodes], dtype=int)
+        return CompiledNetwork(
+            len(net.input_nodes),
+            output_slots,
+            [CompiledNetwork.compile_layer(nodes) for nodes in layers],
+            len(slots),
+        )
+
+    @staticmethod
+    def fuse(
+        networks: list["CompiledNetwork"],
+        input_maps: list[list[int]],
+        feature_count: int,
+    ) -> "CompiledNetwork":
+        # one network evaluating networks side by side on a shared feature vector, input k
+        # of networks[i] reads feature input_maps[i][k] and the outputs are concatenated
+        slot_count = feature_count
+        layers: list[list] = []
+        output_slots = []
+        for net, input_map in zip(networks, input_maps):
+            if len(input_map) != net.input_count:
+                raise ValueError(
+                    f"Expected {net.input_count} features to map, got {len(input_map)}"
+                )
+            # inputs become features, every other slot moves past the slots taken so far
+            remap = np.concatenate(
+                (
+                    np.array(input_map, dtype=int),
+                    np.arange(slot_count, slot_count + net.slots - net.input_count),
+                )
+            )
+            for depth, layer in enumerate(net.layers):
+                if depth == len(layers):
+                    layers.append([])
+                layers[depth].extend(CompiledNetwork.get_layer_nodes(layer, remap))
+            output_slots.extend(remap[net.output_slots].tolist())
+            slot_count += net.slots - net.input_count
+        return CompiledNetwork(
+            feature_count,
+            np.array(output_slots, dtype=int),
+            [CompiledNetwork.compile_layer(nodes) for nodes in layers],
+            slot_count,
+        )
+
+    @staticmethod
+    def get_layer_nodes(layer: Layer, remap: np.ndarray) -> list[tuple]:
+        # the inverse of compile_layer, with every slot s moved to remap[s]
+        fan_ins = np.sum(layer.prefixes > np.arange(len(layer.slots))[:, None], axis=1)
+        return [
+            (
+                int(remap[layer.slots[index]]),
+                float(layer.biases[index]),
+                float(layer.responses[index]),
+                int(layer.activations[index]),
+                [
+                    (int(remap[source]), float(weight))
+                    for source, weight in zip(
+                        layer.sources[index, :fan_in], layer.weights[index, :fan_in]
+                    )
+                ],
+            )
+            for index, fan_in in enumerate(fan_ins.tolist())
+        ]
+
+    @staticmethod
+    def compile_layer(nodes: list[tuple[int, float, float, int, list]]) -> Layer:
+        nodes = sorted(nodes, key=lambda node: len(node[4]), reverse=True)
+        fan_ins = np.array([len(links) for *_, links in nodes], dtype=int)
+        max_fan_in = fan_ins.max(initial=0)
+        sources = np.zeros((len(nodes), max_fan_in), dtype=int)
+        weights = np.zeros((len(nodes), max_fan_in))
+        for index, (*_, links) in enumerate(nodes):
+            for k, (source, weight) in enumerate(links):
+                sources[index, k] = source
+                weights[index, k] = weight
+        return Layer(
+            slots=np.array([slot for slot, *_ in nodes], dtype=int),
+            sources=sources,
+            weights=weights,
+            prefixes=np.sum(fan_ins[:, None] > np.arange(max_fan_in), axis=0),
+            biases=np.array([bias for _, bias, *_ in nodes], dtype=float),
+            responses=np.array([response for _, _, response, *_ in nodes], dtype=float),
+            activations=np.array([code for *_, code, _ in nodes], dtype=int),
+        )
+
+    def activate_batch(self, inputs: np.ndarray) -> np.ndarray:
+        # (episodes, inputs) to (episodes, outputs)
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.ndim != 2 or inputs.shape[1] != self.input_count:
+            raise RuntimeError(
+                f"Expected a batch of {self.input_count} inputs, got {inputs.shape}"
+            )
+        values = np.zeros((len(inputs), self.slots))
+        values[:, : self.input_count] = inputs
+        for layer in self.layers:
+            # link by link rather than a matmul, which may add the terms in another order
+            sums = np.zeros((len(inputs), len(layer.slots)))
+            for k, prefix in enumerate(layer.prefixes.tolist()):
+                sums[:, :prefix] += (
+                    values[:, layer.sources[:prefix, k]] * layer.weights[:prefix, k]
+                )
+            values[:, layer.slots] = activate(
+                layer.biases + layer.responses * sums, layer.activations
+            )
+        return values[:, self.output_slots]
+
+    def activate(self, inputs: list[float]) -> list[float]:
+        # a drop in for FeedForwardNetwork.activate on a single set of inputs
+        return self.activate_batch(np.array([inputs], dtype=float))[0].tolist()
+
+
+# compiled networks by the network they were compiled from, for as long as it lives
+compiled_networks: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
+
+
+def get_compiled_network(net: neat.nn.FeedForwardNetwork) -> CompiledNetwork:
+    # compiles a network once however many times it is fused or evaluated, the compiled
+    # network is shared so its arrays are made read only
+    if net not in compiled_networks:
+        compiled = CompiledNetwork.from_network(net)
+        for layer in compiled.layers:
+            for array in vars(layer).values():
+                array.flags.writeable = False
+        compiled.output_slots.flags.writeable = False
+        compiled_networks[net] = compiled
+    return compiled_networks[net]
+
+
+class PopulationNetwork:
+    """
+    Compiled networks with the same inputs and outputs padded into shared arrays, so a
+    batch whose rows each belong to any of the networks is activated at once. Missing
+    nodes write to a sink slot and missing links read a slot that is always 0. A sum
+    that starts at +0.0 never becomes -0.0, so adding those 0 terms leaves every output
+    bit for bit the same as its own network's.
+    """
+
+    def __init__(self, networks: list[CompiledNetwork]):
+        if len(networks) == 0:
+            raise ValueError("A population network needs at least one network")
+        first = networks[0]
+        for net in networks:
+            if net.input_count != first.input_count or len(net.output_slots) != len(
+                first.output_slots
+            ):
+                raise ValueError("All networks of a population must share their shape")
+
+        self.input_count = first.input_count
+        self.slots = max(net.slots for net in networks) + 2
+        self.zero_slot, self.sink_slot = self.slots - 2, self.slots - 1
+        self.output_slots = np.array([net.output_slots for net in networks])
+        self.layers = [
+            self.pad_layer(
+                [
+                    net.layers[depth] if depth < len(net.layers) else None
+                    for net in networks
+                ]
+            )
+            for depth in range(max(len(net.layers) for net in networks))
+        ]
+
+    def pad_layer(self, layers: list[Layer | None]) -> Layer:
+        # the networks' layers at one depth stacked, None for networks not that deep
+        present = [layer for layer in layers if layer is not None]
+        node_count = max(len(layer.slots) for layer in present)
+        max_fan_in = max(layer.sources.shape[1] for layer in present)
+        shape = (len(layers), node_count)
+        padded = Layer(
+            slots=np.full(shape, self.sink_slot),
+            sources=np.full(shape + (max_fan_in,), self.zero_slot),
+            weights=np.zeros(shape + (max_fan_in,)),
+            prefixes=np.full(max_fan_in, node_count),
+            biases=np.zeros(shape),
+            responses=np.zeros(shape),
+            activations=np.zeros(shape, dtype=int),
+        )
+        for net, layer in enumerate(layers):
+            if layer is None:
+                continue
+            nodes, fan_in = layer.sources.shape
+            padded.slots[net, :nodes] = layer.slots
+            padded.sources[net, :nodes, :fan_in] = layer.sources
+            padded.weights[net, :nodes, :fan_in] = layer.weights
+            padded.biases[net, :nodes] = layer.biases
+            padded.responses[net, :nodes] = layer.responses
+            padded.activations[net, :nodes] = layer.activations
+        return padded
+
+    def activate_batch(
+        self, inputs: np.ndarray, owners: np.ndarray | None = None
+    ) -> np.ndarray:
+        # (rows, inputs) to (rows, outputs), row i activated by network owners[i]
+        inputs = np.asarray(inputs, dtype=float)
+        if inputs.ndim != 2 or inputs.shape[1] != self.input_count:
+            raise RuntimeError(
+                f"Expected a batch of {self.input_count} inputs, got {inputs.shape}"
+            )
+        if owners is None:
+            owners = np.zeros(len(inputs), dtype=int)
+        rows = np.arange(len(inputs))[:, None]
+        values = np.zeros((len(inputs), self.slots))
+        values[:, : self.input_count] = inputs
+        for layer in self.layers:
+            sources, weights = layer.sources[owners], layer.weights[owners]
+            sums = np.zeros(sources.shape[:2])
+            for k in range(sources.shape[2]):
+                sums += values[rows, sources[:, :, k]] * weights[:, :, k]
+            values[rows, layer.slots[owners]] = activate(
+                layer.biases[owners] + layer.responses[owners] * sums,
+                layer.activations[owners],
+            )
+        return values[rows, self.output_slots[owners]]
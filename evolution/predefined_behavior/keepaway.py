@@ -1,47 +1,44 @@
 import numpy as np
 import math
 import neat
-import json
 from environment.config import ENVIRONMENT_HEIGHT, ENVIRONMENT_WIDTH
 from environment.core import BluelockEnvironment, Offender, Ball
+from environment.control import for_each_episode
 from evolution.task import EvolutionTask
+from evolution.episodes import EpisodeBank
+from evolution.metrics import MetricsSink
 from evolution.config import (
     CHECKPOINTS_PATH,
     MODELS_PATH,
     PLOTS_PATH,
     get_default_config,
 )
+from evolution.features import FeatureLayout, Displacement, CornerDisplacements
 from evolution.util import (
-    get_keepaway2v1_fitness,
+    get_keepaway2v1_batch_awards,
     get_keepaway2v1_env,
-    scale_to_env_dims,
 )
 from visualization.visualizer import BluelockEnvironmentVisualizer
-from util import Rect, get_beeline_orientation, get_random_point
+from util import get_beeline_orientation, get_random_point
 from dataclasses import dataclass
 
+
 # Predefined Behavior ANN's inputs
+PASSING_LANE_CREATOR_FEATURES = FeatureLayout(
+    [
+        Displacement("defender", "possessor"),
+        Displacement("offballer", "possessor"),
+        CornerDisplacements("offballer", is_to_corners=True),
+    ]
+)
+
+
 def get_passing_lane_creator_inputs(
     env: BluelockEnvironment, possessor_id: int, defender_id: int, offballer_id: int
 ):
-    possessor, defender, offballer = env.get_players_by_ids(
-        possessor_id, defender_id, offballer_id
+    return PASSING_LANE_CREATOR_FEATURES.encode_env(
+        env, possessor=possessor_id, defender=defender_id, offballer=offballer_id
     )
-    defender_to_ball = scale_to_env_dims(env, possessor.position - defender.position)
-    offballer_to_ball = scale_to_env_dims(env, possessor.position - offballer.position)
-    inputs = [
-        defender_to_ball[0],
-        defender_to_ball[1],
-        offballer_to_ball[0],
-        offballer_to_ball[1],
-    ]
-    for point in Rect([0.0, 0.0], height=env.height, width=env.width).get_vertices():
-        displacement_to_corner = scale_to_env_dims(
-            env, np.array(point) - offballer.position
-        )
-        inputs.append(displacement_to_corner[0])
-        inputs.append(displacement_to_corner[1])
-    return inputs
 
 
 def get_passing_lane_creator_recommendations(
@@ -81,7 +78,7 @@ class PredefinedBehaviorControlState:
         return self.who_should_seek is not None and self.who_should_seek == offender.id
 
 
-def with_predefined_pass_seek_behaviors(
+def get_predefined_pass_seek_control(
     env: BluelockEnvironment, passing_lane_creator: neat.nn.FeedForwardNetwork
 ):
     # hard coded 2 v 1
@@ -96,7 +93,6 @@ def with_predefined_pass_seek_behaviors(
             return env.offense
         return env.offense[1], env.offense[0]
 
-    old_update = env.update
     state = PredefinedBehaviorControlState()
 
     def control():
@@ -119,11 +115,14 @@ def with_predefined_pass_seek_behaviors(
                 if state.should_seek(offender):
                     seek_ball(env.ball, offender)
 
-    def new_update(*args, **kwargs):
-        control()
-        old_update(*args, **kwargs)
+    return control
 
-    env.update = new_update
+
+def with_predefined_pass_seek_behaviors(
+    env: BluelockEnvironment, passing_lane_creator: neat.nn.FeedForwardNetwork
+):
+    control = get_predefined_pass_seek_control(env, passing_lane_creator)
+    env.controllers.register("predefined_pass_seek", control)
     return env
 
 
@@ -131,7 +130,7 @@ TASK_NAME = "predefined_keepaway"
 
 
 class PredefinedBehaviorKeepaway(EvolutionTask):
-    def __init__(self, difficulty=0.5, is_dynamic=False):
+    def __init__(self, difficulty=0.5, is_dynamic=False, decision_interval=15):
         tag = TASK_NAME
         if is_dynamic:
             tag = f"{TASK_NAME}_dynamic"
@@ -139,8 +138,10 @@ class PredefinedBehaviorKeepaway(EvolutionTask):
         super().__init__(CHECKPOINTS_PATH, MODELS_PATH, PLOTS_PATH, tag, config_file)
         self.is_dynamic = is_dynamic
         self.difficulty = difficulty
+        # how often the offense re-decides, physics in between is resolved at the training dt
+        self.decision_interval = decision_interval
 
-    def get_episodes(self):
+    def get_episodes(self, rng: np.random.Generator | None = None):
         envs = []
         for _ in range(10):
             if self.is_dynamic:
@@ -148,49 +149,52 @@ class PredefinedBehaviorKeepaway(EvolutionTask):
                     get_keepaway2v1_env(
                         self.difficulty,
                         defender_pos=get_random_point(
-                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT
+                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng
                         ),
                         possessor_pos=get_random_point(
-                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT
+                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng
                         ),
+                        rng=rng,
                     )
                 )
             else:
-                envs.append(get_keepaway2v1_env(self.difficulty))
+                envs.append(get_keepaway2v1_env(self.difficulty, rng=rng))
         return envs
 
-    def compute_fitness(self, genome, config) -> float:
+    def compute_awards(self, genome, config, bank: EpisodeBank) -> list[float]:
         dt, allotted = 15, 24000
-        fitness = 0
         net = neat.nn.FeedForwardNetwork.create(genome, config)
-        episodes = self.get_episodes()
-        for env in episodes:
-            env = with_predefined_pass_seek_behaviors(env, net)
-            for elapsed in range(0, allotted, dt):
-                if env.does_defense_have_possession():
-                    break
-                env.update(dt)
 
-            fitness += get_keepaway2v1_fitness(elapsed / allotted)
-        return fitness / len(episodes)
+        batch = bank.get_batch()
+        return get_keepaway2v1_batch_awards(
+            batch,
+            for_each_episode(
+                [get_predefined_pass_seek_control(env, net) for env in batch.episodes]
+            ),
+            dt,
+            allotted,
+            self.decision_interval,
+        )
 
 
 def evolve_predefined_behavior_keepaway():
-    stats = {"difficulty": {}, "fitness": {}}
     task = PredefinedBehaviorKeepaway(is_dynamic=False)
-    eval_count = 0
-    for _, winner in enumerate(task.evolve(100, 5)):
-        eval_count += 1
-        fitness = task.compute_fitness(winner, task.config)
-        print(
-            f"{eval_count} test at difficulty {task.difficulty} resulted in fitness of {fitness}"
-        )
-        if fitness > 0.8:
-            task.difficulty += 0.05
-        stats["difficulty"][eval_count] = task.difficulty
-        stats["fitness"][eval_count] = fitness
-        with open(f"predefined_keepaway_dynamic_stats.json", "w") as f:
-            json.dump(stats, f, indent=2, sort_keys=True)
+    with MetricsSink("predefined_keepaway_dynamic_metrics.jsonl") as metrics:
+        eval_count = 0
+        for _, winner in enumerate(task.evolve(100, 5, metrics=metrics)):
+            eval_count += 1
+            fitness = task.compute_test_fitness(winner, task.config)
+            print(
+                f"{eval_count} test at difficulty {task.difficulty} resulted in fitness of {fitness}"
+            )
+            if fitness > 0.8:
+                task.difficulty += 0.05
+            metrics.record(
+                "test",
+                evaluation=eval_count,
+                difficulty=task.difficulty,
+                fitness=fitness,
+            )
 
 
 def watch_predefined_behavior_keepaway():
@@ -2,41 +2,44 @@ import numpy as np
 import neat
 import math
 from environment.core import BluelockEnvironment, Offender, Defender, Ball
+from environment.batched import BatchedBluelockEnvironment
 from environment.config import ENVIRONMENT_HEIGHT, ENVIRONMENT_WIDTH
-from environment.defense.agent import with_policy_defense, naive_man_to_man
-from evolution.util import scale_to_env_dims
+from environment.control import Phase, DEFENSE_PRIORITY
+from environment.defense.agent import (
+    with_policy_defense,
+    get_batch_man_to_man_defense,
+    naive_man_to_man,
+)
+from evolution.util import get_run_outputs
 from evolution.task import EvolutionTask
-from evolution.sequential.seek import Seek, do_seek
-from evolution.sequential.pass_ball import Pass, make_pass
+from evolution.network import PopulationNetwork, get_compiled_network
+from evolution.features import FeatureLayout, Displacement, CornerDisplacements
+from evolution.sequential.seek import Seek, do_seek, do_batch_seek
+from evolution.sequential.pass_ball import Pass, make_pass, make_batch_pass
 from evolution.config import (
     CHECKPOINTS_PATH,
     MODELS_PATH,
     PLOTS_PATH,
     get_default_config,
 )
-from util import Rect, get_beeline_orientation, get_random_point, get_euclidean_dist
+from util import get_beeline_orientation, get_random_point, get_euclidean_dist
 from visualization.visualizer import BluelockEnvironmentVisualizer
 
+FIND_SPACE_FEATURES = FeatureLayout(
+    [
+        Displacement("defender", "possessor"),
+        Displacement("offballer", "possessor"),
+        CornerDisplacements("possessor"),
+    ]
+)
+
 
 def get_find_space_inputs(
     env: BluelockEnvironment, possessor_id: int, defender_id: int, offballer_id: int
 ):
-    possessor, defender, offballer = env.get_players_by_ids(
-        possessor_id, defender_id, offballer_id
+    return FIND_SPACE_FEATURES.encode_env(
+        env, possessor=possessor_id, defender=defender_id, offballer=offballer_id
     )
-    defender_disp_to_ball = scale_to_env_dims(
-        env, possessor.position - defender.position
-    )
-    offballer_disp_to_ball = scale_to_env_dims(
-        env, possessor.position - offballer.position
-    )
-    inputs = list(defender_disp_to_ball) + list(offballer_disp_to_ball)
-    for point in Rect([0.0, 0.0], height=env.height, width=env.width).get_vertices():
-        corner_displacement_to_ball = scale_to_env_dims(
-            env, possessor.position - np.array(point)
-        )
-        inputs.extend(list(corner_displacement_to_ball))
-    return inputs
 
 
 def get_find_space_outputs(
@@ -69,7 +72,7 @@ def go_to_space(
     offballer.run(speed_mag)
 
 
-def with_offball_movement(
+def get_offball_movement_control(
     env: BluelockEnvironment,
     spacer_net: neat.nn.FeedForwardNetwork,
     seeker_net: neat.nn.FeedForwardNetwork,
@@ -77,9 +80,6 @@ def with_offball_movement(
     defender_id: int,
     offballer_id: int,
 ):
-
-    old_update = env.update
-
     def control():
         offballer = env.get_player(offballer_id)
         if env.does_offense_have_possession():
@@ -88,20 +88,80 @@ def with_offball_movement(
         else:
             do_seek(env, seeker_net, offballer_id)
 
-    def new_update(*args, **kwargs):
-        old_update(*args, **kwargs)
-        control()
+    return control
 
-    env.update = new_update
+
+def with_offball_movement(
+    env: BluelockEnvironment,
+    spacer_net: neat.nn.FeedForwardNetwork,
+    seeker_net: neat.nn.FeedForwardNetwork,
+    possessor_id: int,
+    defender_id: int,
+    offballer_id: int,
+):
+    control = get_offball_movement_control(
+        env, spacer_net, seeker_net, possessor_id, defender_id, offballer_id
+    )
+    env.controllers.register("offball_movement", control, phase=Phase.POST)
     return env
 
 
+def get_batch_offball_movement_control(
+    batch: BatchedBluelockEnvironment,
+    spacers: PopulationNetwork,
+    owners: np.ndarray | None,
+    seekers: PopulationNetwork,
+    possessor_id: int,
+    defender_id: int,
+    offballer_id: int,
+):
+    # get_offball_movement_control for every episode of a batch, the spacer of episode i
+    # is network owners[i]
+    possessor_slot = batch.get_slot(possessor_id)
+    defender_slot = batch.get_slot(defender_id)
+    offballer_slot = batch.get_slot(offballer_id)
+
+    def control(episodes: list[tuple[int, BluelockEnvironment]]):
+        episodes = np.array([episode for episode, _ in episodes], dtype=int)
+        possessors = batch.possessors[episodes]
+        does_offense_have_possession = (possessors >= 0) & (
+            possessors < batch.offense_count
+        )
+        spacing = episodes[
+            does_offense_have_possession & (possessors != offballer_slot)
+        ]
+        if len(spacing) > 0:
+            speed_mags, orientations = get_run_outputs(
+                spacers.activate_batch(
+                    FIND_SPACE_FEATURES.encode(
+                        batch,
+                        spacing,
+                        possessor=possessor_slot,
+                        defender=defender_slot,
+                        offballer=offballer_slot,
+                    ),
+                    None if owners is None else owners[spacing],
+                )
+            )
+            batch.rotations[spacing, offballer_slot] = orientations
+            batch.speeds[spacing, offballer_slot] = (
+                batch.top_speeds[spacing, offballer_slot] * speed_mags
+            )
+        seeking = episodes[~does_offense_have_possession]
+        do_batch_seek(batch, seeking, seekers, None, offballer_slot)
+
+    return control
+
+
 TASK_NAME = "find_space"
 
 
 class FindSpace(EvolutionTask):
     def __init__(
-        self, seeker: neat.nn.FeedForwardNetwork, passer: neat.nn.FeedForwardNetwork
+        self,
+        seeker: neat.nn.FeedForwardNetwork,
+        passer: neat.nn.FeedForwardNetwork,
+        decision_interval: int = 15,
     ):
         super().__init__(
             CHECKPOINTS_PATH,
@@ -112,24 +172,34 @@ class FindSpace(EvolutionTask):
         )
         self.seeker = seeker
         self.passer = passer
+        self.seekers = PopulationNetwork([get_compiled_network(seeker)])
+        self.passers = PopulationNetwork([get_compiled_network(passer)])
+        # how often players re-decide while the pass travels, ticks in between are fast-forwarded
+        self.decision_interval = decision_interval
         self.possessor_id = 1
         self.offballer_id = 2
         self.defender_id = 3
 
-    def get_episodes(self):
+    def get_episodes(self, rng: np.random.Generator | None = None):
         envs = []
         for _ in range(40):
             possessor = Offender(
                 self.possessor_id,
-                get_random_point(x_max=ENVIRONMENT_WIDTH, y_max=ENVIRONMENT_HEIGHT),
+                get_random_point(
+                    x_max=ENVIRONMENT_WIDTH, y_max=ENVIRONMENT_HEIGHT, rng=rng
+                ),
             )
             offballer = Offender(
                 self.offballer_id,
-                get_random_point(x_max=ENVIRONMENT_WIDTH, y_max=ENVIRONMENT_HEIGHT),
+                get_random_point(
+                    x_max=ENVIRONMENT_WIDTH, y_max=ENVIRONMENT_HEIGHT, rng=rng
+                ),
             )
             defender = Defender(
                 self.defender_id,
-                get_random_point(x_max=ENVIRONMENT_WIDTH, y_max=ENVIRONMENT_HEIGHT),
+                get_random_point(
+                    x_max=ENVIRONMENT_WIDTH, y_max=ENVIRONMENT_HEIGHT, rng=rng
+                ),
             )
             ball = Ball((0, 0))
             possessor.possess(ball)
@@ -143,41 +213,71 @@ class FindSpace(EvolutionTask):
             )
         return envs
 
-    def compute_fitness(self, genome, config) -> float:
+    def compute_batch_awards(
+        self,
+        batch: BatchedBluelockEnvironment,
+        spacers: PopulationNetwork,
+        owners: np.ndarray,
+    ) -> list[float]:
         dt, allotted = 15, 6000
         find_space_alloted = 1500
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
-        episodes = self.get_episodes()
-        fitness = 0
-        for env in episodes:
-            env = with_offball_movement(
-                env,
-                net,
-                self.seeker,
+        batch.controllers.register(
+            "offball_movement",
+            get_batch_offball_movement_control(
+                batch,
+                spacers,
+                owners,
+                self.seekers,
                 self.possessor_id,
                 self.defender_id,
                 self.offballer_id,
+            ),
+            phase=Phase.POST,
+        )
+        # the defense only joins in once the pass is made
+        batch.controllers.register(
+            "defense",
+            get_batch_man_to_man_defense(batch, is_incremental=True),
+            priority=DEFENSE_PRIORITY,
+            is_enabled=False,
+        )
+        for _ in range(0, find_space_alloted, dt):
+            batch.update(dt)
+
+        make_batch_pass(
+            batch,
+            np.arange(len(batch.episodes)),
+            self.passers,
+            None,
+            self.possessor_id,
+            self.offballer_id,
+        )
+        possessor_positions = batch.positions[:, batch.get_slot(self.possessor_id)]
+        offballer_positions = batch.positions[:, batch.get_slot(self.offballer_id)]
+        initial_dists_to_possessor = np.sqrt(
+            np.sum((possessor_positions - offballer_positions) ** 2, axis=1)
+        )
+        initial_defender_positions = batch.positions[
+            :, batch.get_slot(self.defender_id)
+        ].copy()
+
+        batch.controllers.enable("defense")
+        for _ in range(0, allotted, self.decision_interval):
+            batch.finish(
+                batch.does_defense_have_possession()
+                | batch.does_offense_have_possession()
             )
-            for _ in range(0, find_space_alloted, dt):
-                env.update(dt)
+            if batch.is_done():
+                break
+            batch.fast_forward(dt, self.decision_interval)
 
-            env = with_policy_defense(env, policy=naive_man_to_man)
-            make_pass(env, self.passer, self.possessor_id, self.offballer_id)
+        awards = []
+        for env, initial_dist_to_possessor, initial_defender_pos in zip(
+            batch.episodes, initial_dists_to_possessor, initial_defender_positions
+        ):
             possessor, offballer, defender = env.get_players_by_ids(
                 self.possessor_id, self.offballer_id, self.defender_id
             )
-            initial_dist_to_possessor = get_euclidean_dist(
-                possessor.position, offballer.position
-            )
-            initial_defender_pos = defender.position
-            for _ in range(0, allotted, dt):
-                if (
-                    env.does_defense_have_possession()
-                    or env.does_offense_have_possession()
-                ):
-                    break
-                env.update(dt)
-
             # very very unlikely neither will have possession
             max_dist_possible = math.sqrt(env.width**2 + env.height**2)
             award = 0
@@ -193,15 +293,15 @@ class FindSpace(EvolutionTask):
                         get_euclidean_dist(possessor.position, offballer.position)
                         / initial_dist_to_possessor
                     )
-            fitness += award
-        return fitness / len(episodes)
+            awards.append(award)
+        return awards
 
 
 def evolve_find_space():
     seek = Seek()
     pass_ball = Pass(seek.get_best_model())
     find_space = FindSpace(seek.get_best_model(), pass_ball.get_best_model())
-    for _ in find_space.evolve(100, 100):
+    for _ in find_space.evolve(100, 100, is_lockstep=True):
         pass
 
 
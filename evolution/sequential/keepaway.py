@@ -1,45 +1,64 @@
+import numpy as np
 import neat
-import json
-from environment.config import ENVIRONMENT_HEIGHT, ENVIRONMENT_WIDTH
+from environment.config import (
+    ENVIRONMENT_HEIGHT,
+    ENVIRONMENT_WIDTH,
+    PLAYER_SHOT_SPEED,
+)
 from environment.core import Offender, BluelockEnvironment
+from environment.batched import BatchedBluelockEnvironment
 from evolution.config import (
     CHECKPOINTS_PATH,
     MODELS_PATH,
     PLOTS_PATH,
     get_default_config,
 )
-from evolution.sequential.seek import evolve_seek, watch_seek, do_seek, Seek
-from evolution.sequential.pass_ball import evolve_pass, watch_pass, make_pass, Pass
+from evolution.sequential.seek import (
+    evolve_seek,
+    watch_seek,
+    do_seek,
+    SEEK_FEATURES,
+    Seek,
+)
+from evolution.sequential.pass_ball import (
+    evolve_pass,
+    watch_pass,
+    make_pass,
+    PASS_FEATURES,
+    Pass,
+)
 from evolution.sequential.find_space import (
     evolve_find_space,
     watch_find_space,
     go_to_space,
+    FIND_SPACE_FEATURES,
     FindSpace,
 )
+from evolution.network import CompiledNetwork, get_compiled_network
+from evolution.features import FeatureLayout, Displacement
 from evolution.util import (
-    scale_to_env_dims,
+    get_run_outputs,
     get_keepaway2v1_env,
-    get_keepaway2v1_fitness,
+    get_keepaway2v1_batch_awards,
     get_random_point,
 )
 from evolution.task import EvolutionTask
+from evolution.episodes import EpisodeBank
+from evolution.metrics import MetricsSink
 from dataclasses import dataclass
 from visualization.visualizer import BluelockEnvironmentVisualizer
 
+PASS_EVALUATE_FEATURES = FeatureLayout(
+    [Displacement("defender", "possessor"), Displacement("offballer", "possessor")]
+)
+
 
 def get_pass_evaluate_inputs(
     env: BluelockEnvironment, possessor_id: int, defender_id: int, offballer_id: int
 ):
-    possessor, defender, offballer = env.get_players_by_ids(
-        possessor_id, defender_id, offballer_id
-    )
-    defender_disp_to_ball = scale_to_env_dims(
-        env, possessor.position - defender.position
+    return PASS_EVALUATE_FEATURES.encode_env(
+        env, possessor=possessor_id, defender=defender_id, offballer=offballer_id
     )
-    offballer_disp_to_ball = scale_to_env_dims(
-        env, possessor.position - offballer.position
-    )
-    return list(defender_disp_to_ball) + list(offballer_disp_to_ball)
 
 
 def should_pass(
@@ -63,7 +82,7 @@ class FullyLearnedBehaviorsControlState:
         return self.who_should_seek is not None and self.who_should_seek == offender.id
 
 
-def with_fully_learned_behaviors(
+def get_fully_learned_behaviors_control(
     env: BluelockEnvironment,
     seeker: neat.nn.FeedForwardNetwork,
     passer: neat.nn.FeedForwardNetwork,
@@ -82,7 +101,6 @@ def with_fully_learned_behaviors(
             return env.offense
         return env.offense[1], env.offense[0]
 
-    old_update = env.update
     state = FullyLearnedBehaviorsControlState()
 
     def control():
@@ -100,14 +118,119 @@ def with_fully_learned_behaviors(
                 if state.should_seek(offender):
                     do_seek(env, seeker, offender.id)
 
-    def new_update(*args, **kwargs):
-        control()
-        old_update(*args, **kwargs)
+    return control
+
 
-    env.update = new_update
+def with_fully_learned_behaviors(
+    env: BluelockEnvironment,
+    seeker: neat.nn.FeedForwardNetwork,
+    passer: neat.nn.FeedForwardNetwork,
+    find_spacer: neat.nn.FeedForwardNetwork,
+    pass_evaluator: neat.nn.FeedForwardNetwork,
+):
+    control = get_fully_learned_behaviors_control(
+        env, seeker, passer, find_spacer, pass_evaluator
+    )
+    env.controllers.register("fully_learned_behaviors", control)
     return env
 
 
+# the find space features start with the pass evaluate features, the pass target is the
+# offballer
+FULLY_LEARNED_BEHAVIORS_FEATURES = FIND_SPACE_FEATURES + PASS_FEATURES + SEEK_FEATURES
+# where each behavior's inputs sit in the fully learned behaviors' features
+FULLY_LEARNED_BEHAVIORS_INPUTS = [
+    list(range(4)),  # pass evaluate
+    list(range(12)),  # find space
+    [12, 13],  # pass
+    [14, 15, 16, 17],  # seek
+]
+
+
+def fuse_fully_learned_behaviors(
+    seeker: neat.nn.FeedForwardNetwork,
+    passer: neat.nn.FeedForwardNetwork,
+    find_spacer: neat.nn.FeedForwardNetwork,
+    pass_evaluator: neat.nn.FeedForwardNetwork,
+) -> CompiledNetwork:
+    # outputs pass confidence, find space (vx, vy), pass (vx, vy) then seek (vx, vy)
+    return CompiledNetwork.fuse(
+        [
+            get_compiled_network(net)
+            for net in (pass_evaluator, find_spacer, passer, seeker)
+        ],
+        FULLY_LEARNED_BEHAVIORS_INPUTS,
+        FULLY_LEARNED_BEHAVIORS_FEATURES.size,
+    )
+
+
+def get_batch_fully_learned_behaviors_control(
+    batch: BatchedBluelockEnvironment, behaviors: CompiledNetwork
+):
+    # get_fully_learned_behaviors_control for every episode of a batch, each decision
+    # step is one forward pass of the fused behaviors over all deciding episodes
+    # hard coded 2 v 1
+    offense_count = defender_slot = batch.offense_count
+    seeker_slots = np.full(len(batch.episodes), -1)
+
+    def control(episodes: list[tuple[int, BluelockEnvironment]]):
+        episodes = np.array([episode for episode, _ in episodes], dtype=int)
+        possessors = batch.possessors[episodes]
+        does_offense_have_possession = (possessors >= 0) & (possessors < offense_count)
+        is_seeking = ~does_offense_have_possession & (seeker_slots[episodes] >= 0)
+        is_deciding = does_offense_have_possession | is_seeking
+        episodes, possessors = episodes[is_deciding], possessors[is_deciding]
+        does_offense_have_possession = does_offense_have_possession[is_deciding]
+        if len(episodes) == 0:
+            return
+
+        possessor_slots = np.where(possessors == 0, 0, 1)
+        offballer_slots = 1 - possessor_slots
+        outputs = behaviors.activate_batch(
+            FULLY_LEARNED_BEHAVIORS_FEATURES.encode(
+                batch,
+                episodes,
+                possessor=possessor_slots,
+                defender=defender_slot,
+                offballer=offballer_slots,
+                target=offballer_slots,
+                # only meaningful in episodes with a seeker
+                seeker=np.maximum(seeker_slots[episodes], 0),
+            )
+        )
+
+        spacing = does_offense_have_possession
+        speed_mags, orientations = get_run_outputs(outputs[spacing, 1:3])
+        spacers = offballer_slots[spacing]
+        batch.rotations[episodes[spacing], spacers] = orientations
+        batch.speeds[episodes[spacing], spacers] = (
+            batch.top_speeds[episodes[spacing], spacers] * speed_mags
+        )
+
+        passing = spacing & (outputs[:, 0] > 0.5)
+        power_mags, orientations = get_run_outputs(outputs[passing, 3:5])
+        for episode, slot, power_mag, orientation in zip(
+            episodes[passing].tolist(),
+            possessor_slots[passing].tolist(),
+            power_mags.tolist(),
+            orientations.tolist(),
+        ):
+            possessor = batch.episodes[episode].players[slot]
+            possessor.set_rotation(orientation)
+            possessor.shoot(power_mag * PLAYER_SHOT_SPEED)
+        seeker_slots[episodes[passing]] = offballer_slots[passing]
+
+        seeking = ~does_offense_have_possession
+        speed_mags, orientations = get_run_outputs(outputs[seeking, 5:7])
+        seekers = seeker_slots[episodes[seeking]]
+        batch.rotations[episodes[seeking], seekers] = orientations
+        batch.speeds[episodes[seeking], seekers] = (
+            batch.top_speeds[episodes[seeking], seekers] * speed_mags
+        )
+
+    return control
+
+
 TASK_NAME = "pass_evaluate"
 
 
@@ -119,6 +242,7 @@ class SequentialKeepaway(EvolutionTask):
         spacer: neat.nn.FeedForwardNetwork,
         is_dynamic=False,
         difficulty=0.5,
+        decision_interval=15,
     ):
         tag = TASK_NAME
         if is_dynamic:
@@ -135,8 +259,10 @@ class SequentialKeepaway(EvolutionTask):
         self.spacer = spacer
         self.is_dynamic = is_dynamic
         self.difficulty = difficulty
+        # how often the offense re-decides, physics in between is resolved at the training dt
+        self.decision_interval = decision_interval
 
-    def get_episodes(self):
+    def get_episodes(self, rng: np.random.Generator | None = None):
         envs = []
         for _ in range(10):
             if self.is_dynamic:
@@ -144,37 +270,35 @@ class SequentialKeepaway(EvolutionTask):
                     get_keepaway2v1_env(
                         self.difficulty,
                         defender_pos=get_random_point(
-                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT
+                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng
                         ),
                         possessor_pos=get_random_point(
-                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT
+                            ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng
                         ),
+                        rng=rng,
                     )
                 )
             else:
-                envs.append(get_keepaway2v1_env(self.difficulty))
+                envs.append(get_keepaway2v1_env(self.difficulty, rng=rng))
         return envs
 
-    def compute_fitness(self, genome, config) -> float:
+    def compute_awards(self, genome, config, bank: EpisodeBank) -> list[float]:
         dt, allotted = 15, 24000
-        fitness = 0
         net = neat.nn.FeedForwardNetwork.create(genome, config)
-        episodes = self.get_episodes()
-        for env in episodes:
-            env = with_fully_learned_behaviors(
-                env, self.seeker, self.passer, self.spacer, net
-            )
-            for elapsed in range(0, allotted, dt):
-                if env.does_defense_have_possession():
-                    break
-                env.update(dt)
-
-            fitness += get_keepaway2v1_fitness(elapsed / allotted)
-        return fitness / len(episodes)
+        behaviors = fuse_fully_learned_behaviors(
+            self.seeker, self.passer, self.spacer, net
+        )
+        batch = bank.get_batch()
+        return get_keepaway2v1_batch_awards(
+            batch,
+            get_batch_fully_learned_behaviors_control(batch, behaviors),
+            dt,
+            allotted,
+            self.decision_interval,
+        )
 
 
 def evolve_pass_evaluator():
-    stats = {"difficulty": {}, "fitness": {}}
     seek = Seek()
     pass_ball = Pass(seek.get_best_model())
     find_space = FindSpace(seek.get_best_model(), pass_ball.get_best_model())
@@ -184,19 +308,22 @@ def evolve_pass_evaluator():
         find_space.get_best_model(),
         is_dynamic=True,
     )
-    eval_count = 0
-    for _, winner in enumerate(task.evolve(100, 5)):
-        eval_count += 1
-        fitness = task.compute_fitness(winner, task.config)
-        print(
-            f"{eval_count} test at difficulty {task.difficulty} resulted in fitness of {fitness}"
-        )
-        if fitness > 0.8:
-            task.difficulty += 0.05
-        stats["difficulty"][eval_count] = task.difficulty
-        stats["fitness"][eval_count] = fitness
-        with open(f"sequential_keepaway_dynamic_stats.json", "w") as f:
-            json.dump(stats, f, indent=2, sort_keys=True)
+    with MetricsSink("sequential_keepaway_dynamic_metrics.jsonl") as metrics:
+        eval_count = 0
+        for _, winner in enumerate(task.evolve(100, 5, metrics=metrics)):
+            eval_count += 1
+            fitness = task.compute_test_fitness(winner, task.config)
+            print(
+                f"{eval_count} test at difficulty {task.difficulty} resulted in fitness of {fitness}"
+            )
+            if fitness > 0.8:
+                task.difficulty += 0.05
+            metrics.record(
+                "test",
+                evaluation=eval_count,
+                difficulty=task.difficulty,
+                fitness=fitness,
+            )
 
 
 def watch_pass_evaluator():
@@ -2,6 +2,7 @@ import neat
 import numpy as np
 import math
 from environment.core import BluelockEnvironment, Offender, Ball
+from environment.batched import BatchedBluelockEnvironment
 from environment.config import ENVIRONMENT_HEIGHT, ENVIRONMENT_WIDTH, PLAYER_SHOT_SPEED
 from evolution.config import (
     CHECKPOINTS_PATH,
@@ -10,8 +11,10 @@ from evolution.config import (
     PLOTS_PATH,
 )
 from evolution.task import EvolutionTask
-from evolution.sequential.seek import with_seeker, Seek
-from evolution.util import scale_to_env_dims
+from evolution.sequential.seek import with_seeker, do_batch_seek, Seek
+from evolution.network import PopulationNetwork, get_compiled_network
+from evolution.features import FeatureLayout, Displacement
+from evolution.util import get_run_outputs
 from visualization.visualizer import BluelockEnvironmentVisualizer
 from util import (
     get_beeline_orientation,
@@ -19,13 +22,11 @@ from util import (
     get_random_point,
 )
 
+PASS_FEATURES = FeatureLayout([Displacement("possessor", "target")])
+
 
 def get_pass_inputs(env: BluelockEnvironment, possessor_id: int, target_id: int):
-    possessor, target = env.get_players_by_ids(possessor_id, target_id)
-    displacement_to_target = scale_to_env_dims(
-        env, target.position - possessor.position
-    )
-    return [displacement_to_target[0], displacement_to_target[1]]
+    return PASS_FEATURES.encode_env(env, possessor=possessor_id, target=target_id)
 
 
 def get_pass_outputs(
@@ -53,11 +54,38 @@ def make_pass(
     possessor.shoot(power_mag * PLAYER_SHOT_SPEED)
 
 
+def make_batch_pass(
+    batch: BatchedBluelockEnvironment,
+    episodes: np.ndarray,
+    passers: PopulationNetwork,
+    owners: np.ndarray | None,
+    possessor_id: int,
+    target_id: int,
+):
+    # make_pass in the given episodes, the passer of episode i is network owners[i]
+    possessor_slot = batch.get_slot(possessor_id)
+    target_slot = batch.get_slot(target_id)
+    power_mags, orientations = get_run_outputs(
+        passers.activate_batch(
+            PASS_FEATURES.encode(
+                batch, episodes, possessor=possessor_slot, target=target_slot
+            ),
+            None if owners is None else owners[episodes],
+        )
+    )
+    for episode, power_mag, orientation in zip(
+        episodes.tolist(), power_mags.tolist(), orientations.tolist()
+    ):
+        possessor = batch.episodes[episode].players[possessor_slot]
+        possessor.set_rotation(orientation)
+        possessor.shoot(power_mag * PLAYER_SHOT_SPEED)
+
+
 TASK_NAME = "pass"
 
 
 class Pass(EvolutionTask):
-    def __init__(self, seeker: neat.nn.FeedForwardNetwork):
+    def __init__(self, seeker: neat.nn.FeedForwardNetwork, decision_interval: int = 15):
         config_file = get_default_config(f"{TASK_NAME}.ini")
         super().__init__(
             CHECKPOINTS_PATH,
@@ -67,20 +95,25 @@ class Pass(EvolutionTask):
             config_file,
         )
         self.seeker = seeker
+        self.seekers = PopulationNetwork([get_compiled_network(seeker)])
+        # how often the seeker re-decides while the pass travels, ticks in between are fast-forwarded
+        self.decision_interval = decision_interval
         self.possessor_id = 1
         self.offballer_id = 2
 
-    def get_episodes(self) -> list[BluelockEnvironment]:
+    def get_episodes(
+        self, rng: np.random.Generator | None = None
+    ) -> list[BluelockEnvironment]:
         envs = []
         for _ in range(40):
             possessor = Offender(
                 self.possessor_id,
-                get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT),
+                get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng),
             )
             ball = Ball((0, 0))
             offballer = Offender(
                 self.offballer_id,
-                get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT),
+                get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng),
             )
             possessor.possess(ball)
             envs.append(
@@ -93,29 +126,46 @@ class Pass(EvolutionTask):
             )
         return envs
 
-    def compute_fitness(self, genome, config):
+    def compute_batch_awards(
+        self,
+        batch: BatchedBluelockEnvironment,
+        passers: PopulationNetwork,
+        owners: np.ndarray,
+    ) -> list[float]:
         dt, allotted = 15, 6000
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
-        episodes = self.get_episodes()
-        fitness = 0
-        for env in episodes:
-            env = with_seeker(env, self.seeker, self.offballer_id)
-            offender, possessor = env.get_players_by_ids(
-                self.offballer_id, self.possessor_id
-            )
-            offender_pos = offender.position
-            to_possessor_dist = get_euclidean_dist(
-                offender.position, possessor.position
+        offballer_slot = batch.get_slot(self.offballer_id)
+        possessor_slot = batch.get_slot(self.possessor_id)
+        offender_positions = batch.positions[:, offballer_slot].copy()
+        to_possessor_dists = np.sqrt(
+            np.sum(
+                (offender_positions - batch.positions[:, possessor_slot]) ** 2, axis=1
             )
-            make_pass(env, net, self.possessor_id, self.offballer_id)
-            moving_time = 0
-            for elapsed in range(0, allotted, dt):
-                if offender.has_possession():
-                    break
-                if offender.speed > 0:
-                    moving_time += dt
-                env.update(dt)
+        )
+        make_batch_pass(
+            batch,
+            np.arange(len(batch.episodes)),
+            passers,
+            owners,
+            self.possessor_id,
+            self.offballer_id,
+        )
 
+        for _ in range(0, allotted, self.decision_interval):
+            episodes = np.flatnonzero(batch.active)
+            has_possession = batch.possessors[episodes] == offballer_slot
+            batch.finish(episodes[has_possession])
+            do_batch_seek(
+                batch, episodes[~has_possession], self.seekers, None, offballer_slot
+            )
+            if batch.is_done():
+                break
+            batch.fast_forward(dt, self.decision_interval)
+
+        awards = []
+        for env, offender_pos, to_possessor_dist in zip(
+            batch.episodes, offender_positions, to_possessor_dists
+        ):
+            offender = env.get_player(self.offballer_id)
             seeker_movement_award = 0.1 / (
                 0.1
                 + (
@@ -128,14 +178,14 @@ class Pass(EvolutionTask):
                 award = 1 + seeker_movement_award
             else:
                 award = seeker_movement_award
-            fitness += award
-        return fitness / len(episodes)
+            awards.append(award)
+        return awards
 
 
 def evolve_pass():
     seek = Seek()
     pass_task = Pass(seek.get_best_model())
-    for _ in pass_task.evolve(100, 100):
+    for _ in pass_task.evolve(100, 100, is_lockstep=True):
         pass
 
 
@@ -2,6 +2,7 @@ import neat
 import numpy as np
 import math
 from environment.core import BluelockEnvironment, Offender, Ball
+from environment.batched import BatchedBluelockEnvironment
 from environment.config import ENVIRONMENT_HEIGHT, ENVIRONMENT_WIDTH, PLAYER_SHOT_SPEED
 from evolution.config import (
     CHECKPOINTS_PATH,
@@ -10,28 +11,22 @@ from evolution.config import (
     PLOTS_PATH,
 )
 from evolution.task import EvolutionTask
-from evolution.util import scale_to_env_dims
+from evolution.network import PopulationNetwork
+from evolution.features import FeatureLayout, Displacement, BallVelocity, BALL
+from evolution.util import get_run_outputs
 from visualization.visualizer import BluelockEnvironmentVisualizer
 from util import (
-    get_unit_vector,
     get_beeline_orientation,
     get_euclidean_dist,
     get_random_point,
     get_random_within_range,
 )
 
+SEEK_FEATURES = FeatureLayout([Displacement("seeker", BALL), BallVelocity()])
+
 
 def get_seek_inputs(env: BluelockEnvironment, seeker_id: int):
-    ball = env.ball
-    seeker = env.get_player(seeker_id)
-    displacement_to_ball = scale_to_env_dims(env, ball.position - seeker.position)
-    ball_velocity = ball.speed * get_unit_vector(ball.direction)
-    return [
-        displacement_to_ball[0],
-        displacement_to_ball[1],
-        ball_velocity[0],
-        ball_velocity[1],
-    ]
+    return SEEK_FEATURES.encode_env(env, seeker=seeker_id)
 
 
 def get_seek_outputs(
@@ -52,16 +47,32 @@ def do_seek(
     seeker.run(speed_mag)
 
 
-def with_seeker(
-    env: BluelockEnvironment, seeker_net: neat.nn.FeedForwardNetwork, seeker_id: int
+def do_batch_seek(
+    batch: BatchedBluelockEnvironment,
+    episodes: np.ndarray,
+    seekers: PopulationNetwork,
+    owners: np.ndarray | None,
+    seeker_slot: int,
 ):
-    old_update = env.update
+    # do_seek in the given episodes, the seeker of episode i is network owners[i]
+    if len(episodes) == 0:
+        return
+    speed_mags, orientations = get_run_outputs(
+        seekers.activate_batch(
+            SEEK_FEATURES.encode(batch, episodes, seeker=seeker_slot),
+            None if owners is None else owners[episodes],
+        )
+    )
+    batch.rotations[episodes, seeker_slot] = orientations
+    batch.speeds[episodes, seeker_slot] = (
+        batch.top_speeds[episodes, seeker_slot] * speed_mags
+    )
 
-    def new_update(*args, **kwargs):
-        do_seek(env, seeker_net, seeker_id)
-        old_update(*args, **kwargs)
 
-    env.update = new_update
+def with_seeker(
+    env: BluelockEnvironment, seeker_net: neat.nn.FeedForwardNetwork, seeker_id: int
+):
+    env.controllers.register("seeker", lambda: do_seek(env, seeker_net, seeker_id))
     return env
 
 
@@ -69,7 +80,7 @@ TASK_NAME = "seek"
 
 
 class Seek(EvolutionTask):
-    def __init__(self):
+    def __init__(self, decision_interval: int = 15):
         config_file = get_default_config(f"{TASK_NAME}.ini")
         super().__init__(
             CHECKPOINTS_PATH,
@@ -78,18 +89,24 @@ class Seek(EvolutionTask):
             TASK_NAME,
             config_file,
         )
+        # how often the seeker re-decides, ticks in between are fast-forwarded
+        self.decision_interval = decision_interval
         self.offballer_id = 1
 
-    def get_episodes(self) -> list[BluelockEnvironment]:
+    def get_episodes(
+        self, rng: np.random.Generator | None = None
+    ) -> list[BluelockEnvironment]:
         envs = []
         for _ in range(40):
             offender = Offender(
                 self.offballer_id,
-                get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT),
+                get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng),
+            )
+            ball = Ball(
+                get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng)
             )
-            ball = Ball(get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT))
             ball.direction = get_random_within_range(
-                math.pi / 20, -math.pi / 20
+                math.pi / 20, -math.pi / 20, rng
             ) + get_beeline_orientation(offender.position - ball.position)
             ball.speed = PLAYER_SHOT_SPEED
             envs.append(
@@ -99,22 +116,31 @@ class Seek(EvolutionTask):
             )
         return envs
 
-    def compute_fitness(self, genome, config):
+    def compute_batch_awards(
+        self,
+        batch: BatchedBluelockEnvironment,
+        seekers: PopulationNetwork,
+        owners: np.ndarray,
+    ) -> list[float]:
         dt, allotted = 15, 6000
-        net = neat.nn.FeedForwardNetwork.create(genome, config)
-        episodes = self.get_episodes()
-        fitness = 0
-        for env in episodes:
-            env = with_seeker(env, net, self.offballer_id)
+        seeker_slot = batch.get_slot(self.offballer_id)
+        moving_times = np.zeros(len(batch.episodes))
+        seek_times = np.full(len(batch.episodes), allotted - dt)
+        for elapsed in range(0, allotted, self.decision_interval):
+            episodes = np.flatnonzero(batch.active)
+            has_possession = batch.possessors[episodes] == seeker_slot
+            seek_times[episodes[has_possession]] = elapsed
+            batch.finish(episodes[has_possession])
+            episodes = episodes[~has_possession]
+            moving_times[episodes[batch.speeds[episodes, seeker_slot] > 0]] += dt
+            do_batch_seek(batch, episodes, seekers, owners, seeker_slot)
+            if batch.is_done():
+                break
+            batch.fast_forward(dt, self.decision_interval)
+
+        awards = []
+        for env, moving_time, elapsed in zip(batch.episodes, moving_times, seek_times):
             offender = env.get_player(self.offballer_id)
-            moving_time = 0
-            for elapsed in range(0, allotted, dt):
-                if offender.has_possession():
-                    break
-                if offender.speed > 0:
-                    moving_time += dt
-                env.update(dt)
-
             award = 0
             if offender.has_possession():
                 laziness_bonus = 0.1 / (0.1 + moving_time / elapsed)
@@ -125,13 +151,13 @@ class Seek(EvolutionTask):
                     get_euclidean_dist(env.ball.position, offender.position)
                     / max_dist_possible
                 )
-            fitness += award
-        return fitness / len(episodes)
+            awards.append(award)
+        return awards
 
 
 def evolve_seek():
     seek = Seek()
-    for _ in seek.evolve(100, 100):
+    for _ in seek.evolve(100, 100, is_lockstep=True):
         pass
 
 
@@ -0,0 +1,111 @@
+import math
+import random
+import neat
+from dataclasses import dataclass, field
+from itertools import count
+
+
+@dataclass
+class Niche:
+    # a species of a steady state population, its founder stays its representative
+    representative: object
+    members: dict = field(default_factory=dict)
+
+    def get_mean_fitness(self):
+        fitnesses = [member.fitness for member in self.members.values()]
+        return sum(fitnesses) / len(fitnesses)
+
+
+class SteadyStatePopulation:
+    """
+    A NEAT population that changes one genome at a time instead of a generation at a
+    time. An evaluated genome joins the first species whose representative it is
+    compatible with, or founds its own. Once the population is full it pushes out the
+    least fit member of its species, or of the largest species when it is a founder.
+    Offspring are bred the way neat's reproduction does: a species is picked in
+    proportion to its adjusted fitness, the parents from its fittest survival_threshold
+    fraction.
+    """
+
+    def __init__(self, config: neat.Config):
+        self.config = config
+        self.genome_indexer = count(1)
+        self.species_indexer = count(1)
+        self.species: dict[int, Niche] = {}
+        self.best_genome = None
+
+    def __len__(self):
+        return sum(len(niche.members) for niche in self.species.values())
+
+    def create_initial(self) -> list:
+        genomes = []
+        for _ in range(self.config.pop_size):
+            genome = self.config.genome_type(next(self.genome_indexer))
+            genome.configure_new(self.config.genome_config)
+            genomes.append(genome)
+        return genomes
+
+    def add(self, genome):
+        # the genome must have been evaluated
+        niche = self.get_niche(genome)
+        niche.members[genome.key] = genome
+        if self.best_genome is None or genome.fitness > self.best_genome.fitness:
+            self.best_genome = genome
+        if len(self) > self.config.pop_size:
+            if len(niche.members) == 1:
+                niche = max(self.species.values(), key=lambda niche: len(niche.members))
+            self.remove_least_fit(niche)
+
+    def get_niche(self, genome) -> Niche:
+        threshold = self.config.species_set_config.compatibility_threshold
+        for niche in self.species.values():
+            distance = genome.distance(niche.representative, self.config.genome_config)
+            if distance < threshold:
+                return niche
+        niche = Niche(genome)
+        self.species[next(self.species_indexer)] = niche
+        return niche
+
+    def remove_least_fit(self, niche: Niche):
+        key = min(niche.members, key=lambda key: niche.members[key].fitness)
+        del niche.members[key]
+        for species_id, other in list(self.species.items()):
+            if len(other.members) == 0:
+                del self.species[species_id]
+
+    def spawn(self):
+        niches = list(self.species.values())
+        fitnesses = [
+            member.fitness for niche in niches for member in niche.members.values()
+        ]
+        min_fitness = min(fitnesses)
+        # as in neat's reproduction, the range is not allowed below 1
+        fitness_range = max(1.0, max(fitnesses) - min_fitness)
+        adjusted_fitnesses = [
+            (niche.get_mean_fitness() - min_fitness) / fitness_range for niche in niches
+        ]
+        if sum(adjusted_fitnesses) <= 0:
+            adjusted_fitnesses = None
+        niche = random.choices(niches, weights=adjusted_fitnesses)[0]
+
+        members = sorted(
+            niche.members.values(), key=lambda member: member.fitness, reverse=True
+        )
+        reproduction_config = self.config.reproduction_config
+        cutoff = max(
+            2, math.ceil(reproduction_config.survival_threshold * len(members))
+        )
+        parents = members[:cutoff]
+        child = self.config.genome_type(next(self.genome_indexer))
+        child.configure_crossover(
+            random.choice(parents), random.choice(parents), self.config.genome_config
+        )
+        child.mutate(self.config.genome_config)
+        return child
+
+    def is_solved(self):
+        return (
+            not self.config.no_fitness_termination
+            and self.best_genome is not None
+            and self.best_genome.fitness >= self.config.fitness_threshold
+        )
@@ -1,9 +1,24 @@
 import neat
 import os
 import multiprocessing
-import random
 import time
-from evolution.util import MostRecentHistoryRecorder, EvolutionVisualizer
+import queue
+import numpy as np
+from environment.core import BluelockEnvironment
+from environment.batched import BatchedBluelockEnvironment
+from evolution.util import (
+    MostRecentHistoryRecorder,
+    HallOfFameRecorder,
+    EvolutionVisualizer,
+    get_mean_award,
+)
+from evolution.episodes import EpisodeBank, get_test_seed
+from evolution.network import CompiledNetwork, PopulationNetwork
+from evolution.workers import create_pool, evaluate_forked
+from evolution.steady_state import SteadyStatePopulation
+from evolution.islands import run_island
+from evolution.hall_of_fame import HallOfFame
+from evolution.metrics import MetricsSink, MetricsRecorder
 
 
 class EvolutionTask:
@@ -26,11 +41,29 @@ class EvolutionTask:
         self.checkpoint_path = os.path.join(checkpoint_dir, self.tag)
         self.plot_path = os.path.join(plot_dir, self.tag)
         self.model_path = os.path.join(model_dir, self.tag)
+        self.hall_of_fame = HallOfFame(
+            os.path.join(model_dir, f"{self.tag}_hall_of_fame")
+        )
         self.config = config
         self.cpus = cpus
+        # the curriculum's difficulty, for tasks that have one
+        self.difficulty: float | None = None
         self.seed = self.get_seed()
+        self.bank: EpisodeBank | None = None
 
-    def evolve(self, generations: int, generation_step_size: int = 5):
+    def evolve(
+        self,
+        generations: int,
+        generation_step_size: int = 5,
+        is_lockstep: bool = False,
+        is_forked: bool = False,
+        episode_chunk_size: int | None = None,
+        metrics: MetricsSink | None = None,
+    ):
+        if is_lockstep and not self.has_batched_evaluation():
+            raise ValueError(
+                f"{self.tag} has no batched evaluation to evolve in lockstep"
+            )
         population = neat.Population(self.config)
         if os.path.exists(self.checkpoint_path):
             population = MostRecentHistoryRecorder.restore_generation(
@@ -44,36 +77,261 @@ class EvolutionTask:
             )
             return
 
-        print(f"Evolving {self.tag} with {self.cpus} cpus")
+        if is_lockstep:
+            print(f"Evolving {self.tag} in lockstep")
+        else:
+            print(f"Evolving {self.tag} with {self.cpus} cpus")
+        # forked workers are started per generation, otherwise they are kept warm
+        pool = None
+        if not is_lockstep and not is_forked:
+            pool = create_pool(self, self.cpus)
 
         population.add_reporter(neat.StdOutReporter(True))
         population.add_reporter(EvolutionVisualizer(output_prefix=self.plot_path))
-        population.add_reporter(
-            MostRecentHistoryRecorder(self.checkpoint_path, self.model_path)
-        )
-        pe = neat.ParallelEvaluator(self.cpus, self.eval_genome)
+        recorder = MostRecentHistoryRecorder(self.checkpoint_path, self.model_path)
+        population.add_reporter(recorder)
+        population.add_reporter(HallOfFameRecorder(self))
+        if metrics is not None:
+            population.add_reporter(MetricsRecorder(metrics, self.tag))
 
         def evaluate(genomes, config):
+            # the generation's episodes are drawn once here and sent to the workers
             self.seed = self.get_seed()
-            pe.evaluate(genomes, config)
+            bank = self.get_episode_bank()
+            if is_lockstep:
+                self.evaluate_lockstep(genomes, config)
+                return
+            individuals = [genome for _, genome in genomes]
+            units = self.get_units(individuals, episode_chunk_size)
+            # a unit per genome is grouped into chunks, a grid of smaller units is
+            # handed out one unit at a time so idle workers pick up the slack
+            chunk_count = None if episode_chunk_size is None else len(units)
+            if is_forked:
+                awards = evaluate_forked(self, units, self.cpus, chunk_count)
+            else:
+                awards = pool.evaluate(bank, units, chunk_count)
+            units_per_genome = len(units) // len(individuals)
+            for index, genome in enumerate(individuals):
+                genome_awards = []
+                for unit_awards in awards[
+                    index * units_per_genome : (index + 1) * units_per_genome
+                ]:
+                    genome_awards.extend(unit_awards)
+                genome.fitness = get_mean_award(genome_awards)
 
-        while generations > 0:
-            step_size = min(generations, generation_step_size)
-            yield population.run(evaluate, n=step_size)
-            generations -= step_size
+        try:
+            while generations > 0:
+                step_size = min(generations, generation_step_size)
+                yield population.run(evaluate, n=step_size)
+                generations -= step_size
+        finally:
+            if pool is not None:
+                pool.close()
+            recorder.writer.flush()
         return
 
-    # override
+    def evolve_steady_state(self, evaluations: int, report_interval: int | None = None):
+        # evolves without generations, workers are kept busy breeding and evaluating one
+        # genome at a time, the best genome is yielded every report_interval evaluations
+        population = SteadyStatePopulation(self.config)
+        report_interval = report_interval or self.config.pop_size
+        unevaluated = population.create_initial()
+        # two evaluations in flight per worker, so none waits on the parent
+        in_flight = 2 * self.cpus
+        results = queue.Queue()
+        print(f"Evolving {self.tag} steady state with {self.cpus} cpus")
+
+        def submit(genome):
+            pool.submit(
+                self.get_units([genome]),
+                lambda awards: results.put((genome, awards)),
+                lambda error: results.put((genome, error)),
+            )
+
+        with create_pool(self, self.cpus) as pool:
+            self.seed = self.get_seed()
+            pool.broadcast(self.get_episode_bank())
+            for _ in range(min(in_flight, len(unevaluated))):
+                submit(unevaluated.pop())
+            for evaluation in range(1, evaluations + 1):
+                genome, awards = results.get()
+                if isinstance(awards, BaseException):
+                    raise awards
+                genome.fitness = get_mean_award(awards[0])
+                population.add(genome)
+
+                if population.is_solved() or evaluation == evaluations:
+                    self.record_fame(population.best_genome, evaluation)
+                    yield population.best_genome
+                    return
+                if evaluation % report_interval == 0:
+                    print(
+                        f"{evaluation} evaluations of {self.tag}, {len(population.species)} species, best fitness {population.best_genome.fitness}"
+                    )
+                    self.record_fame(population.best_genome, evaluation)
+                    # fresh episodes for the next stretch, like a new generation would draw
+                    self.seed = self.get_seed()
+                    pool.broadcast(self.get_episode_bank())
+                    yield population.best_genome
+                submit(unevaluated.pop() if unevaluated else population.spawn())
+
+    def evolve_islands(
+        self,
+        generations: int,
+        island_count: int,
+        migration_interval: int = 5,
+        migrant_count: int = 2,
+    ):
+        # evolves a population per process, every migration_interval generations the
+        # fittest genomes of each island move on to the next island of a ring, the best
+        # genome across the islands is yielded after every migration
+        connections, processes = [], []
+        for island in range(island_count):
+            connection, island_connection = multiprocessing.Pipe()
+            process = multiprocessing.Process(
+                target=run_island,
+                args=(self, island, migrant_count, island_connection),
+                daemon=True,
+            )
+            process.start()
+            island_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        def receive(connection):
+            message = connection.recv()
+            if isinstance(message, BaseException):
+                raise message
+            return message
+
+        try:
+            # islands restored from their checkpoints carry on from the least evolved
+            evolved = min(receive(connection) for connection in connections)
+            generations -= evolved
+            if generations <= 0:
+                print(
+                    f"The desired # of generations have already been reached. Not training {self.tag}"
+                )
+                return
+
+            print(f"Evolving {self.tag} on {island_count} islands")
+            migrants = [[] for _ in range(island_count)]
+            while generations > 0:
+                step_size = min(generations, migration_interval)
+                for connection, immigrants in zip(connections, migrants):
+                    connection.send((step_size, immigrants))
+                reports = [receive(connection) for connection in connections]
+                migrants = [reports[island - 1][0] for island in range(island_count)]
+                best_genomes = [best_genome for _, best_genome in reports]
+                best_genome = max(best_genomes, key=lambda genome: genome.fitness)
+                print(
+                    f"{self.tag} islands best fitness {[genome.fitness for genome in best_genomes]}"
+                )
+                evolved += step_size
+                self.record_fame(best_genome, evolved - 1)
+                yield best_genome
+                generations -= step_size
+        finally:
+            for connection, process in zip(connections, processes):
+                try:
+                    connection.send(None)
+                except OSError:
+                    pass
+                process.join(timeout=5)
+                if process.is_alive():
+                    process.terminate()
+
+    def record_fame(self, genome, generation: int):
+        # saves genome as the best model and adds it to the hall of fame, for evolutions
+        # that have no reporters to do it
+        MostRecentHistoryRecorder.save_best_genome(self.model_path, genome, self.config)
+        self.hall_of_fame.add_genomes(
+            [genome], [self.config], generation, genome.fitness, self.difficulty
+        )
+
     def compute_fitness(self, genome, config) -> float:
-        return float("-inf")
+        return get_mean_award(
+            self.compute_awards(genome, config, self.get_episode_bank())
+        )
+
+    def compute_test_fitness(self, genome, config) -> float:
+        # on episodes of its own rather than those of the generation genome came from
+        bank = EpisodeBank.generate(self.get_episodes, get_test_seed(), self.difficulty)
+        return get_mean_award(self.compute_awards(genome, config, bank))
+
+    # override, the award of every episode of bank
+    def compute_awards(self, genome, config, bank: EpisodeBank) -> list[float]:
+        nets = PopulationNetwork([CompiledNetwork.create(genome, config)])
+        owners = np.zeros(len(bank), dtype=int)
+        return self.compute_batch_awards(bank.get_batch(), nets, owners)
+
+    # override, the award of every episode of batch, where nets' network owners[i] plays
+    # episode i
+    def compute_batch_awards(
+        self,
+        batch: BatchedBluelockEnvironment,
+        nets: PopulationNetwork,
+        owners: np.ndarray,
+    ) -> list[float]:
+        return []
+
+    def has_batched_evaluation(self) -> bool:
+        # tasks that evaluate one episode at a time can not be evolved in lockstep
+        return type(self).compute_batch_awards is not EvolutionTask.compute_batch_awards
+
+    def evaluate_lockstep(self, genomes, config):
+        # every genome plays its own copy of the generation's episodes, all in one batch
+        bank = self.get_episode_bank()
+        nets = PopulationNetwork(
+            [CompiledNetwork.create(genome, config) for _, genome in genomes]
+        )
+        batch = bank.tile(len(genomes)).get_batch()
+        owners = np.repeat(np.arange(len(genomes)), len(bank))
+        awards = self.compute_batch_awards(batch, nets, owners)
+        for index, (_, genome) in enumerate(genomes):
+            genome.fitness = get_mean_award(
+                awards[index * len(bank) : (index + 1) * len(bank)]
+            )
+
+    # override
+    def get_episodes(
+        self, rng: np.random.Generator | None = None
+    ) -> list[BluelockEnvironment]:
+        return []
+
+    def get_episode_bank(self) -> EpisodeBank:
+        # drawn again when the seed or the difficulty the episodes are shaped by changes
+        key = (self.seed, self.difficulty)
+        if self.bank is None or (self.bank.seed, self.bank.difficulty) != key:
+            self.bank = EpisodeBank.generate(
+                self.get_episodes, self.seed, self.difficulty
+            )
+        return self.bank
+
+    def use_bank(self, bank: EpisodeBank):
+        # a worker takes on a broadcast bank along with the seed and difficulty of it
+        self.bank, self.seed, self.difficulty = bank, bank.seed, bank.difficulty
+
+    def get_units(self, genomes, episode_chunk_size: int | None = None):
+        # (genome, start, stop) units of work, the units of a genome are consecutive and
+        # cover the bank's episodes in order
+        episode_count = len(self.get_episode_bank())
+        chunk_size = episode_chunk_size or episode_count
+        return [
+            (genome, start, min(start + chunk_size, episode_count))
+            for genome in genomes
+            for start in range(0, episode_count, chunk_size)
+        ]
 
-    def eval_genome(self, genome, config) -> float:
-        random.seed(self.seed)
-        return self.compute_fitness(genome, config)
+    def evaluate_chunk(self, units) -> list[list[float]]:
+        # runs in a worker, which already holds the task, its config and episode bank
+        return [
+            self.compute_awards(genome, self.config, self.bank.select(start, stop))
+            for genome, start, stop in units
+        ]
 
     def get_best_model(self):
-        genome = MostRecentHistoryRecorder.load_best_genome(self.model_path)
-        return neat.nn.FeedForwardNetwork.create(genome, self.config)
+        return MostRecentHistoryRecorder.load_best_model(self.model_path, self.config)
 
     def get_seed(self):
         return int(time.time())
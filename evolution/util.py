@@ -3,6 +3,7 @@ import random
 import pickle
 import gzip
 import math
+import os
 import neat
 import evolution.visualize as visualize
 from environment.config import (
@@ -11,11 +12,19 @@ from environment.config import (
     PLAYER_DEFENDER_SPEED,
 )
 from environment.core import BluelockEnvironment, Offender, Defender, Ball
-from environment.defense.agent import with_policy_defense, naive_man_to_man
+from environment.batched import BatchedBluelockEnvironment
+from environment.control import DEFENSE_PRIORITY
+from environment.defense.agent import (
+    with_policy_defense,
+    get_batch_man_to_man_defense,
+    naive_man_to_man,
+)
+from evolution.checkpoints import CheckpointWriter, read_checkpoint
+from evolution.models import save_genomes, get_networks
 from neat.population import Population
 from neat.reporting import BaseReporter
 from typing import Callable
-from util import get_random_point
+from util import get_random_point, get_beeline_orientations
 
 
 class MostRecentHistoryRecorder(BaseReporter):
@@ -24,32 +33,68 @@ class MostRecentHistoryRecorder(BaseReporter):
         self.checkpoint_file_path = checkpoint_file_path
         self.best_save_path = best_save_path
         self.generation = 0
+        self.writer = CheckpointWriter(checkpoint_file_path)
 
     def start_generation(self, generation):
         self.generation = generation
 
     def post_evaluate(self, config, population, species, best_genome):
-        with open(self.best_save_path, "wb") as f:
-            pickle.dump(best_genome, f)
+        MostRecentHistoryRecorder.save_best_genome(
+            self.best_save_path, best_genome, config
+        )
 
     def end_generation(self, config, population, species_set):
-        with open(self.checkpoint_file_path, "wb") as f:
-            data = (self.generation, config, population, species_set, random.getstate())
-            f.write(gzip.compress(pickle.dumps(data)))
+        self.writer.write(
+            self.generation, [config], [population], [species_set], random.getstate()
+        )
+
+    @staticmethod
+    def save_best_genome(save_path: str, genome, config: neat.Config):
+        # saved as its network, see evolution.models
+        save_genomes(save_path, [genome], [config])
 
     @staticmethod
-    def load_best_genome(save_path: str):
-        with open(save_path, "rb") as f:
-            return pickle.load(f)
+    def load_best_model(save_path: str, config: neat.Config):
+        # shared with every other stage that loads it, see get_networks
+        return get_networks(save_path, [config])[0]
 
     @staticmethod
     def restore_generation(save_path: str):
-        with open(save_path, "rb") as f:
-            generation, config, population, species, random_state = pickle.loads(
-                gzip.decompress(f.read())
+        if os.path.isfile(save_path):
+            # a checkpoint from before checkpoints were directories
+            with open(save_path, "rb") as f:
+                generation, config, population, species, random_state = pickle.loads(
+                    gzip.decompress(f.read())
+                )
+        else:
+            generation, configs, populations, species_sets, random_state = (
+                read_checkpoint(save_path)
             )
-            random.setstate(random_state)
-            return Population(config, (population, species, generation))
+            config, population, species = configs[0], populations[0], species_sets[0]
+        random.setstate(random_state)
+        restored = Population(config, (population, species, generation))
+        species.reporters = restored.reporters
+        return restored
+
+
+class HallOfFameRecorder(BaseReporter):
+    # adds the best genome of every generation to a task's hall of fame
+    def __init__(self, task):
+        super().__init__()
+        self.task = task
+        self.generation = 0
+
+    def start_generation(self, generation):
+        self.generation = generation
+
+    def post_evaluate(self, config, population, species, best_genome):
+        self.task.hall_of_fame.add_genomes(
+            [best_genome],
+            [config],
+            self.generation,
+            best_genome.fitness,
+            self.task.difficulty,
+        )
 
 
 class EvolutionVisualizer(neat.StatisticsReporter):
@@ -79,13 +124,14 @@ def get_keepaway2v1_env(
     defender_id=3,
     defender_pos=(ENVIRONMENT_WIDTH // 2, 0),
     possessor_pos=(0, ENVIRONMENT_HEIGHT // 2),
+    rng: np.random.Generator | None = None,
 ):
     defender = Defender(
         defender_id, defender_pos, top_speed=difficulty * PLAYER_DEFENDER_SPEED
     )
     possessor = Offender(possessor_id, possessor_pos)
     offballer = Offender(
-        offballer_id, get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT)
+        offballer_id, get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT, rng=rng)
     )
     ball = Ball((0, 0))
     possessor.possess(ball)
@@ -100,8 +146,66 @@ def get_keepaway2v1_env(
     )
 
 
-def scale_to_env_dims(env: BluelockEnvironment, displacement: np.ndarray):
-    return np.array([displacement[0] / env.width, displacement[1] / env.height])
+# Steps keepaway episodes in lockstep, running the batched offense control before the defense.
+# Controls re-decide every decision_interval while physics is resolved at dt.
+def get_keepaway2v1_batch_awards(
+    batch: BatchedBluelockEnvironment,
+    offense_control: Callable[[list[tuple[int, BluelockEnvironment]]], None],
+    dt: int,
+    allotted: int,
+    decision_interval: int | None = None,
+):
+    decision_interval = decision_interval or dt
+    batch.controllers.register("offense", offense_control)
+    batch.controllers.register(
+        "defense",
+        get_batch_man_to_man_defense(batch, is_incremental=True),
+        priority=DEFENSE_PRIORITY,
+    )
+    for _ in range(0, allotted, decision_interval):
+        batch.finish(batch.does_defense_have_possession())
+        if batch.is_done():
+            break
+        batch.update(decision_interval, substep=dt)
+
+    # the defense never gives the ball back, so its last change of hands ends the episode
+    survival_times = np.where(
+        batch.does_defense_have_possession(),
+        np.minimum(batch.possession_changed_at, allotted - dt),
+        allotted - dt,
+    )
+    return [
+        get_keepaway2v1_fitness(survival_time / allotted)
+        for survival_time in survival_times.tolist()
+    ]
+
+
+def get_keepaway2v1_batch_fitness(
+    batch: BatchedBluelockEnvironment,
+    offense_control: Callable[[list[tuple[int, BluelockEnvironment]]], None],
+    dt: int,
+    allotted: int,
+    decision_interval: int | None = None,
+):
+    return get_mean_award(
+        get_keepaway2v1_batch_awards(
+            batch, offense_control, dt, allotted, decision_interval
+        )
+    )
+
+
+def get_run_outputs(outputs: np.ndarray):
+    # magnitude and orientation of every row of (vx, vy) network outputs
+    magnitudes = np.sqrt(outputs[:, 0] ** 2 + outputs[:, 1] ** 2) / math.sqrt(2)
+    return magnitudes, get_beeline_orientations(outputs)
+
+
+def get_mean_award(awards: list[float]) -> float:
+    # added up one at a time, like the fitness loops of the tasks
+    fitness = 0
+    for award in awards:
+        fitness += award
+    return float(fitness / len(awards))
 
 
 OffenseControl = Callable[[BluelockEnvironment, Offender], None]
@@ -114,12 +218,10 @@ def with_offense_controls(
     control_map = {}
     for id, control in controls:
         control_map[id] = control
-    old_update = env.update
 
-    def new_update(*args, **kwargs):
+    def control():
         for player_id in control_map:
             control_map[player_id](env, env.get_player(player_id))
-        old_update(*args, **kwargs)
 
-    env.update = new_update
+    env.controllers.register("offense", control)
     return env
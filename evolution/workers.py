@@ -0,0 +1,151 @@
+import multiprocessing
+from evolution.episodes import EpisodeBank
+
+# the task of a worker process, shipped once when its pool starts
+worker_task = None
+worker_barrier = None
+# the items of a forked round of work, inherited by its workers copy-on-write
+forked_items: list = []
+# how many chunks the items are split into per worker unless told otherwise
+CHUNKS_PER_PROCESS = 4
+
+
+def init_worker(task, barrier=None):
+    global worker_task, worker_barrier
+    worker_task, worker_barrier = task, barrier
+
+
+def receive_bank(bank: EpisodeBank):
+    # the barrier holds a worker back until every other worker has taken a copy too
+    worker_task.use_bank(bank)
+    worker_barrier.wait()
+
+
+def get_bank_key(bank: EpisodeBank | None) -> tuple | None:
+    # the seed and difficulty a bank was drawn at, which is all it takes to draw it again
+    return None if bank is None else (bank.seed, bank.difficulty)
+
+
+def evaluate_chunk(work: tuple[tuple | None, list]) -> list:
+    # a worker the pool started after the last broadcast holds the bank it was started
+    # with, it draws the bank the chunk is meant for itself rather than score on that
+    bank_key, chunk = work
+    if bank_key is not None and get_bank_key(worker_task.bank) != bank_key:
+        worker_task.seed, worker_task.difficulty = bank_key
+        worker_task.get_episode_bank()
+    return worker_task.evaluate_chunk(chunk)
+
+
+def evaluate_forked_chunk(bounds: tuple[int, int]) -> list:
+    start, stop = bounds
+    return worker_task.evaluate_chunk(forked_items[start:stop])
+
+
+def get_chunk_bounds(item_count: int, chunk_count: int) -> list[tuple[int, int]]:
+    # contiguous and evenly sized, so results come back in the order of the items
+    size = max(1, -(-item_count // chunk_count))
+    return [
+        (start, min(start + size, item_count)) for start in range(0, item_count, size)
+    ]
+
+
+def get_chunks(items: list, chunk_count: int) -> list[list]:
+    return [
+        items[start:stop] for start, stop in get_chunk_bounds(len(items), chunk_count)
+    ]
+
+
+def evaluate_forked(
+    task, items: list, processes: int, chunk_count: int | None = None
+) -> list:
+    # forks workers for one round of work, they inherit the task, its episode bank and
+    # the items copy-on-write so only chunk bounds and results cross between processes
+    global forked_items
+    forked_items = items
+    context = multiprocessing.get_context("fork")
+    try:
+        with context.Pool(processes, initializer=init_worker, initargs=(task,)) as pool:
+            results = []
+            bounds = get_chunk_bounds(
+                len(items), chunk_count or processes * CHUNKS_PER_PROCESS
+            )
+            for chunk_results in pool.imap(evaluate_forked_chunk, bounds):
+                results.extend(chunk_results)
+            return results
+    finally:
+        forked_items = []
+
+
+class WorkerPool:
+    """
+    Worker processes kept warm for the whole of an evolution. The task, configs included,
+    is shipped once through the pool's initializer. A new episode bank is broadcast once
+    to every worker, after which only chunks of work, tagged with the bank they are
+    meant for, and their results cross between processes. Tasks handle a chunk in
+    evaluate_chunk.
+    """
+
+    def __init__(self, task, processes: int):
+        self.processes = processes
+        self.bank: EpisodeBank | None = None
+        barrier = multiprocessing.Barrier(processes)
+        self.pool = multiprocessing.Pool(
+            processes, initializer=init_worker, initargs=(task, barrier)
+        )
+
+    def broadcast(self, bank: EpisodeBank):
+        # every worker has taken the bank once this returns, a worker that failed to
+        # raises here rather than evaluate on the bank before it
+        if bank is not self.bank:
+            self.pool.map(receive_bank, [bank] * self.processes, chunksize=1)
+            self.bank = bank
+
+    def submit(self, items: list, callback, error_callback):
+        # evaluates items as one chunk without waiting for it
+        self.pool.apply_async(
+            evaluate_chunk,
+            ((get_bank_key(self.bank), items),),
+            callback=callback,
+            error_callback=error_callback,
+        )
+
+    def evaluate(
+        self, bank: EpisodeBank, items: list, chunk_count: int | None = None
+    ) -> list:
+        self.broadcast(bank)
+        results, bank_key = [], get_bank_key(bank)
+        for chunk_results in self.pool.imap(
+            evaluate_chunk,
+            [
+                (bank_key, chunk)
+                for chunk in get_chunks(
+                    items, chunk_count or self.processes * CHUNKS_PER_PROCESS
+                )
+            ],
+        ):
+            results.extend(chunk_results)
+        return results
+
+    def close(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# what pools are made of, worker processes on this machine unless set otherwise
+pool_backend = WorkerPool
+
+
+def use_backend(backend):
+    # a callable of (task, processes) that returns a pool, like WorkerPool
+    global pool_backend
+    pool_backend = backend
+
+
+def create_pool(task, processes: int):
+    return pool_backend(task, processes)
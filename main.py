@@ -2,7 +2,7 @@ import argparse
 from environment.core import Offender, Defender, Ball
 from environment.config import ENVIRONMENT_HEIGHT, ENVIRONMENT_WIDTH
 from environment.core import BluelockEnvironment
-from environment.defense.agent import with_policy_defense, naive_man_to_man
+from environment.defense.agent import with_policy_defense, spatial_man_to_man
 from evolution.predefined_behavior.keepaway import (
     evolve_predefined_behavior_keepaway,
     watch_predefined_behavior_keepaway,
@@ -12,9 +12,12 @@ from evolution.sequential.keepaway import (
     watch_sequential_keepaway,
 )
 from evolution.coevolution.keepaway import coevolve_keepaway, watch_coevolved_keepaway
+from evolution.distributed import DistributedPool, run_worker
+from evolution.workers import use_backend
 from visualization.visualizer import BluelockEnvironmentVisualizer
 from util import get_random_point
 from enum import Enum
+from functools import partial
 
 
 class TrainingStyle(str, Enum):
@@ -40,15 +43,13 @@ def visualize(namespace: argparse.Namespace):
     ball = Ball(position=get_random_point(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT))
     offenders[0].possess(ball)
 
-    env = with_policy_defense(
-        BluelockEnvironment(
-            dims=(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT),
-            offense=offenders,
-            defense=defenders,
-            ball=ball,
-        ),
-        policy=naive_man_to_man,
+    env = BluelockEnvironment(
+        dims=(ENVIRONMENT_WIDTH, ENVIRONMENT_HEIGHT),
+        offense=offenders,
+        defense=defenders,
+        ball=ball,
     )
+    env = with_policy_defense(env, policy=spatial_man_to_man(env))
 
     vis = BluelockEnvironmentVisualizer(env)
     vis.start()
@@ -56,6 +57,9 @@ def visualize(namespace: argparse.Namespace):
 
 def train(namespace: argparse.Namespace):
     style: TrainingStyle = namespace.style
+    if namespace.listen is not None:
+        host, port = namespace.listen.rsplit(":", 1)
+        use_backend(partial(DistributedPool, address=(host, int(port))))
     if style == TrainingStyle.SEQUENTIAL:
         evolve_sequential_keepaway()
     elif style == TrainingStyle.PREDEFINED_BEHAVIOR:
@@ -64,6 +68,10 @@ def train(namespace: argparse.Namespace):
         coevolve_keepaway()
 
 
+def work(namespace: argparse.Namespace):
+    run_worker(namespace.host, namespace.port)
+
+
 def watch(namespace: argparse.Namespace):
     style: TrainingStyle = namespace.style
     if style == TrainingStyle.SEQUENTIAL:
@@ -99,6 +107,22 @@ if __name__ == "__main__":
         default=TrainingStyle.SEQUENTIAL,
         help="The methodology of training the playmaking AI. In 'sequential' training, the AI will learn each disjoint task of soccer and aggregate its learnings",
     )
+    train_parser.add_argument(
+        "--listen",
+        default=None,
+        help="Evaluate on workers that connect to this host:port instead of on local processes",
+    )
+
+    worker_parser = subparsers.add_parser(
+        name="worker", description="Evaluate for a training run started with --listen"
+    )
+    worker_parser.set_defaults(func=work)
+    worker_parser.add_argument(
+        "--host", default="localhost", help="The host the training run listens on"
+    )
+    worker_parser.add_argument(
+        "--port", type=int, default=5555, help="The port the training run listens on"
+    )
 
     watch_parser = subparsers.add_parser(
         name="watch", description="Watch the result of training for the playmaking AI"
@@ -0,0 +1,51 @@
+import random
+import neat
+from evolution.config import get_default_config
+from evolution.util import MostRecentHistoryRecorder
+
+
+def random_fitness(genomes, config):
+    for _, genome in genomes:
+        genome.fitness = random.random()
+
+
+def evolve(population: neat.Population, checkpoint_path: str, model_path: str, n: int):
+    recorder = MostRecentHistoryRecorder(checkpoint_path, model_path)
+    population.add_reporter(recorder)
+    population.run(random_fitness, n=n)
+    recorder.writer.flush()
+
+
+def test_resumed_population_evolves(tmp_path):
+    checkpoint_path, model_path = str(tmp_path / "checkpoint"), str(tmp_path / "model")
+    random.seed(0)
+    evolve(
+        neat.Population(get_default_config("seek.ini")),
+        checkpoint_path,
+        model_path,
+        10,
+    )
+
+    restored = MostRecentHistoryRecorder.restore_generation(checkpoint_path)
+    # new nodes of a resumed run must not reuse the keys of nodes evolved before it
+    node_keys = [key for genome in restored.population.values() for key in genome.nodes]
+    assert restored.config.genome_config.get_new_node_key({}) > max(node_keys)
+    generation = restored.generation
+    evolve(restored, checkpoint_path, model_path, 10)
+    resumed = MostRecentHistoryRecorder.restore_generation(checkpoint_path)
+    assert resumed.generation == generation + 9
+
+
+def test_checkpoint_directory_is_complete(tmp_path):
+    # a run that died before its first checkpoint leaves no directory to restore from
+    checkpoint_path = str(tmp_path / "checkpoint")
+    (tmp_path / "checkpoint.tmp").mkdir()
+    (tmp_path / "checkpoint.tmp" / "config").write_bytes(b"")
+    evolve(
+        neat.Population(get_default_config("seek.ini")),
+        checkpoint_path,
+        str(tmp_path / "model"),
+        1,
+    )
+    assert not (tmp_path / "checkpoint.tmp").exists()
+    assert MostRecentHistoryRecorder.restore_generation(checkpoint_path).generation == 0
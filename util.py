@@ -33,6 +33,17 @@ def get_beeline_orientation(vector: np.ndarray):
     return math.atan2(vector[1], vector[0])
 
 
+# batched counterparts of the above, math per value so the results match them exactly
+def get_unit_vectors(angles: np.ndarray):
+    return np.array(
+        [[math.cos(angle), math.sin(angle)] for angle in angles.tolist()]
+    ).reshape(-1, 2)
+
+
+def get_beeline_orientations(vectors: np.ndarray):
+    return np.array([math.atan2(y, x) for x, y in vectors.tolist()])
+
+
 def get_euclidean_dist(point1: np.ndarray, point2: np.ndarray):
     return math.sqrt(np.sum((point1 - point2) ** 2))
 
@@ -42,13 +53,61 @@ def can_circles_intersect(a: Circle, b: Circle):
     return dist <= (a.radius + b.radius)
 
 
-def get_random_within_range(max: float, min: float):
+def get_segments_dist(
+    p_start: np.ndarray, p_end: np.ndarray, q_start: np.ndarray, q_end: np.ndarray
+):
+    # closest distance between segments p and q, broadcast over leading dimensions
+    p_dir, q_dir, offset = p_end - p_start, q_end - q_start, p_start - q_start
+    a = np.sum(p_dir * p_dir, axis=-1)
+    b = np.sum(p_dir * q_dir, axis=-1)
+    c = np.sum(p_dir * offset, axis=-1)
+    e = np.sum(q_dir * q_dir, axis=-1)
+    f = np.sum(q_dir * offset, axis=-1)
+    is_p_point, is_q_point = a <= 1e-12, e <= 1e-12
+    safe_a, safe_e = np.where(is_p_point, 1, a), np.where(is_q_point, 1, e)
+    denom = a * e - b * b
+    s = np.where(denom > 1e-12, (b * f - c * e) / np.where(denom > 1e-12, denom, 1), 0)
+    s = np.where(is_q_point, -c / safe_a, s)
+    s = np.where(is_p_point, 0, np.clip(s, 0, 1))
+    t = np.where(is_q_point, 0, (b * s + f) / safe_e)
+    # re-project onto p whenever t had to be clamped to q's ends
+    s = np.where(~is_p_point & (t < 0), np.clip(-c / safe_a, 0, 1), s)
+    s = np.where(~is_p_point & (t > 1), np.clip((b - c) / safe_a, 0, 1), s)
+    t = np.clip(t, 0, 1)
+    closest = (p_start + p_dir * s[..., None]) - (q_start + q_dir * t[..., None])
+    return np.sqrt(np.sum(closest**2, axis=-1))
+
+
+def can_swept_circles_intersect(
+    a_start: np.ndarray,
+    a_end: np.ndarray,
+    b_start: np.ndarray,
+    b_end: np.ndarray,
+    radius: float,
+):
+    # conservative continuous test, true if circles sweeping along both segments can touch
+    return get_segments_dist(a_start, a_end, b_start, b_end) <= radius + 1e-6
+
+
+# draws from the global random module unless a NumPy Generator is passed in
+def get_random_within_range(
+    max: float, min: float, rng: np.random.Generator | None = None
+):
     range = max - min
-    return random.random() * range + min
-
-
-def get_random_point(x_max: float, y_max: float, x_min: float = 0, y_min: float = 0):
-    return get_random_within_range(x_max, x_min), get_random_within_range(y_max, y_min)
+    sample = random.random() if rng is None else rng.random()
+    return sample * range + min
+
+
+def get_random_point(
+    x_max: float,
+    y_max: float,
+    x_min: float = 0,
+    y_min: float = 0,
+    rng: np.random.Generator | None = None,
+):
+    return get_random_within_range(x_max, x_min, rng), get_random_within_range(
+        y_max, y_min, rng
+    )
 
 
 def get_fscore(tp, fp, fn):